@@ -1,5 +1,10 @@
 from .conv_acc import ConvAccelerator
-from .mesh_soc import MeshSoC 
+from .mesh_soc import MeshSoC
+from .routing import RoutingBase, XYRouting, TorusRouting, ShortestPathRouting
 from .nvdla import NVDLA, GemmNVDLA
 from .shidiannao import DepthwiseShiDianNao, ConvShiDianNao
-from .tpu import GemmTPU
\ No newline at end of file
+from .tpu import GemmTPU
+from .analytical import calibrate
+from .dataflow import Dataflow, Sz, SpatialMap, TemporalMap, Cluster
+from .tuner import DataflowTuner
+from .dse import HardwareDSE, ParetoFrontier, design_space, compute_area
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+from typing import Dict, Any, List, Tuple
+from ..base import AcceleratorBase
+
+# relative power of one active PE, the absolute scale comes from calibrate
+PE_POWER = 1e-3
+
+
+def ceil_div(a, b):
+    return (a + b - 1) // b
+
+
+def roofline(compute_cycles, traffic, hardware: Dict[str, Any], fill_cycles: int = 0):
+    """
+    Runtime cycles bounded by the PE array and by moving the traffic
+    over the NoC and the off-chip link. The bandwidths are in
+    elements per cycle, the same units given to MAESTRO.
+    """
+    return max(compute_cycles,
+               traffic / hardware["noc_bw"],
+               traffic / hardware["off_chip_bw"]) + fill_cycles
+
+
+def refetch_factor(working_set, folds, hardware: Dict[str, Any]):
+    """
+    Inputs stay in L2 when the working set fits,
+    otherwise they are fetched again for each outer fold
+    """
+    return 1 if working_set <= hardware["l2_size"] else folds
+
+
+def channel_parallel_conv(hardware: Dict[str, Any], cluster: int, H, W, P, Q, K, C, R, S, stride_h, stride_w):
+    """
+    K is spatially mapped on the clusters, C on the PEs of a cluster
+    (NVDLA and TPU style): SpatialMap K; Cluster(cluster); SpatialMap C
+    """
+    num_clusters = max(hardware["num_pes"] // cluster, 1)
+    folds = ceil_div(K, num_clusters)
+    compute = folds * ceil_div(C, cluster) * P * Q * R * S
+    inputs, weights, outputs = H * W * C, K * C * R * S, P * Q * K
+    traffic = inputs * refetch_factor(inputs + weights + outputs, folds, hardware) + weights + outputs
+    used_pes = min(K * cluster, hardware["num_pes"])
+    return roofline(compute, traffic, hardware, cluster), used_pes * PE_POWER
+
+
+def output_parallel_conv(hardware: Dict[str, Any], cluster: int, H, W, P, Q, K, C, R, S, stride_h, stride_w):
+    """
+    Output rows are spatially mapped on the clusters, output columns
+    on the PEs of a cluster (ShiDianNao style), channels are temporal
+    """
+    num_clusters = max(hardware["num_pes"] // cluster, 1)
+    folds = ceil_div(P, num_clusters)
+    compute = folds * ceil_div(Q, cluster) * K * C * R * S
+    inputs, weights, outputs = H * W * C, K * C * R * S, P * Q * K
+    traffic = weights * refetch_factor(inputs + weights + outputs, folds, hardware) + inputs + outputs
+    used_pes = min(H * cluster, hardware["num_pes"])
+    return roofline(compute, traffic, hardware, cluster), used_pes * PE_POWER
+
+
+def output_parallel_depthwise(hardware: Dict[str, Any], cluster: int, H, W, P, Q, K, M, R, S, stride_h, stride_w):
+    """
+    Same as output_parallel_conv, K is the channel and M the multiplier
+    """
+    num_clusters = max(hardware["num_pes"] // cluster, 1)
+    folds = ceil_div(P, num_clusters)
+    compute = folds * ceil_div(Q, cluster) * K * M * R * S
+    inputs, weights, outputs = H * W * K, K * M * R * S, P * Q * K * M
+    traffic = weights * refetch_factor(inputs + weights + outputs, folds, hardware) + inputs + outputs
+    used_pes = min(H * cluster, hardware["num_pes"])
+    return roofline(compute, traffic, hardware, cluster), used_pes * PE_POWER
+
+
+def gemm(hardware: Dict[str, Any], cluster: int, outer: int, inner: int, temporal: int, M, N, K):
+    """
+    outer is spatially mapped on the clusters, inner on the PEs
+    of a cluster and temporal is iterated
+    """
+    num_clusters = max(hardware["num_pes"] // cluster, 1)
+    folds = ceil_div(outer, num_clusters)
+    compute = folds * ceil_div(inner, cluster) * temporal
+    a, b, c = M * K, K * N, M * N
+    traffic = a * refetch_factor(a + b + c, folds, hardware) + b + c
+    used_pes = min(outer * cluster, hardware["num_pes"])
+    return roofline(compute, traffic, hardware, cluster), used_pes * PE_POWER
+
+
+def calibrate(accelerators: List[AcceleratorBase], records: List[Dict[str, Any]] = None):
+    """
+    Fit the runtime and power scale of the analytical model of each
+    accelerator type and task kind against MAESTRO results, by default
+    the ones in the persistent evaluation cache.
+    The geometric mean of the ratios is used, it is stored in
+    AcceleratorBase.calibration and returned.
+    """
+    if records is None:
+        assert AcceleratorBase.eval_cache is not None, "No evaluation cache loaded"
+        records = AcceleratorBase.eval_cache.records()
+    types = {type(acc).__name__: type(acc) for acc in accelerators}
+    ratios = {}
+    for record in records:
+        acc_type = types.get(record["accelerator"], None)
+        if acc_type is None or record["hardware"] is None:
+            continue
+        runtime, power = acc_type.analytical_cost(record["hardware"], *record["args"])
+        if runtime <= 0 or power <= 0 or record["runtime"] <= 0 or record["power"] <= 0:
+            continue
+        key = (record["accelerator"], record["kind"])
+        ratios.setdefault(key, []).append(
+            (math.log(record["runtime"] / runtime), math.log(record["power"] / power)))
+    ret = {}
+    for key, values in ratios.items():
+        values = np.array(values)
+        ret[key] = tuple(float(x) for x in np.exp(values.mean(axis=0)))
+    AcceleratorBase.calibration.update(ret)
+    return ret
@@ -3,7 +3,6 @@ import copy
 from typing import Dict, Any
 from collections import OrderedDict
 from ..base import AcceleratorBase, AccTask
-from ..utils import run_maestro, generate_maestro_command, find_maestro
 from .. import global_timer
 
 class ConvAccelerator(AcceleratorBase):
@@ -15,34 +14,6 @@ class ConvAccelerator(AcceleratorBase):
         assert task.task_kind == "Conv2d"
         super(ConvAccelerator, self).push_task_to_stream(idx, task)
 
-    def evaluate_compute(self, *args):
-        key = ("conv", args)
-        if key not in AcceleratorBase.compute_cache:
-            H, W, P, Q, K, C, R, S, stride_h, stride_w = args
-            mapping_contents = self.get_mapping(
-                H, W, P, Q, K, C, R, S, stride_h, stride_w)
-            mapping_file = "conv_sample_mapping"
-
-            if os.path.exists(f"{mapping_file}.m") and os.path.isfile(f"{mapping_file}.m"):
-                os.remove(f"{mapping_file}.m")
-            with open(f"{mapping_file}.m", "w") as fout:
-                fout.write(mapping_contents)
-
-            maestro_path = find_maestro()
-            command = generate_maestro_command(
-                maestro_path,
-                mapping_file,
-                self.noc_bw,
-                self.off_chip_bw,  # off_chip_bw,
-                self.num_pes,  # num_pes,
-                self.l1_size,  # l1_size,
-                self.l2_size,  # l2_size,
-            )
-
-            results = run_maestro(mapping_file, command)
-
-            if os.path.exists(f"{mapping_file}.m") and os.path.isfile(f"{mapping_file}.m"):
-                os.remove(f"{mapping_file}.m")
-            AcceleratorBase.compute_cache[key] = (results.runtime[0] / self.freq, results.power[0])
-        ret = AcceleratorBase.compute_cache[key]
-        return ret
+    def compute_request(self, *args):
+        H, W, P, Q, K, C, R, S, stride_h, stride_w = args
+        return "conv", args, 1
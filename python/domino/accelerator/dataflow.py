@@ -0,0 +1,218 @@
+import hashlib
+from collections import namedtuple
+from typing import Dict, List, Tuple, Union
+
+
+class Sz(namedtuple("Sz", ["dim"])):
+    """
+    The size of a dimension, Sz(R) in MAESTRO
+    """
+
+    def render(self) -> str:
+        return f"Sz({self.dim})"
+
+
+def _render_size(size: Union[int, Sz]) -> str:
+    return size.render() if isinstance(size, Sz) else str(size)
+
+
+class SpatialMap(namedtuple("SpatialMap", ["size", "offset", "dim"])):
+    def render(self) -> str:
+        return f"SpatialMap({_render_size(self.size)},{_render_size(self.offset)}) {self.dim};"
+
+
+class TemporalMap(namedtuple("TemporalMap", ["size", "offset", "dim"])):
+    def render(self) -> str:
+        return f"TemporalMap({_render_size(self.size)},{_render_size(self.offset)}) {self.dim};"
+
+
+class Cluster(namedtuple("Cluster", ["size", "kind"])):
+    def __new__(cls, size, kind="P"):
+        return super(Cluster, cls).__new__(cls, size, kind)
+
+    def render(self) -> str:
+        return f"Cluster({_render_size(self.size)},{self.kind});"
+
+
+Directive = Union[SpatialMap, TemporalMap, Cluster]
+
+LAYER_NAMES = {"CONV": "Conv2d", "DSCONV": "DepthwiseConv2d", "GEMM": "GEMM"}
+# the order of the dimensions in the rendered mapping
+DIM_ORDER = "KCRSYXMN"
+
+
+class Dataflow(object):
+    """
+    A single-layer MAESTRO mapping: the layer dimensions and
+    the SpatialMap/TemporalMap/Cluster directives.
+    Equivalent mappings have the same canonical form, which is
+    what gets hashed and rendered for MAESTRO.
+    """
+
+    def __init__(self, layer_type: str, dimensions: Dict[str, int], directives: List[Directive],
+                 stride: Dict[str, int] = None) -> None:
+        assert layer_type in LAYER_NAMES, f"Unknown layer type {layer_type}"
+        self.layer_type = layer_type
+        self.dimensions = dict(dimensions)
+        self.directives = list(directives)
+        self.stride = None if stride is None else dict(stride)
+        self._canonical = None
+
+    @staticmethod
+    def conv2d(H, W, K, C, R, S, stride_h, stride_w, directives: List[Directive]) -> "Dataflow":
+        return Dataflow("CONV", {"K": K, "C": C, "R": R, "S": S, "Y": H, "X": W}, directives,
+                        stride={"X": stride_h, "Y": stride_w})
+
+    @staticmethod
+    def depthwise_conv2d(H, W, K, M, R, S, stride_h, stride_w, directives: List[Directive]) -> "Dataflow":
+        return Dataflow("DSCONV", {"K": M, "C": K, "R": R, "S": S, "Y": H, "X": W}, directives,
+                        stride={"X": stride_h, "Y": stride_w})
+
+    @staticmethod
+    def gemm(M, N, K, directives: List[Directive]) -> "Dataflow":
+        return Dataflow("GEMM", {"K": K, "M": M, "N": N}, directives)
+
+    def _resolve(self, size: Union[int, Sz]) -> int:
+        return self.dimensions[size.dim] if isinstance(size, Sz) else size
+
+    def canonical(self) -> "Dataflow":
+        """
+        Return the normal form:
+        Sz() is replaced by the dimension sizes, tiles larger than
+        their dimension are clamped, a tile covering the whole
+        dimension gets the dimension as offset, and the temporal
+        maps that cover their whole dimension (single-step loops)
+        are moved to the end of their cluster level in dimension order.
+        """
+        if self._canonical is not None:
+            return self._canonical
+        directives = []
+        level, full = [], []
+        for directive in self.directives + [None]:
+            if directive is None or isinstance(directive, Cluster):
+                directives += level + sorted(full, key=lambda d: DIM_ORDER.index(d.dim))
+                level, full = [], []
+                if directive is not None:
+                    directives.append(Cluster(self._resolve(directive.size), directive.kind))
+                continue
+            dim_size = self.dimensions[directive.dim]
+            size = min(self._resolve(directive.size), dim_size)
+            offset = dim_size if size == dim_size else self._resolve(directive.offset)
+            directive = type(directive)(size, offset, directive.dim)
+            if isinstance(directive, TemporalMap) and size == dim_size:
+                full.append(directive)
+            else:
+                level.append(directive)
+        dimensions = {dim: self.dimensions[dim] for dim in sorted(self.dimensions, key=DIM_ORDER.index)}
+        stride = None if self.stride is None else dict(sorted(self.stride.items()))
+        ret = Dataflow(self.layer_type, dimensions, directives, stride=stride)
+        ret._canonical = ret
+        self._canonical = ret
+        return ret
+
+    def key(self) -> Tuple:
+        canonical = self.canonical()
+        return (canonical.layer_type,
+                None if canonical.stride is None else tuple(canonical.stride.items()),
+                tuple(canonical.dimensions.items()),
+                tuple((type(d).__name__, *d) for d in canonical.directives))
+
+    def digest(self) -> str:
+        return hashlib.sha256(repr(self.key()).encode()).hexdigest()
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Dataflow) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def render(self, network_name: str = "sample_net") -> str:
+        """
+        Render the MAESTRO mapping file
+        """
+        lines = [f"Network {network_name} {{",
+                 f"Layer {LAYER_NAMES[self.layer_type]} {{",
+                 f"Type: {self.layer_type}"]
+        if self.stride is not None:
+            lines.append("Stride { " + ", ".join(f"{k}: {v}" for k, v in self.stride.items()) + " }")
+        lines.append("Dimensions { " + ", ".join(f"{k}: {v}" for k, v in self.dimensions.items()) + " }")
+        lines.append("Dataflow {")
+        lines += ["        " + directive.render() for directive in self.directives]
+        lines += ["}", "}", "}"]
+        return "\n".join(lines) + "\n"
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def __repr__(self) -> str:
+        return f"Dataflow({self.layer_type}, {self.dimensions}, {self.directives})"
+
+
+def channel_parallel_conv_directives(cluster: int) -> List[Directive]:
+    """
+    Output channels across clusters, input channels inside (NVDLA, TPU)
+    """
+    return [SpatialMap(1, 1, "K"),
+            TemporalMap(cluster, cluster, "C"),
+            TemporalMap(Sz("R"), Sz("R"), "R"),
+            TemporalMap(Sz("S"), Sz("S"), "S"),
+            TemporalMap(Sz("R"), 1, "Y"),
+            TemporalMap(Sz("S"), 1, "X"),
+            Cluster(cluster),
+            SpatialMap(1, 1, "C"),
+            TemporalMap(Sz("R"), 1, "Y"),
+            TemporalMap(Sz("S"), 1, "X"),
+            TemporalMap(Sz("R"), Sz("R"), "R"),
+            TemporalMap(Sz("S"), Sz("S"), "S")]
+
+
+def output_parallel_conv_directives(cluster: int) -> List[Directive]:
+    """
+    Output rows across clusters, output columns inside (ShiDianNao)
+    """
+    return [TemporalMap(1, 1, "K"),
+            TemporalMap(1, 1, "C"),
+            SpatialMap(Sz("R"), 1, "Y"),
+            TemporalMap(cluster, cluster, "X"),
+            TemporalMap(Sz("R"), Sz("R"), "R"),
+            TemporalMap(Sz("S"), Sz("S"), "S"),
+            Cluster(cluster),
+            SpatialMap(Sz("S"), 1, "X")]
+
+
+def output_parallel_depthwise_directives(cluster: int) -> List[Directive]:
+    """
+    Depthwise version of output_parallel_conv_directives
+    """
+    return [TemporalMap(1, 1, "C"),
+            SpatialMap(Sz("R"), 1, "Y"),
+            TemporalMap(cluster, cluster, "X"),
+            TemporalMap(Sz("R"), Sz("R"), "R"),
+            TemporalMap(Sz("S"), Sz("S"), "S"),
+            Cluster(cluster),
+            SpatialMap(Sz("S"), 1, "X")]
+
+
+def systolic_gemm_directives(cluster: int, tile: int = 16) -> List[Directive]:
+    """
+    Rows of M across clusters, N inside, K in tiles (TPU)
+    """
+    return [SpatialMap(1, 1, "M"),
+            TemporalMap(cluster, cluster, "N"),
+            TemporalMap(tile, tile, "K"),
+            Cluster(cluster),
+            SpatialMap(1, 1, "N"),
+            TemporalMap(1, 1, "M"),
+            TemporalMap(tile, tile, "K")]
+
+
+def cluster_sizes(num_pes: int, smallest: int = 8, largest: int = 1024) -> List[int]:
+    """
+    The power-of-two cluster sizes that fit in num_pes PEs
+    """
+    ret = []
+    size = smallest
+    while size <= min(num_pes, largest):
+        ret.append(size)
+        size *= 2
+    return ret
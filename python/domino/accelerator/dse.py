@@ -0,0 +1,215 @@
+import itertools
+import numpy as np
+from typing import Dict, Any, List, Sequence, Tuple
+from ..base import AccTask
+from .analytical import PE_POWER
+
+ALPHA = 2.3141918
+# um^2 of one MAC by "<min(input, weight) bits><max(input, weight) bits><output bits>"
+MAC_AREA = {
+    "444": 282 / ALPHA / ALPHA / ALPHA,
+    "448": 282 / ALPHA / ALPHA,
+    "484": 282 / ALPHA / ALPHA,
+    "488": 282 / ALPHA,
+    "884": 282 / ALPHA,
+    "888": 282,
+}
+# energy of one MAC relative to "888", scaled like its area
+MAC_ENERGY = {precision: area / MAC_AREA["888"] for precision, area in MAC_AREA.items()}
+BUF_AREA_PER_BIT = 0.086
+DESIGN_PARAMS = ["num_pes", "l1_size", "l2_size", "noc_bw", "precision"]
+
+
+def compute_area(num_pes, l1_size, l2_size, precision):
+    """
+    Return the area (um^2) of the PEs and buffers, the params
+    can be scalars or arrays of the same shape
+    """
+    if isinstance(precision, str):
+        mac_area = MAC_AREA[precision]
+    else:
+        mac_area = np.array([MAC_AREA[p] for p in np.asarray(precision).reshape(-1)]).reshape(np.shape(precision))
+    num_pes = np.asarray(num_pes, dtype=np.float64)
+    buf_size = np.asarray(l1_size, dtype=np.float64) * num_pes + np.asarray(l2_size, dtype=np.float64)
+    area = num_pes * mac_area + buf_size * BUF_AREA_PER_BIT * 8
+    return area if np.ndim(area) else float(area)
+
+
+def design_space(**params: Sequence) -> Dict[str, np.ndarray]:
+    """
+    The cartesian product of the candidate values of DESIGN_PARAMS,
+    returned as one column per param
+    """
+    assert set(params) <= set(DESIGN_PARAMS), f"Unknown params {set(params) - set(DESIGN_PARAMS)}"
+    names = list(params)
+    points = list(itertools.product(*[params[name] for name in names]))
+    return {name: np.array([point[i] for point in points]) for i, name in enumerate(names)}
+
+
+class ParetoFrontier(object):
+    """
+    The non-dominated points seen so far, every objective is minimized
+    """
+
+    def __init__(self, num_objectives: int) -> None:
+        self.objectives = np.zeros((0, num_objectives))
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def dominated(self, objectives: np.ndarray, strict: bool = False) -> bool:
+        """
+        Whether a frontier point is at least as good in every objective
+        (and better in one with strict)
+        """
+        if not len(self.ids):
+            return False
+        no_worse = (self.objectives <= objectives).all(axis=1)
+        if strict:
+            no_worse &= (self.objectives < objectives).any(axis=1)
+        return bool(no_worse.any())
+
+    def add(self, point_id, objectives: Sequence[float]) -> bool:
+        """
+        Insert a point, the points it dominates are removed.
+        Return False if it is dominated.
+        """
+        objectives = np.asarray(objectives, dtype=np.float64)
+        if self.dominated(objectives):
+            return False
+        keep = ~(objectives <= self.objectives).all(axis=1)
+        self.objectives = np.concatenate([self.objectives[keep], objectives[None, :]])
+        self.ids = [i for i, k in zip(self.ids, keep) if k] + [point_id]
+        return True
+
+
+class HardwareDSE(object):
+    """
+    Explore the hardware params of one accelerator type on a workload.
+    The points are visited by increasing area. Before evaluating a
+    point, its area and a latency lower bound (every MAC on every PE
+    at full utilization) are checked against the frontier, dominated
+    points are skipped. The unique shapes of the workload are evaluated
+    with the cached and batched evaluator of the accelerator, latency and
+    energy are reduced over the shapes for a whole chunk of points at once.
+    The objectives are latency (s), area (um^2) and energy (runtime x power
+    scaled by the MAC_ENERGY of the precision). The energy lower bound is
+    every MAC at mac_energy, by default the analytical energy of one PE cycle,
+    with the other cost models energy doesn't prune unless mac_energy is given.
+    """
+
+    def __init__(self, acc_type: type, tasks: List[AccTask], objectives: Tuple[str] = ("latency", "area", "energy"),
+                 chunk_size: int = 16, prune: bool = True, mac_energy: float = None, **acc_kwargs) -> None:
+        assert set(objectives) <= {"latency", "area", "energy"}
+        self.acc_type = acc_type
+        self.objectives = list(objectives)
+        self.chunk_size = chunk_size
+        self.prune = prune
+        self.mac_energy = mac_energy
+        self.acc_kwargs = acc_kwargs
+        # unique compute requests and how many tasks need them
+        probe = acc_type("dse_probe", **acc_kwargs)
+        shapes = {}
+        for task in tasks:
+            if task.task_kind not in probe.supported_task:
+                continue
+            params = task.get_params()
+            shapes[(task.task_kind, params)] = shapes.get((task.task_kind, params), 0) + 1
+        assert len(shapes), "No task is supported by the accelerator"
+        self.shapes = list(shapes.keys())
+        self.counts = np.array(list(shapes.values()), dtype=np.float64)
+        self.tasks = [AccTask(f"dse_{i}", kind, dict(zip(self._param_names(kind), params)))
+                      for i, (kind, params) in enumerate(self.shapes)]
+        self.macs = float(sum(count * self._macs(kind, params) for (kind, params), count in zip(self.shapes, self.counts)))
+        self.frontier = ParetoFrontier(len(self.objectives))
+        self.results = []
+        self.num_pruned = 0
+
+    @staticmethod
+    def _param_names(kind):
+        if kind == "Conv2d":
+            return ["H", "W", "P", "Q", "K", "C", "R", "S", "stride_h", "stride_w"]
+        elif kind == "Depthwise":
+            return ["H", "W", "P", "Q", "K", "M", "R", "S", "stride_h", "stride_w"]
+        elif kind == "Gemm":
+            return ["B", "M", "N", "K"]
+        raise NotImplementedError()
+
+    @staticmethod
+    def _macs(kind, params):
+        if kind == "Conv2d":
+            H, W, P, Q, K, C, R, S, _, _ = params
+            return P * Q * K * C * R * S
+        elif kind == "Depthwise":
+            H, W, P, Q, K, M, R, S, _, _ = params
+            return P * Q * K * M * R * S
+        elif kind == "Gemm":
+            B, M, N, K = params
+            return B * M * N * K
+        raise NotImplementedError()
+
+    def _make_acc(self, point: Dict[str, Any], idx: int):
+        kwargs = dict(self.acc_kwargs)
+        kwargs.update({k: v for k, v in point.items() if k != "precision"})
+        return self.acc_type(f"dse_{idx}", **kwargs)
+
+    def _mac_energy(self, acc) -> float:
+        """
+        Lower bound of the "888" energy of one MAC on acc
+        """
+        if self.mac_energy is not None:
+            return self.mac_energy
+        if acc.get_cost_model() != "analytical":
+            return 0.0
+        # a PE does at most one MAC per cycle at PE_POWER
+        kinds = {acc.compute_request(*params)[0] for _, params in self.shapes}
+        return min(float(np.prod(acc.calibrated(kind, 1, PE_POWER))) for kind in kinds)
+
+    def _objectives(self, latency, area, energy):
+        values = {"latency": latency, "area": area, "energy": energy}
+        return np.stack([np.asarray(values[name], dtype=np.float64) for name in self.objectives], axis=-1)
+
+    def explore(self, space: Dict[str, np.ndarray], pool=None):
+        """
+        Explore the points of space (see design_space), return the
+        frontier as a list of (point, objectives dict) sorted by latency
+        """
+        num_points = len(next(iter(space.values())))
+        default = self.acc_type("dse_default", **self.acc_kwargs)
+        columns = {name: np.asarray(space.get(name, np.full(num_points, getattr(default, name, None))))
+                   for name in DESIGN_PARAMS if name != "precision"}
+        precision = np.asarray(space.get("precision", np.full(num_points, "888")))
+        area = compute_area(columns["num_pes"], columns["l1_size"], columns["l2_size"], precision)
+        freq = default.freq
+        latency_bound = self.macs / (columns["num_pes"].astype(np.float64) * freq)
+        mac_energy = np.array([MAC_ENERGY[p] for p in precision])
+        energy_bound = self.macs * self._mac_energy(default) * mac_energy
+        bounds = self._objectives(latency_bound, area, energy_bound)
+        order = np.lexsort((latency_bound, area))
+
+        for start in range(0, num_points, self.chunk_size):
+            chunk = [idx for idx in order[start:start + self.chunk_size]
+                     if not (self.prune and self.frontier.dominated(bounds[idx]))]
+            self.num_pruned += min(self.chunk_size, num_points - start) - len(chunk)
+            if not len(chunk):
+                continue
+            runtimes = np.zeros((len(chunk), len(self.shapes)))
+            powers = np.zeros((len(chunk), len(self.shapes)))
+            for row, idx in enumerate(chunk):
+                point = {name: column[idx].item() for name, column in columns.items()}
+                acc = self._make_acc(point, idx)
+                acc.prefetch(self.tasks, pool)
+                for col, task in enumerate(self.tasks):
+                    runtimes[row, col], powers[row, col] = acc.evaluate_compute(*task.get_params())
+            latency = runtimes @ self.counts
+            energy = (runtimes * powers) @ self.counts * mac_energy[chunk]
+            objectives = self._objectives(latency, area[chunk], energy)
+            for row, idx in enumerate(chunk):
+                point = {name: column[idx].item() for name, column in columns.items()}
+                point["precision"] = str(precision[idx])
+                values = dict(zip(self.objectives, objectives[row].tolist()))
+                self.results.append((point, values))
+                self.frontier.add(len(self.results) - 1, objectives[row])
+        ret = [self.results[i] for i in self.frontier.ids]
+        return sorted(ret, key=lambda x: x[1].get("latency", 0))
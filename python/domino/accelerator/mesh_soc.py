@@ -1,11 +1,21 @@
 from ..base import SoCBase, AcceleratorBase
 import networkx as nx
-from typing import List
+import numpy as np
+from typing import List, Union
+from .routing import RoutingBase, ROUTINGS
 
 
 class MeshSoC(SoCBase):
     # TODO: OFFCHIP HIGH 120, LOW 60
-    def __init__(self, accelerator_matrix: List[List[AcceleratorBase]], on_chip_bw=32, off_chip_nearest_bw=3.2, name = 'MeshSoC') -> None:
+    def __init__(self, accelerator_matrix: List[List[AcceleratorBase]], on_chip_bw=32, off_chip_nearest_bw=3.2, name = 'MeshSoC', event_driven: bool = False,
+                 routing: Union[str, RoutingBase] = 'xy', hop_latency: float = 0, contention: bool = False) -> None:
+        """
+        routing is 'xy', 'torus', 'shortest_path' or a RoutingBase instance,
+        the bandwidth between two accelerators is off_chip_nearest_bw divided
+        by the hop count, each hop adds hop_latency seconds.
+        With contention, transfers share the off_chip_nearest_bw of every
+        link on their route.
+        """
         accelerator_graph = nx.DiGraph()
         self.on_chip_bw = on_chip_bw
         self.off_chip_nearest_bw = off_chip_nearest_bw
@@ -14,25 +24,31 @@ class MeshSoC(SoCBase):
         num_cols = len(accelerator_matrix[0])
         for row in accelerator_matrix:
             assert len(row) == num_cols
+        if isinstance(routing, str):
+            assert routing in ROUTINGS, f"Unknown routing {routing}"
+            routing = ROUTINGS[routing](num_rows, num_cols)
+        assert (routing.num_rows, routing.num_cols) == (num_rows, num_cols)
+        self.routing = routing
 
+        # accelerators are added row-major, the same index as the routing
         visited = set()
+        names = []
         for i in range(num_rows):
             for j in range(num_cols):
                 acc = accelerator_matrix[i][j]
                 acc.topo_id = (i,j)
                 assert acc.name not in visited, "Please use unique name for each accelerator instance"
+                visited.add(acc.name)
                 accelerator_graph.add_node(acc.name, acc=acc)
-        for i in range(num_rows):
-            for j in range(num_cols):
-                for u in range(num_rows):
-                    for v in range(num_cols):
-                        acc_1 = accelerator_matrix[i][j]
-                        acc_2 = accelerator_matrix[u][v]
-                        distance = abs(u - i) + abs(v - j)
-                        if distance == 0:
-                            accelerator_graph.add_edge(
-                                acc_1.name, acc_2.name, bandwidth=self.on_chip_bw)
-                        else:
-                            accelerator_graph.add_edge(
-                                acc_1.name, acc_2.name, bandwidth=self.off_chip_nearest_bw / distance)
-        super(MeshSoC, self).__init__(accelerator_graph, name=name)
+                names.append(acc.name)
+        # only the physical links are kept in the graph
+        for src, dst in routing.links():
+            accelerator_graph.add_edge(names[src], names[dst], bandwidth=self.off_chip_nearest_bw)
+
+        hops = routing.hop_matrix()
+        bandwidth = np.full(hops.shape, float(self.on_chip_bw))
+        remote = hops > 0
+        bandwidth[remote] = self.off_chip_nearest_bw / hops[remote]
+        super(MeshSoC, self).__init__(accelerator_graph, name=name, event_driven=event_driven,
+                                      bandwidth=bandwidth, hops=hops, latency=hops * hop_latency,
+                                      contention=contention, routes=routing.route)
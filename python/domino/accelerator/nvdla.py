@@ -4,6 +4,8 @@ from typing import Dict, Any
 from collections import OrderedDict
 from ..base import AcceleratorBase, AccTask
 from ..utils import run_maestro, generate_maestro_command, find_maestro
+from .dataflow import Dataflow, SpatialMap, TemporalMap, Cluster, channel_parallel_conv_directives, cluster_sizes
+from .analytical import channel_parallel_conv, gemm
 from .conv_acc import ConvAccelerator
 from .gemm_acc import GemmAccelerator
 
@@ -13,41 +15,22 @@ class NVDLA(ConvAccelerator):
         super(NVDLA, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                     off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
-        mapping = ("Network sample_net {\n"
-                   "Layer Conv2d {\n"
-                   "Type: CONV\n"
-                   "Stride { "
-                   f"X: {stride_h}, Y: {stride_w} "
-                   "}\n"
-                   "Dimensions { "
-                   f"K: {K}, C: {C}, R: {R}, S: {S}, Y: {H}, X: {W} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        SpatialMap(1,1) K;\n"
-                   "        TemporalMap(64,64) C;\n"
-                   "        TemporalMap(Sz(R),Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S),Sz(S)) S;\n"
-                   "        TemporalMap(Sz(R),1) Y;\n"
-                   "        TemporalMap(Sz(S),1) X;\n"
-                   "        Cluster(64, P);\n"
-                   "        SpatialMap(1,1) C;\n"
-                   "        TemporalMap(Sz(R),1) Y;\n"
-                   "        TemporalMap(Sz(S),1) X;\n"
-                   "        TemporalMap(Sz(R),Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S),Sz(S)) S;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+    def get_dataflow(self, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=64):
+        return Dataflow.conv2d(H, W, K, C, R, S, stride_h, stride_w, channel_parallel_conv_directives(cluster))
+
+    @staticmethod
+    def analytical_cost(hardware, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=64):
+        return channel_parallel_conv(hardware, cluster, H, W, P, Q, K, C, R, S, stride_h, stride_w)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes)}
 
     def spatial_used_pes(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(K * 64, self.num_pes)
+        return min(K * self.tuned_params(H, W, P, Q, K, C, R, S, stride_h, stride_w).get("cluster", 64), self.num_pes)
 
     def __str__(self) -> str:
         return f'NVDLA{self.topo_id}'
@@ -61,34 +44,31 @@ class GemmNVDLA(GemmAccelerator):
         super(GemmNVDLA, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                         off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, M, N, K):
+    def get_dataflow(self, M, N, K, cluster=64):
         # N * 64
-        mapping = ("Network sample_net {\n"
-                   "Layer GEMM {\n"
-                   "Type: GEMM\n"
-                   "Dimensions { "
-                   f"K: {K}, M: {M}, N: {N} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        SpatialMap(1, 1) N;\n"
-                   "        TemporalMap(64, 64) K;\n"
-                   "        TemporalMap(1, 1) M;\n"
-                   "        Cluster(64, P);\n"
-                   "        SpatialMap(1, 1) K\n"
-                   "        TemporalMap(1, 1) M;\n"
-                   "        TemporalMap(1, 1) N;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+        return Dataflow.gemm(M, N, K, [
+            SpatialMap(1, 1, "N"),
+            TemporalMap(cluster, cluster, "K"),
+            TemporalMap(1, 1, "M"),
+            Cluster(cluster),
+            SpatialMap(1, 1, "K"),
+            TemporalMap(1, 1, "M"),
+            TemporalMap(1, 1, "N"),
+        ])
+
+    @staticmethod
+    def analytical_cost(hardware, M, N, K, cluster=64):
+        return gemm(hardware, cluster, N, K, M, M, N, K)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes)}
 
     def spatial_used_pes(self, B, M, N, K):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(N * 64, self.num_pes)
+        return min(N * self.tuned_params(B, M, N, K).get("cluster", 64), self.num_pes)
 
     def __str__(self) -> str:
         return f'GemmNVDLA{self.topo_id}'
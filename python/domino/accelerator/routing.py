@@ -0,0 +1,162 @@
+import numpy as np
+from typing import List, Tuple
+
+
+class RoutingBase(object):
+    """
+    Routing model of a 2D array of accelerators.
+    The accelerators are indexed row-major, i * num_cols + j.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int) -> None:
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+
+    def num_nodes(self):
+        return self.num_rows * self.num_cols
+
+    def coordinates(self) -> Tuple[np.ndarray, np.ndarray]:
+        idx = np.arange(self.num_nodes())
+        return idx // self.num_cols, idx % self.num_cols
+
+    def links(self) -> List[Tuple[int, int]]:
+        """
+        Return the physical links (src, dst) between neighbours
+        """
+        ret = []
+        for i in range(self.num_rows):
+            for j in range(self.num_cols):
+                src = i * self.num_cols + j
+                if i + 1 < self.num_rows:
+                    ret += [(src, src + self.num_cols), (src + self.num_cols, src)]
+                if j + 1 < self.num_cols:
+                    ret += [(src, src + 1), (src + 1, src)]
+        return ret
+
+    def hop_matrix(self) -> np.ndarray:
+        """
+        Return the hop count of every (src, dst) pair
+        """
+        raise NotImplementedError()
+
+    def route(self, src: int, dst: int) -> List[Tuple[int, int]]:
+        """
+        Return the links traversed from src to dst
+        """
+        raise NotImplementedError()
+
+
+class XYRouting(RoutingBase):
+    """
+    Dimension-ordered routing on a mesh, first along the columns then the rows
+    """
+
+    def hop_matrix(self) -> np.ndarray:
+        rows, cols = self.coordinates()
+        return (np.abs(rows[:, None] - rows[None, :]) + np.abs(cols[:, None] - cols[None, :])).astype(np.int64)
+
+    def route(self, src: int, dst: int) -> List[Tuple[int, int]]:
+        i, j = divmod(src, self.num_cols)
+        u, v = divmod(dst, self.num_cols)
+        ret = []
+        while j != v:
+            nj = j + (1 if v > j else -1)
+            ret.append((i * self.num_cols + j, i * self.num_cols + nj))
+            j = nj
+        while i != u:
+            ni = i + (1 if u > i else -1)
+            ret.append((i * self.num_cols + j, ni * self.num_cols + j))
+            i = ni
+        return ret
+
+
+class TorusRouting(RoutingBase):
+    """
+    Dimension-ordered routing with wrap-around links, the shorter direction is used
+    """
+
+    def links(self) -> List[Tuple[int, int]]:
+        ret = set(super(TorusRouting, self).links())
+        for i in range(self.num_rows):
+            first, last = i * self.num_cols, i * self.num_cols + self.num_cols - 1
+            if self.num_cols > 2:
+                ret |= {(first, last), (last, first)}
+        for j in range(self.num_cols):
+            first, last = j, (self.num_rows - 1) * self.num_cols + j
+            if self.num_rows > 2:
+                ret |= {(first, last), (last, first)}
+        return sorted(ret)
+
+    def hop_matrix(self) -> np.ndarray:
+        rows, cols = self.coordinates()
+        drow = np.abs(rows[:, None] - rows[None, :])
+        dcol = np.abs(cols[:, None] - cols[None, :])
+        return (np.minimum(drow, self.num_rows - drow) + np.minimum(dcol, self.num_cols - dcol)).astype(np.int64)
+
+    def _step(self, x, y, n):
+        forward = (y - x) % n
+        return (x + 1) % n if forward <= n - forward else (x - 1) % n
+
+    def route(self, src: int, dst: int) -> List[Tuple[int, int]]:
+        i, j = divmod(src, self.num_cols)
+        u, v = divmod(dst, self.num_cols)
+        ret = []
+        while j != v:
+            nj = self._step(j, v, self.num_cols)
+            ret.append((i * self.num_cols + j, i * self.num_cols + nj))
+            j = nj
+        while i != u:
+            ni = self._step(i, u, self.num_rows)
+            ret.append((i * self.num_cols + j, ni * self.num_cols + j))
+            i = ni
+        return ret
+
+
+class ShortestPathRouting(RoutingBase):
+    """
+    Shortest paths over an arbitrary set of links, e.g., a mesh with
+    missing or extra links. The hop matrix is computed with
+    Floyd-Warshall, ties are broken by the lower intermediate index.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int, links: List[Tuple[int, int]] = None) -> None:
+        super(ShortestPathRouting, self).__init__(num_rows, num_cols)
+        self._links = super(ShortestPathRouting, self).links() if links is None else list(links)
+        n = self.num_nodes()
+        dist = np.full((n, n), np.inf)
+        np.fill_diagonal(dist, 0)
+        nxt = np.full((n, n), -1, dtype=np.int64)
+        for src, dst in self._links:
+            dist[src, dst] = 1
+            nxt[src, dst] = dst
+        np.fill_diagonal(nxt, np.arange(n))
+        for k in range(n):
+            through = dist[:, k, None] + dist[None, k, :]
+            better = through < dist
+            dist = np.where(better, through, dist)
+            nxt = np.where(better, nxt[:, k, None], nxt)
+        self._dist = dist
+        self._next = nxt
+
+    def links(self) -> List[Tuple[int, int]]:
+        return list(self._links)
+
+    def hop_matrix(self) -> np.ndarray:
+        assert np.isfinite(self._dist).all(), "Some accelerators are not connected"
+        return self._dist.astype(np.int64)
+
+    def route(self, src: int, dst: int) -> List[Tuple[int, int]]:
+        assert self._next[src, dst] >= 0, f"No route from {src} to {dst}"
+        ret = []
+        while src != dst:
+            nxt = int(self._next[src, dst])
+            ret.append((src, nxt))
+            src = nxt
+        return ret
+
+
+ROUTINGS = {
+    "xy": XYRouting,
+    "torus": TorusRouting,
+    "shortest_path": ShortestPathRouting,
+}
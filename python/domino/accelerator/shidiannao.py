@@ -4,6 +4,8 @@ from typing import Dict, Any
 from collections import OrderedDict
 from ..base import AcceleratorBase, AccTask
 from ..utils import run_maestro, generate_maestro_command, find_maestro
+from .dataflow import Dataflow, output_parallel_conv_directives, output_parallel_depthwise_directives, cluster_sizes
+from .analytical import output_parallel_conv, output_parallel_depthwise
 from .conv_acc import ConvAccelerator
 from .depthwise_acc import DepthwiseAccelerator
 
@@ -13,36 +15,22 @@ class DepthwiseShiDianNao(DepthwiseAccelerator):
         super(DepthwiseShiDianNao, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                                   off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, H, W, P, Q, K, M, R, S, stride_h, stride_w):
-        mapping = ("Network sample_net {\n"
-                   "Layer DepthwiseConv2d {\n"
-                   "Type: DSCONV\n"
-                   "Stride { "
-                   f"X: {stride_h}, Y: {stride_w} "
-                   "}\n"
-                   "Dimensions { "
-                   f"K: {M}, C: {K}, R: {R}, S: {S}, Y: {H}, X: {W} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        TemporalMap(1,1) C;\n"
-                   "        SpatialMap(Sz(R), 1) Y;\n"
-                   "        TemporalMap(64,64) X;\n"
-                   "        TemporalMap(Sz(R), Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S), Sz(S)) S;\n"
-                   "        Cluster(64, P);\n"
-                   "        SpatialMap(Sz(S), 1) X;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+    def get_dataflow(self, H, W, P, Q, K, M, R, S, stride_h, stride_w, cluster=64):
+        return Dataflow.depthwise_conv2d(H, W, K, M, R, S, stride_h, stride_w, output_parallel_depthwise_directives(cluster))
+
+    @staticmethod
+    def analytical_cost(hardware, H, W, P, Q, K, M, R, S, stride_h, stride_w, cluster=64):
+        return output_parallel_depthwise(hardware, cluster, H, W, P, Q, K, M, R, S, stride_h, stride_w)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes)}
 
     def spatial_used_pes(self, H, W, P, Q, K, M, R, S, stride_h, stride_w):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(H * 64, self.num_pes)
+        return min(H * self.tuned_params(H, W, P, Q, K, M, R, S, stride_h, stride_w).get("cluster", 64), self.num_pes)
 
     def __str__(self) -> str:
         return f'DepthwiseShiDianNao{self.topo_id}'
@@ -56,37 +44,22 @@ class ConvShiDianNao(ConvAccelerator):
         super(ConvShiDianNao, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                              off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
-        mapping = ("Network sample_net {\n"
-                   "Layer Conv2d {\n"
-                   "Type: CONV\n"
-                   "Stride { "
-                   f"X: {stride_h}, Y: {stride_w} "
-                   "}\n"
-                   "Dimensions { "
-                   f"K: {K}, C: {C}, R: {R}, S: {S}, Y: {H}, X: {W} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        TemporalMap(1,1) K;\n"
-                   "        TemporalMap(1,1) C;\n"
-                   "        SpatialMap(Sz(R), 1) Y;\n"
-                   "        TemporalMap(64,64) X;\n"
-                   "        TemporalMap(Sz(R), Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S), Sz(S)) S;\n"
-                   "        Cluster(64, P);\n"
-                   "        SpatialMap(Sz(S), 1) X;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+    def get_dataflow(self, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=64):
+        return Dataflow.conv2d(H, W, K, C, R, S, stride_h, stride_w, output_parallel_conv_directives(cluster))
+
+    @staticmethod
+    def analytical_cost(hardware, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=64):
+        return output_parallel_conv(hardware, cluster, H, W, P, Q, K, C, R, S, stride_h, stride_w)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes)}
 
     def spatial_used_pes(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(H * 64, self.num_pes)
+        return min(H * self.tuned_params(H, W, P, Q, K, C, R, S, stride_h, stride_w).get("cluster", 64), self.num_pes)
 
     def __str__(self) -> str:
         return f'ConvShiDianNao{self.topo_id}'
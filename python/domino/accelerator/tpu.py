@@ -4,6 +4,8 @@ from typing import Dict, Any
 from collections import OrderedDict
 from ..base import AcceleratorBase, AccTask
 from ..utils import run_maestro, generate_maestro_command, find_maestro
+from .dataflow import Dataflow, channel_parallel_conv_directives, systolic_gemm_directives, cluster_sizes
+from .analytical import channel_parallel_conv, gemm
 from .gemm_acc import GemmAccelerator
 from .conv_acc import ConvAccelerator
 
@@ -13,34 +15,24 @@ class GemmTPU(GemmAccelerator):
         super(GemmTPU, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                       off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, M, N, K):
+    def get_dataflow(self, M, N, K, cluster=128, tile=16):
         # Mx128
-        mapping = ("Network sample_net {\n"
-                   "Layer GEMM {\n"
-                   "Type: GEMM\n"
-                   "Dimensions { "
-                   f"K: {K}, M: {M}, N: {N} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        SpatialMap(1, 1) M;\n"
-                   "        TemporalMap(128, 128) N;\n"
-                   "        TemporalMap(16, 16) K;\n"
-                   "        Cluster(128, P);\n"
-                   "        SpatialMap(1, 1) N;\n"
-                   "        TemporalMap(1, 1) M;\n"
-                   "        TemporalMap(16, 16) K;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+        return Dataflow.gemm(M, N, K, systolic_gemm_directives(cluster, tile))
+
+    @staticmethod
+    def analytical_cost(hardware, M, N, K, cluster=128, tile=16):
+        # the K tile only changes the reuse inside a cluster
+        return gemm(hardware, cluster, M, N, K, M, N, K)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes), "tile": [8, 16, 32, 64]}
 
     def spatial_used_pes(self, B, M, N, K):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(M * 128, self.num_pes)
+        return min(M * self.tuned_params(B, M, N, K).get("cluster", 128), self.num_pes)
 
     def __str__(self) -> str:
         return f'GemmTPU{self.topo_id}'
@@ -54,41 +46,22 @@ class ConvTPU(ConvAccelerator):
         super(ConvTPU, self).__init__(name, n_stream, freq=freq, num_pes=num_pes, noc_bw=noc_bw,
                                       off_chip_bw=off_chip_bw, l1_size=l1_size, l2_size=l2_size)
 
-    def get_mapping(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
-        mapping = ("Network sample_net {\n"
-                   "Layer Conv2d {\n"
-                   "Type: CONV\n"
-                   "Stride { "
-                   f"X: {stride_h}, Y: {stride_w} "
-                   "}\n"
-                   "Dimensions { "
-                   f"K: {K}, C: {C}, R: {R}, S: {S}, Y: {H}, X: {W} "
-                   "}\n"
-                   "Dataflow {\n"
-                   "        SpatialMap(1,1) K;\n"
-                   "        TemporalMap(128,128) C;\n"
-                   "        TemporalMap(Sz(R),Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S),Sz(S)) S;\n"
-                   "        TemporalMap(Sz(R),1) Y;\n"
-                   "        TemporalMap(Sz(S),1) X;\n"
-                   "        Cluster(128, P);\n"
-                   "        SpatialMap(1,1) C;\n"
-                   "        TemporalMap(Sz(R),1) Y;\n"
-                   "        TemporalMap(Sz(S),1) X;\n"
-                   "        TemporalMap(Sz(R),Sz(R)) R;\n"
-                   "        TemporalMap(Sz(S),Sz(S)) S;\n"
-                   "}\n"
-                   "}\n"
-                   "}\n")
-
-        return mapping
+    def get_dataflow(self, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=128):
+        return Dataflow.conv2d(H, W, K, C, R, S, stride_h, stride_w, channel_parallel_conv_directives(cluster))
+
+    @staticmethod
+    def analytical_cost(hardware, H, W, P, Q, K, C, R, S, stride_h, stride_w, cluster=128):
+        return channel_parallel_conv(hardware, cluster, H, W, P, Q, K, C, R, S, stride_h, stride_w)
+
+    def tuning_space(self):
+        return {"cluster": cluster_sizes(self.num_pes)}
 
     def spatial_used_pes(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
         """
         Return how many PEs are actually needed
         This is calculated according to the mapping
         """
-        return min(K * 128, self.num_pes)
+        return min(K * self.tuned_params(H, W, P, Q, K, C, R, S, stride_h, stride_w).get("cluster", 128), self.num_pes)
 
     def __str__(self) -> str:
         return f'ConvTPU{self.topo_id}'
@@ -0,0 +1,139 @@
+import itertools
+from typing import Dict, Any, List, Tuple
+from ..base import AcceleratorBase
+from .. import global_timer
+
+
+class DataflowTuner(object):
+    """
+    Search the dataflow params (e.g., the cluster size) of every shape.
+    The candidates of AcceleratorBase.tuning_space are ranked by the
+    analytical model, only the top_k within slack of the best estimate
+    are evaluated with MAESTRO, in parallel. Candidates needing more
+    L1/L2 than the accelerator has are rejected.
+    With the analytical cost model the best estimate is used directly.
+    """
+
+    def __init__(self, top_k: int = 4, slack: float = 2.0) -> None:
+        assert top_k > 0 and slack >= 1
+        self.top_k = top_k
+        self.slack = slack
+        # compute cache key -> (params, runtime seconds, power), params is None if nothing fits
+        self.best: Dict[Tuple, Tuple[Dict[str, int], float, float]] = {}
+
+    def candidates(self, acc: AcceleratorBase) -> List[Dict[str, int]]:
+        space = acc.tuning_space()
+        return [dict(zip(space.keys(), values)) for values in itertools.product(*space.values())]
+
+    def prune(self, acc: AcceleratorBase, mapping_args: Tuple[int], candidates: List[Dict[str, int]]):
+        """
+        Return [(analytical runtime cycles, power, params)] worth evaluating, best first
+        """
+        hardware = acc.hardware_params()
+        scored = []
+        for params in candidates:
+            runtime, power = acc.analytical_cost(hardware, *mapping_args, **params)
+            scored.append((runtime, power, params))
+        scored.sort(key=lambda x: x[0])
+        bound = scored[0][0] * self.slack
+        return [x for x in scored if x[0] <= bound][:self.top_k]
+
+    def fits(self, acc: AcceleratorBase, l1_size: float, l2_size: float) -> bool:
+        return l1_size <= acc.l1_size and l2_size <= acc.l2_size
+
+    def tune(self, acc: AcceleratorBase, requests: List[Tuple[str, Tuple[int]]], pool=None):
+        """
+        Find the best params of every (kind, mapping args) request.
+        pool is a MaestroEvaluationPool, a default one is created if needed.
+        Return the number of MAESTRO runs.
+        """
+        from ..utils import MaestroEvaluationPool, MaestroJob
+        candidates = self.candidates(acc)
+        use_maestro = acc.get_cost_model() != "analytical"
+        # store key -> (kind, recorded args, mapping), shared by the requests
+        pending = {}
+        # cache key -> [(params, store key)]
+        evaluations = {}
+        known = {}
+        for kind, mapping_args in requests:
+            key = acc._compute_cache_key(kind, mapping_args)
+            if key in self.best or key in evaluations:
+                continue
+            if not len(candidates):
+                self.best[key] = (None, 0, 0)
+                continue
+            kept = self.prune(acc, mapping_args, candidates)
+            if not use_maestro:
+                runtime, power, params = kept[0]
+                self.best[key] = (params, *acc.calibrated(kind, runtime, power))
+                continue
+            evaluations[key] = []
+            for _, _, params in kept:
+                mapping_contents = acc.get_dataflow(*mapping_args, **params).canonical().render()
+                store_key = acc._store_key(kind, mapping_contents)
+                evaluations[key].append((params, store_key))
+                if store_key in pending or store_key in known:
+                    continue
+                # the buffer requirements of a cached candidate are checked like a new one
+                results = None
+                if AcceleratorBase.eval_cache is not None:
+                    results = AcceleratorBase.eval_cache.get_results(store_key)
+                if results is not None:
+                    ret = (results["runtime"][0], results["power"][0])
+                    known[store_key] = ret if self.fits(acc, results["l1_size"][0], results["l2_size"][0]) else None
+                else:
+                    # the params follow the mapping args in analytical_cost
+                    pending[store_key] = (kind, tuple(mapping_args) + tuple(params.values()), mapping_contents)
+
+        if len(pending):
+            jobs = [MaestroJob(mapping_contents, acc.noc_bw, acc.off_chip_bw, acc.num_pes, acc.l1_size, acc.l2_size)
+                    for _, _, mapping_contents in pending.values()]
+            own_pool = pool is None
+            pool = MaestroEvaluationPool() if own_pool else pool
+            try:
+                global_timer.start('maestro')
+                all_results = pool.evaluate_many(jobs)
+                global_timer.stop('maestro')
+            finally:
+                if own_pool:
+                    pool.close()
+            for (store_key, (kind, args, _)), results in zip(pending.items(), all_results):
+                ret = acc._record_results(kind, args, store_key, results)
+                known[store_key] = ret if self.fits(acc, results.l1_size[0], results.l2_size[0]) else None
+
+        for key, evaluated in evaluations.items():
+            best = (None, float("inf"), 0)
+            for params, store_key in evaluated:
+                ret = known[store_key]
+                if ret is not None and ret[0] / acc.freq < best[1]:
+                    best = (params, ret[0] / acc.freq, ret[1])
+            self.best[key] = best
+        return len(pending)
+
+    def query(self, acc: AcceleratorBase, kind: str, mapping_args: Tuple[int]):
+        """
+        Return (runtime seconds, power) of the best dataflow,
+        None if the accelerator can't be tuned or nothing fits
+        """
+        key = acc._compute_cache_key(kind, mapping_args)
+        if key not in self.best:
+            self.tune(acc, [(kind, mapping_args)])
+        params, runtime, power = self.best[key]
+        if params is None:
+            return None
+        return runtime, power
+
+    def best_params(self, acc: AcceleratorBase, kind: str, mapping_args: Tuple[int]) -> Dict[str, int]:
+        key = acc._compute_cache_key(kind, mapping_args)
+        if key not in self.best:
+            self.tune(acc, [(kind, mapping_args)])
+        return self.best[key][0]
+
+    def best_mapping(self, acc: AcceleratorBase, kind: str, mapping_args: Tuple[int]) -> str:
+        """
+        Return the MAESTRO mapping of the best dataflow
+        """
+        params = self.best_params(acc, kind, mapping_args)
+        if params is None:
+            return acc.get_mapping(*mapping_args)
+        return acc.get_dataflow(*mapping_args, **params).canonical().render()
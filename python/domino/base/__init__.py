@@ -1,4 +1,7 @@
 from .acc_base import AcceleratorBase, AccTask, AccStream, SoCBase
+from .task_table import TaskTable
+from .eval_cache import EvaluationCache
+from .surrogate import SurrogateModel
 from .ir_base import IRBase
 from .pass_base import PassBase
 from .type_base import TypeBase
\ No newline at end of file
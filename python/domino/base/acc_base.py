@@ -1,23 +1,111 @@
 import os
 import copy
+import heapq
+import bisect
 import pickle as pkl
 import networkx as nx
 from typing import Dict, Any, List, Tuple
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import numpy as np
 from .. import global_timer
+from .eval_cache import EvaluationCache
+from .surrogate import SurrogateModel
+from .noc import ContentionModel
+
+
+class Journal(object):
+    """
+    Undo log of the mutations made to a SoC.
+    Every change made while a checkpoint is open records how to revert
+    itself, so rolling back costs O(changes) instead of a deepcopy.
+    """
+
+    def __init__(self) -> None:
+        self._undo = []
+        self.marks = []
+
+    def __len__(self):
+        return len(self._undo)
+
+    def record(self, fn, *args):
+        self._undo.append((fn, args))
+
+    def rollback(self, mark):
+        while len(self._undo) > mark:
+            fn, args = self._undo.pop()
+            fn(*args)
+
+
+def _assign(journal: Journal, obj, attr, value):
+    if journal is not None:
+        journal.record(setattr, obj, attr, getattr(obj, attr))
+    setattr(obj, attr, value)
+
+
+def _setitem(journal: Journal, table, key, value):
+    if journal is not None:
+        if key in table:
+            journal.record(table.__setitem__, key, table[key])
+        else:
+            journal.record(table.pop, key)
+    table[key] = value
+
+
+def _append(journal: Journal, items: list, value):
+    if journal is not None:
+        journal.record(items.pop)
+    items.append(value)
+
+
+class FreePERanges(object):
+    """
+    The free [start, end) ranges of a PE array, sorted by start.
+    A task takes the first range large enough, its PEs are contiguous.
+    """
+
+    def __init__(self, num_pes) -> None:
+        self.ranges = [(0, num_pes)] if num_pes > 0 else []
+
+    def allocate(self, size):
+        """
+        Return the first PE of size contiguous PEs, None if no range fits
+        """
+        for pos, (start, end) in enumerate(self.ranges):
+            if end - start >= size:
+                if end - start == size:
+                    self.ranges.pop(pos)
+                else:
+                    self.ranges[pos] = (start + size, end)
+                return start
+        return None
+
+    def release(self, start, size):
+        end = start + size
+        pos = bisect.bisect_left(self.ranges, (start, end))
+        if pos < len(self.ranges) and self.ranges[pos][0] == end:
+            end = self.ranges.pop(pos)[1]
+        if pos > 0 and self.ranges[pos - 1][1] == start:
+            pos -= 1
+            start = self.ranges.pop(pos)[0]
+        self.ranges.insert(pos, (start, end))
 
 
 class AccTask(object):
-    unique_id = 0
+    # fixed slots keep large batched workloads small in memory
+    __slots__ = ["name", "unique_id", "_task_kind", "_params", "_cached_params", "_cached_volume",
+                 "depend_tasks", "compute_start", "compute_finish", "pe_start", "pe_finish", "acc", "stream"]
+    next_unique_id = 0
 
     def __init__(self, name, task_kind=None, params: Dict[str, Any] = {}, depend_tasks: List["AccTask"] = []) -> None:
         assert task_kind in [None, "Conv2d", "Depthwise", "Gemm"]
         self.name = name  # The unique id in compute_graph
-        self.unique_id = AccTask.unique_id
-        AccTask.unique_id += 1
-        self.task_kind = task_kind
-        self.params = params
+        self.unique_id = AccTask.next_unique_id
+        AccTask.next_unique_id += 1
+        self._task_kind = task_kind
+        self._params = params
+        self._cached_params = None
+        self._cached_volume = None
         self.depend_tasks = depend_tasks  # the parent tasks of this task
         # for visualization
         self.compute_start = 0
@@ -27,7 +115,33 @@ class AccTask(object):
         self.acc = None
         self.stream = 0
 
+    @property
+    def task_kind(self):
+        return self._task_kind
+
+    @task_kind.setter
+    def task_kind(self, task_kind):
+        assert task_kind in [None, "Conv2d", "Depthwise", "Gemm"]
+        self._task_kind = task_kind
+        self._cached_params = None
+        self._cached_volume = None
+
+    @property
+    def params(self):
+        return self._params
+
+    @params.setter
+    def params(self, params: Dict[str, Any]):
+        self._params = params
+        self._cached_params = None
+        self._cached_volume = None
+
     def get_params(self):
+        if self._cached_params is None:
+            self._cached_params = self._get_params()
+        return self._cached_params
+
+    def _get_params(self):
         if self.task_kind == "Conv2d":
             H, W, P, Q, K, C, R, S = [self.params[x] for x in "HWPQKCRS"]
             stride_h = self.params["stride_h"]
@@ -49,6 +163,11 @@ class AccTask(object):
         The unit is byte.
         Currently, we only consider int8 precision
         """
+        if self._cached_volume is None:
+            self._cached_volume = self._get_output_data_volume()
+        return self._cached_volume
+
+    def _get_output_data_volume(self):
         if self.task_kind == "Conv2d":
             H, W, P, Q, K, C, R, S = [self.params[x] for x in "HWPQKCRS"]
             return P * Q * K
@@ -75,10 +194,14 @@ class AccTask(object):
 class AccStream(object):
     def __init__(self, idx) -> None:
         self.idx = idx
-        self._stream = []
+        self._stream = deque()
         self._to_commit = []
         self._elapsed_time = 0
         self.logs = []
+        self._journal = None
+        # absolute positions of the queued tasks, makes find O(1)
+        self._positions = {}
+        self._num_popped = 0
 
     def __getitem__(self, idx):
         return self._stream[idx]
@@ -91,15 +214,35 @@ class AccStream(object):
 
     def add(self, task: AccTask):
         assert isinstance(task, AccTask)
+        if task not in self._positions:
+            self._positions[task] = deque()
+        self._positions[task].append(self._num_popped + len(self._stream))
         self._stream.append(task)
+        if self._journal is not None:
+            self._journal.record(self._pop_back)
+
+    def _pop_back(self):
+        task = self._stream.pop()
+        self._positions[task].pop()
+        if not len(self._positions[task]):
+            del self._positions[task]
+
+    def _push_front(self, task: AccTask):
+        self._num_popped -= 1
+        if task not in self._positions:
+            self._positions[task] = deque()
+        self._positions[task].appendleft(self._num_popped)
+        self._stream.appendleft(task)
 
     def retire(self, task, comm_time, compute_time):
         elapsed_time = comm_time + compute_time 
         assert len(self._to_commit) > 0
         assert task == self._to_commit[-1], f"stream: {self.idx}: {task} vs {self._to_commit[-1]}"
-        self.logs.append([task, self._elapsed_time, {'elapsed': elapsed_time, 'compute': compute_time, 'communication': comm_time}])
-        self._to_commit = self._to_commit[:-1]
-        self._elapsed_time += elapsed_time
+        _append(self._journal, self.logs, [task, self._elapsed_time, {'elapsed': elapsed_time, 'compute': compute_time, 'communication': comm_time}])
+        self._to_commit.pop()
+        if self._journal is not None:
+            self._journal.record(self._to_commit.append, task)
+        _assign(self._journal, self, '_elapsed_time', self._elapsed_time + elapsed_time)
         return self._elapsed_time
 
     def find(self, task):
@@ -107,12 +250,9 @@ class AccStream(object):
         Return -1 if not found
         else, return the task position in current stream
         """
-        idx = -1
-        for i, t in enumerate(self._stream):
-            if task == t:
-                idx = i
-                break
-        return idx
+        if task not in self._positions:
+            return -1
+        return self._positions[task][0] - self._num_popped
 
     def empty(self):
         return len(self._stream) == 0
@@ -121,8 +261,17 @@ class AccStream(object):
         return self._stream[0]
 
     def prepare_to_commit(self):
-        self._to_commit.append(self.head())
-        self._stream = self._stream[1:]
+        task = self._stream.popleft()
+        self._positions[task].popleft()
+        if not len(self._positions[task]):
+            del self._positions[task]
+        self._num_popped += 1
+        if self._journal is not None:
+            self._journal.record(self._push_front, task)
+        _append(self._journal, self._to_commit, task)
+
+    def set_elapsed_time(self, time):
+        _assign(self._journal, self, '_elapsed_time', time)
 
     def report(self):
         occupation = sum([x[2]['elapsed'] for x in self.logs]) / self._elapsed_time 
@@ -149,6 +298,11 @@ class AcceleratorBase(object):
         self.off_chip_bw = off_chip_bw  # byte/s
         self.l1_size = l1_size  # byte
         self.l2_size = l2_size  # byte
+        # None follows AcceleratorBase.default_cost_model
+        self.cost_model = None
+        # a DataflowTuner searches the dataflow of every shape
+        self.tuner = None
+        self._journal = None
         self.unique_stream_id = 0  # increase only
         self.streams = OrderedDict()
         self.streams[self.unique_stream_id] = AccStream(self.unique_stream_id)
@@ -162,15 +316,35 @@ class AcceleratorBase(object):
         self.pe_usages = []
 
     def add_new_stream(self):
-        self.unique_stream_id += 1
+        _assign(self._journal, self, 'unique_stream_id', self.unique_stream_id + 1)
         idx = self.unique_stream_id
-        self.streams[idx] = AccStream(idx)
+        stream = AccStream(idx)
+        stream._journal = self._journal
+        _setitem(self._journal, self.streams, idx, stream)
         return idx
 
     def delete_stream(self, idx):
         assert idx in self.streams
+        if self._journal is not None:
+            # restore the stream at its original position
+            self._journal.record(self._restore_streams, OrderedDict(self.streams))
         del self.streams[idx]
 
+    def _restore_streams(self, streams):
+        self.streams = streams
+
+    def set_journal(self, journal: Journal):
+        self._journal = journal
+        for stream in self.streams.values():
+            stream._journal = journal
+
+    def annotate(self, task: AccTask, **fields):
+        """
+        Record the visualization fields of a committed task
+        """
+        for attr, value in fields.items():
+            _assign(self._journal, task, attr, value)
+
     def num_streams(self):
         return len(self.streams)
 
@@ -185,37 +359,256 @@ class AcceleratorBase(object):
     def push_task_to_stream(self, idx, task: AccTask):
         stream = self.get_stream(idx)
         stream.add(task)
-        self.board[task] = idx
+        _setitem(self._journal, self.board, task, idx)
 
     def snapshot(self):
         ret = copy.deepcopy(self)
         return ret
 
-    def get_mapping(self, *args):
+    def get_dataflow(self, *args):
+        """
+        Return the Dataflow of the mapping args
+        """
         raise NotImplementedError()
 
+    def tuning_space(self) -> Dict[str, List[int]]:
+        """
+        The keyword params of get_dataflow and analytical_cost
+        searched by a DataflowTuner, with their candidate values
+        """
+        return {}
+
+    def get_mapping(self, *args):
+        """
+        Return the MAESTRO mapping of the mapping args.
+        The canonical form is rendered, so equivalent dataflows
+        share the same text and the same evaluation cache entry.
+        """
+        return self.get_dataflow(*args).canonical().render()
+
     def spatial_used_pes(self, *args):
         raise NotImplementedError()
 
+    def compute_request(self, *args):
+        """
+        Translate task params into (kind, mapping args, runtime scale).
+        The mapping args are passed to get_mapping, the evaluated
+        runtime is multiplied by the scale (e.g., the batch of a Gemm).
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def analytical_cost(hardware: Dict[str, Any], *mapping_args):
+        """
+        Closed-form (runtime cycles, power) of a mapping on the given
+        hardware params, derived from the dataflow of get_mapping
+        """
+        raise NotImplementedError()
+
+    def set_cost_model(self, cost_model: str = None):
+        """
+        Select 'maestro', 'analytical' or 'surrogate' for this accelerator,
+        None follows AcceleratorBase.default_cost_model
+        """
+        assert cost_model in [None] + AcceleratorBase.COST_MODELS, f"Unknown cost model {cost_model}"
+        self.cost_model = cost_model
+
+    def set_tuner(self, tuner=None):
+        """
+        Evaluate every shape with its best dataflow found by tuner,
+        None goes back to the fixed dataflow
+        """
+        self.tuner = tuner
+
+    def tuned_params(self, *args) -> Dict[str, int]:
+        """
+        The dataflow params picked by the tuner for the task params,
+        empty without a tuner, i.e., the defaults of get_dataflow
+        """
+        if self.tuner is None:
+            return {}
+        kind, mapping_args, _ = self.compute_request(*args)
+        params = self.tuner.best_params(self, kind, mapping_args)
+        return {} if params is None else params
+
+    def get_cost_model(self) -> str:
+        return self.cost_model if self.cost_model is not None else AcceleratorBase.default_cost_model
+
     def evaluate_compute(self, *args):
         """
         Calculate compute runtime seconds and energy (nJ)
         """
-        raise NotImplementedError()
+        kind, mapping_args, scale = self.compute_request(*args)
+        runtime, power = self.query_compute(kind, mapping_args)
+        return scale * runtime, power
+
+    def hardware_params(self) -> Dict[str, Any]:
+        return {"freq": self.freq,
+                "num_pes": self.num_pes,
+                "noc_bw": self.noc_bw,
+                "off_chip_bw": self.off_chip_bw,
+                "l1_size": self.l1_size,
+                "l2_size": self.l2_size}
+
+    def _compute_cache_key(self, kind: str, mapping_args: Tuple[int]):
+        return (type(self).__name__, kind, mapping_args, tuple(self.hardware_params().values()))
+
+    def _store_key(self, kind: str, mapping_contents: str):
+        return EvaluationCache.make_key(kind, mapping_contents, self.hardware_params())
+
+    def _record_results(self, kind: str, mapping_args: Tuple[int], store_key: str, results):
+        ret = (results.runtime[0], results.power[0])
+        if AcceleratorBase.results_store is not None:
+            AcceleratorBase.results_store.append(type(self).__name__, kind, mapping_args, self.hardware_params(), results)
+        if AcceleratorBase.eval_cache is not None:
+            AcceleratorBase.eval_cache.put(
+                store_key, *ret, kind=kind, accelerator=type(self).__name__, args=mapping_args,
+                hardware=self.hardware_params(),
+                results={k: np.asarray(v).tolist() for k, v in results._asdict().items()})
+        return ret
+
+    def query_compute(self, kind: str, mapping_args: Tuple[int]):
+        """
+        Return (runtime seconds, power) of one mapping with the selected cost model.
+        For MAESTRO, look up the in-memory cache first, then the persistent
+        cache, and run MAESTRO only for unknown points. The surrogate falls
+        back to MAESTRO when its prediction is not confident enough.
+        """
+        if self.tuner is not None:
+            ret = self.tuner.query(self, kind, mapping_args)
+            if ret is not None:
+                return ret
+        cost_model = self.get_cost_model()
+        if cost_model == "analytical":
+            return self.query_analytical(kind, mapping_args)
+        key = self._compute_cache_key(kind, mapping_args)
+        if cost_model == "surrogate" and key not in AcceleratorBase.compute_cache:
+            surrogate_key = SurrogateModel.make_key(type(self).__name__, kind, self.hardware_params())
+            ret = AcceleratorBase.get_surrogate().query(surrogate_key, mapping_args)
+            if ret is not None:
+                return ret[0] / self.freq, ret[1]
+            runtime, power = self.query_maestro(key, kind, mapping_args)
+            # feed the new point back
+            AcceleratorBase.get_surrogate().add(surrogate_key, mapping_args, runtime * self.freq, power)
+            return runtime, power
+        return self.query_maestro(key, kind, mapping_args)
+
+    def query_maestro(self, key: Tuple, kind: str, mapping_args: Tuple[int]):
+        if key not in AcceleratorBase.compute_cache:
+            mapping_contents = self.get_mapping(*mapping_args)
+            store_key = self._store_key(kind, mapping_contents)
+            ret = None
+            if AcceleratorBase.eval_cache is not None:
+                ret = AcceleratorBase.eval_cache.get(store_key)
+            if ret is None:
+                results = self.run_mapping(kind, mapping_contents)
+                ret = self._record_results(kind, mapping_args, store_key, results)
+            AcceleratorBase.compute_cache[key] = (ret[0] / self.freq, ret[1])
+        return AcceleratorBase.compute_cache[key]
+
+    def query_analytical(self, kind: str, mapping_args: Tuple[int]):
+        """
+        Return (runtime seconds, power) of the calibrated analytical model
+        """
+        runtime, power = self.analytical_cost(self.hardware_params(), *mapping_args)
+        return self.calibrated(kind, runtime, power)
+
+    def calibrated(self, kind: str, runtime: float, power: float):
+        """
+        Apply the calibration to analytical (runtime cycles, power),
+        return (runtime seconds, power)
+        """
+        runtime_scale, power_scale = AcceleratorBase.calibration.get((type(self).__name__, kind), (1.0, 1.0))
+        return runtime * runtime_scale / self.freq, power * power_scale
 
-    def evaluate_fetch_data(self, task: AccTask, soc: "SoCBase"):
+    def run_mapping(self, kind: str, mapping_contents: str):
+        """
+        Evaluate one mapping with MAESTRO, return MaestroResults
+        """
+        # utils depends on the graph IR, which imports base
+        from ..utils import evaluate_maestro_mapping
+        global_timer.start('maestro')
+        results = evaluate_maestro_mapping(
+            mapping_contents,
+            self.noc_bw,
+            self.off_chip_bw,  # off_chip_bw,
+            self.num_pes,  # num_pes,
+            self.l1_size,  # l1_size,
+            self.l2_size,  # l2_size,
+            mapping_file_name=f"{kind}_sample_mapping",
+        )
+        global_timer.stop('maestro')
+        return results
+
+    def prefetch(self, tasks: List[AccTask], pool=None):
+        """
+        Evaluate the unique uncached shapes of the tasks in parallel.
+        pool is a MaestroEvaluationPool, a default one is created if None.
+        Return the number of MAESTRO runs.
+        """
+        from ..utils import MaestroEvaluationPool, MaestroJob
+        if self.tuner is not None:
+            requests = [self.compute_request(*task.get_params())[:2] for task in tasks
+                        if task.task_kind in self.supported_task]
+            return self.tuner.tune(self, requests, pool)
+        if self.get_cost_model() != "maestro":
+            return 0
+        pending = {}  # store key -> (kind, mapping args, cache key, mapping)
+        for task in tasks:
+            if task.task_kind not in self.supported_task:
+                continue
+            kind, mapping_args, _ = self.compute_request(*task.get_params())
+            key = self._compute_cache_key(kind, mapping_args)
+            if key in AcceleratorBase.compute_cache:
+                continue
+            mapping_contents = self.get_mapping(*mapping_args)
+            store_key = self._store_key(kind, mapping_contents)
+            if store_key in pending:
+                continue
+            ret = None
+            if AcceleratorBase.eval_cache is not None:
+                ret = AcceleratorBase.eval_cache.get(store_key)
+            if ret is not None:
+                AcceleratorBase.compute_cache[key] = (ret[0] / self.freq, ret[1])
+            else:
+                pending[store_key] = (kind, mapping_args, key, mapping_contents)
+        if not len(pending):
+            return 0
+
+        jobs = [MaestroJob(mapping_contents, self.noc_bw, self.off_chip_bw, self.num_pes, self.l1_size, self.l2_size)
+                for _, _, _, mapping_contents in pending.values()]
+        own_pool = pool is None
+        pool = MaestroEvaluationPool() if own_pool else pool
+        try:
+            global_timer.start('maestro')
+            all_results = pool.evaluate_many(jobs)
+            global_timer.stop('maestro')
+        finally:
+            if own_pool:
+                pool.close()
+        for (store_key, (kind, mapping_args, key, _)), results in zip(pending.items(), all_results):
+            ret = self._record_results(kind, mapping_args, store_key, results)
+            AcceleratorBase.compute_cache[key] = (ret[0] / self.freq, ret[1])
+        return len(jobs)
+
+    def evaluate_fetch_data(self, task: AccTask, soc: "SoCBase", start_time: float = None):
         """
         Calculate fetch data runtime seconds
+        The inputs are fetched one after another from start_time,
+        which is only needed by SoCs with link contention.
         """
         # max_transfer_time = 0
         sum_transfer_time = 0
         for ptask in task.depend_tasks:
-            transfer_time = soc.evaluate_data_transfer(ptask, task)
+            transfer_start = None if start_time is None else start_time + sum_transfer_time
+            transfer_time = soc.evaluate_data_transfer(ptask, task, transfer_start)
             sum_transfer_time += transfer_time
             # max_transfer_time = max(max_transfer_time, transfer_time)
         return sum_transfer_time
 
-    def commit_current_tasks(self, soc: "SoCBase"):
+    def commit_current_tasks(self, soc: "SoCBase", event_driven: bool = False):
+        if event_driven:
+            return self.commit_current_tasks_event_driven(soc)
         phase = {}
         cur_pe_usage = 0
         total_tasks = 0
@@ -235,31 +628,33 @@ class AcceleratorBase(object):
             for idx, task in phase.items():
                 stream = self.get_stream(idx)
                 task_params = task.get_params()
-                fetch_data_cost = self.evaluate_fetch_data(task, soc)
+                fetch_data_cost = self.evaluate_fetch_data(task, soc, stream._elapsed_time)
                 compute_time_cost, power = self.evaluate_compute(
                     *task_params)
                 max_power = max(max_power, power)
                 sync_time = max(sync_time, stream.retire(
                     task, fetch_data_cost, compute_time_cost))
 
-                task.pe_start = pe_offset
+                pe_start = pe_offset
                 pe_usage = self.spatial_used_pes(*task.get_params())
                 pe_offset += pe_usage 
                 pe_amount += pe_usage * compute_time_cost
                 comm_amount += pe_usage * fetch_data_cost
-                task.pe_finish = pe_offset
-                task.compute_start = stream._elapsed_time
-                task.compute_finish = task.compute_start + fetch_data_cost + compute_time_cost
-                task.acc = self.name
-                task.stream = idx
+                self.annotate(task,
+                              pe_start=pe_start,
+                              pe_finish=pe_offset,
+                              compute_start=stream._elapsed_time,
+                              compute_finish=stream._elapsed_time + fetch_data_cost + compute_time_cost,
+                              acc=self.name,
+                              stream=idx)
             phase_time = sync_time - old_time
-            self.pe_usages.append({'occupancy': pe_offset / self.num_pes, 
-                                   'amount': pe_amount, 
-                                   'comm_amount': comm_amount, 
-                                   'phase_amount': phase_time * self.num_pes})
-            self.total_energy += phase_time * max_power
+            _append(self._journal, self.pe_usages, {'occupancy': pe_offset / self.num_pes, 
+                                                    'amount': pe_amount, 
+                                                    'comm_amount': comm_amount, 
+                                                    'phase_amount': phase_time * self.num_pes})
+            _assign(self._journal, self, 'total_energy', self.total_energy + phase_time * max_power)
             for idx in range(self.num_streams()):
-                self.get_stream(idx)._elapsed_time = sync_time
+                self.get_stream(idx).set_elapsed_time(sync_time)
             phase = {}
             cur_pe_usage = 0
 
@@ -292,10 +687,95 @@ class AcceleratorBase(object):
         assert len(phase) == 0, f"{phase}"
         return max([x._elapsed_time for x in self.streams.values()])
 
+    def commit_current_tasks_event_driven(self, soc: "SoCBase"):
+        """
+        Discrete-event version of commit_current_tasks.
+        A stream issues its head as soon as the stream is idle and a range
+        of enough contiguous PEs is free (see FreePERanges), so no global
+        phase sync is needed.
+        Events are kept in priority queues, the cost is O(n log n).
+        """
+        now = self.get_current_elapsed_time()
+        free_pes = self.num_pes
+        free_ranges = FreePERanges(self.num_pes)
+        # (ready time, stream idx), ties are broken by stream order
+        waiting = [(now, idx) for idx, stream in self.streams.items() if not stream.empty()]
+        heapq.heapify(waiting)
+        # (finish time, stream idx, pe usage, power, first pe)
+        running = []
+        running_powers = {}
+        last_time = now
+        pe_amount = 0
+        comm_amount = 0
+
+        def advance(time):
+            # close the interval [last_time, time) in pe_usages and energy
+            nonlocal last_time, pe_amount, comm_amount
+            if time <= last_time:
+                return
+            _append(self._journal, self.pe_usages, {'occupancy': (self.num_pes - free_pes) / self.num_pes,
+                                                    'amount': pe_amount,
+                                                    'comm_amount': comm_amount,
+                                                    'phase_amount': (time - last_time) * self.num_pes})
+            if len(running_powers):
+                _assign(self._journal, self, 'total_energy',
+                        self.total_energy + (time - last_time) * max(running_powers))
+            last_time = time
+            pe_amount = 0
+            comm_amount = 0
+
+        while len(waiting) or len(running):
+            while len(waiting) and waiting[0][0] <= now:
+                idx = waiting[0][1]
+                stream = self.get_stream(idx)
+                task = stream.head()
+                task_params = task.get_params()
+                pe_usage = self.spatial_used_pes(*task_params)
+                assert pe_usage <= self.num_pes, f"{pe_usage} vs {self.num_pes}"
+                pe_start = free_ranges.allocate(pe_usage)
+                if pe_start is None:
+                    # keep the issue order, later streams wait as well
+                    break
+                heapq.heappop(waiting)
+                stream.prepare_to_commit()
+                fetch_data_cost = self.evaluate_fetch_data(task, soc, now)
+                compute_time_cost, power = self.evaluate_compute(*task_params)
+                stream.set_elapsed_time(now)
+                finish = stream.retire(task, fetch_data_cost, compute_time_cost)
+
+                self.annotate(task,
+                              pe_start=pe_start,
+                              pe_finish=pe_start + pe_usage,
+                              compute_start=now,
+                              compute_finish=finish,
+                              acc=self.name,
+                              stream=idx)
+                free_pes -= pe_usage
+                pe_amount += pe_usage * compute_time_cost
+                comm_amount += pe_usage * fetch_data_cost
+                running_powers[power] = running_powers.get(power, 0) + 1
+                heapq.heappush(running, (finish, idx, pe_usage, power, pe_start))
+
+            if not len(running):
+                assert not len(waiting), f"stream {waiting[0][1]} can never be issued"
+                break
+            now = running[0][0]
+            advance(now)
+            while len(running) and running[0][0] <= now:
+                _, idx, pe_usage, power, pe_start = heapq.heappop(running)
+                free_pes += pe_usage
+                free_ranges.release(pe_start, pe_usage)
+                running_powers[power] -= 1
+                if running_powers[power] == 0:
+                    del running_powers[power]
+                if not self.get_stream(idx).empty():
+                    heapq.heappush(waiting, (now, idx))
+        return max([x._elapsed_time for x in self.streams.values()])
+
     def sync(self, time):
         for stream in self.streams.values():
             assert time >= stream._elapsed_time
-            stream._elapsed_time = time
+            stream.set_elapsed_time(time)
 
     def get_current_elapsed_time(self):
         return max([stream.get_current_elapsed_time() for stream in self.streams.values()])
@@ -303,21 +783,77 @@ class AcceleratorBase(object):
     def get_current_energy_consumption(self):
         return self.total_energy
 
+    # in-memory cache: (accelerator, kind, mapping args, hardware params) -> (runtime seconds, power)
     compute_cache = {}
+    # persistent cache shared by processes, see load_cache
+    eval_cache = None
+    COST_MODELS = ["maestro", "analytical", "surrogate"]
+    default_cost_model = "maestro"
+    # (accelerator, kind) -> (runtime scale, power scale) of the analytical model
+    calibration = {}
+    # trained from MAESTRO results, see train_surrogate
+    surrogate = None
+    # every MAESTRO evaluation is appended to it, see open_results_store
+    results_store = None
+
+    @staticmethod
+    def get_surrogate() -> SurrogateModel:
+        if AcceleratorBase.surrogate is None:
+            AcceleratorBase.surrogate = SurrogateModel()
+        return AcceleratorBase.surrogate
+
+    @staticmethod
+    def train_surrogate(records: List[Dict[str, Any]] = None):
+        """
+        Fit the surrogate model on MAESTRO results,
+        by default the ones in the persistent evaluation cache
+        """
+        if records is None:
+            if AcceleratorBase.eval_cache is None:
+                return AcceleratorBase.get_surrogate()
+            records = AcceleratorBase.eval_cache.records()
+        AcceleratorBase.get_surrogate().fit(records)
+        return AcceleratorBase.surrogate
+
+    @staticmethod
+    def set_default_cost_model(cost_model: str):
+        assert cost_model in AcceleratorBase.COST_MODELS, f"Unknown cost model {cost_model}"
+        AcceleratorBase.default_cost_model = cost_model
 
     @staticmethod
-    def load_cache(dir: str = './.cache'):
-        file = os.path.join(dir, "accelerator.pkl")
-        if os.path.exists(file):
-            with open(file, 'rb') as f:
-                AcceleratorBase.compute_cache = pkl.load(f)
+    def load_cache(dir: str = './.cache', max_entries: int = None):
+        AcceleratorBase.eval_cache = EvaluationCache(
+            os.path.join(dir, "accelerator.db"), max_entries=max_entries)
 
     @staticmethod
-    def store_cache(dir: str = './.cache/'):
-        file = os.path.join(dir, "accelerator.pkl")
-        if os.path.exists(file):
-            with open(file, 'wb') as f:
-                pkl.dump(AcceleratorBase.compute_cache, f)
+    def store_cache(dir: str = None):
+        """
+        Flush the cache opened by load_cache, dir (if given) must be the directory given to it
+        """
+        if AcceleratorBase.eval_cache is None:
+            return
+        if dir is not None:
+            path = os.path.join(dir, "accelerator.db")
+            assert os.path.abspath(path) == os.path.abspath(AcceleratorBase.eval_cache.path), \
+                f"The cache is in {AcceleratorBase.eval_cache.path}, not in {dir}"
+        stats = AcceleratorBase.eval_cache.stats()
+        print(f"evaluation cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+        AcceleratorBase.eval_cache.flush()
+
+    @staticmethod
+    def open_results_store(dir: str = './.cache/results'):
+        # utils depends on the graph IR, which imports base
+        from ..utils import ResultsStore
+        AcceleratorBase.results_store = ResultsStore(dir)
+        return AcceleratorBase.results_store
+
+    @staticmethod
+    def close_results_store():
+        if AcceleratorBase.results_store is None:
+            return
+        print(f"results store: {len(AcceleratorBase.results_store)} rows")
+        AcceleratorBase.results_store.close()
+        AcceleratorBase.results_store = None
 
     def report(self):
         print(f"{self.name}: ")
@@ -335,29 +871,84 @@ class AcceleratorBase(object):
         return data 
 
 class SoCBase(object):
-    def __init__(self, accelerator_graph: nx.DiGraph, name = 'SoC') -> None:
+    def __init__(self, accelerator_graph: nx.DiGraph, name = 'SoC', event_driven: bool = False,
+                 bandwidth: np.ndarray = None, hops: np.ndarray = None, latency: np.ndarray = None,
+                 contention: bool = False, routes = None) -> None:
+        """
+        bandwidth (GB/s), hops and latency (s) are indexed by the accelerator
+        index, i.e., the order of accelerator_graph.nodes. Without a bandwidth
+        matrix, the 'bandwidth' of the edges of accelerator_graph is used.
+        With contention, the edges of accelerator_graph are the links and
+        routes(src, dst) returns the links between two accelerator indices
+        (default: the direct edge).
+        """
         self.accelerator_graph = accelerator_graph
         self.name = name
+        # use the discrete-event engine instead of phase-based commit
+        self.event_driven = event_driven
         self.elapsed_time = 0
         self._bind_table = {}  # task id to (accelerator_id, stream_id)
+        self._journal = None
+        self.acc_names = list(accelerator_graph.nodes)
+        self.acc_index = {name: idx for idx, name in enumerate(self.acc_names)}
+        num_accs = len(self.acc_names)
+        if bandwidth is None:
+            bandwidth = np.zeros((num_accs, num_accs))
+            for acc_from, acc_to, bw in accelerator_graph.edges.data("bandwidth"):
+                if bw is not None:
+                    bandwidth[self.acc_index[acc_from], self.acc_index[acc_to]] = bw
+        self.bandwidth = np.asarray(bandwidth, dtype=np.float64)
+        self.hops = np.zeros((num_accs, num_accs), dtype=np.int64) if hops is None else np.asarray(hops, dtype=np.int64)
+        self.latency = np.zeros((num_accs, num_accs)) if latency is None else np.asarray(latency, dtype=np.float64)
+        assert self.bandwidth.shape == self.hops.shape == self.latency.shape == (num_accs, num_accs)
+        # nested lists are faster than NumPy for scalar lookups
+        self._bandwidth_table = self.bandwidth.tolist()
+        self._latency_table = self.latency.tolist()
+        # per-task cost tables, see build_cost_tables
+        self.compute_table = None
+        self.pe_table = None
+        self.contention = None
+        if contention:
+            capacities = {(self.acc_index[u], self.acc_index[v]): bw
+                          for u, v, bw in accelerator_graph.edges.data("bandwidth")}
+            self.contention = ContentionModel(capacities, routes if routes is not None else SoCBase._direct_route)
+
+    @staticmethod
+    def _direct_route(src: int, dst: int):
+        return [(src, dst)]
 
-    def evaluate_data_transfer(self, task_from: AccTask, task_to: AccTask):
+    def transfer_time(self, volume: float, acc_from: str, acc_to: str,
+                      start_time: float = None, reserve: bool = True) -> float:
+        """
+        Seconds to move volume bytes from acc_from to acc_to.
+        With link contention and a start_time, the transfer shares the links
+        with the ones already reserved; it is reserved too unless reserve is False.
+        """
+        src, dst = self.acc_index[acc_from], self.acc_index[acc_to]
+        # unit is GB/s
+        bw = self._bandwidth_table[src][dst]
+        assert bw > 0, f"Can't get the bandwidth from {acc_from} to {acc_to}"
+        if self.contention is not None and start_time is not None and src != dst:
+            finish = self.contention.transfer(volume / 1e9, src, dst, bw, start_time, reserve)
+            return finish - start_time + self._latency_table[src][dst]
+        return volume / 1e9 / bw + self._latency_table[src][dst]
+
+    def transfer_times(self, volumes: np.ndarray, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+        """
+        Vectorized transfer_time, src and dst are accelerator indices
+        """
+        return np.asarray(volumes) / 1e9 / self.bandwidth[src, dst] + self.latency[src, dst]
+
+    def evaluate_data_transfer(self, task_from: AccTask, task_to: AccTask, start_time: float = None):
         assert task_from.unique_id in self._bind_table
         assert task_to.unique_id in self._bind_table
         acc_from, stream_from = self._bind_table[task_from.unique_id]
         acc_to, stream_to = self._bind_table[task_to.unique_id]
-        transfer_volume = task_from.get_output_data_volume() / 1e9  # unit is GB
-        try:
-            # unit is GB/s
-            bw = self.accelerator_graph[acc_from][acc_to]["bandwidth"]
-            return transfer_volume / bw
-        except Exception as e:
-            print(f"Can't get the bandwidth from {acc_from} to {acc_to}")
-            raise e
+        return self.transfer_time(task_from.get_output_data_volume(), acc_from, acc_to, start_time)
 
     def push_task(self, task, acc: str, stream_id):
         assert isinstance(acc, str)
-        self._bind_table[task.unique_id] = (acc, stream_id)
+        _setitem(self._journal, self._bind_table, task.unique_id, (acc, stream_id))
         self.accelerator_graph.nodes[acc]['acc'].push_task_to_stream(
             stream_id, task)
 
@@ -371,16 +962,21 @@ class SoCBase(object):
         return ret
 
     def commit_all_tasks(self):
-        self.elapsed_time = 0.0
+        elapsed_time = 0.0
         for acc_name in self.accelerator_graph.nodes:
             acc = self.accelerator_graph.nodes[acc_name]["acc"]
-            self.elapsed_time = max(
-                self.elapsed_time, acc.commit_current_tasks(self))
+            elapsed_time = max(
+                elapsed_time, acc.commit_current_tasks(self, self.event_driven))
             for i in range(acc.num_streams()):
                 assert acc[i].empty()
+        _assign(self._journal, self, 'elapsed_time', elapsed_time)
         # global sync
         for _, acc in self.accelerator_graph.nodes.data('acc'):
             acc.sync(self.elapsed_time)
+        # later transfers start after the sync, the timelines before it can go
+        # unless they may still be rolled back
+        if self.contention is not None and self._journal is None:
+            self.contention.prune(self.elapsed_time)
 
         return self.elapsed_time
 
@@ -401,17 +997,73 @@ class SoCBase(object):
     def snapshot(self):
         return copy.deepcopy(self)
 
+    def _set_journal(self, journal: Journal):
+        self._journal = journal
+        if self.contention is not None:
+            self.contention._journal = journal
+        for _, acc in self.accelerator_graph.nodes.data('acc'):
+            acc.set_journal(journal)
+
+    def checkpoint(self) -> int:
+        """
+        Open a checkpoint and return its mark.
+        Mutations after this point are journaled until the checkpoint is
+        rolled back or released.
+        """
+        if self._journal is None:
+            self._set_journal(Journal())
+        mark = len(self._journal)
+        self._journal.marks.append(mark)
+        return mark
+
+    def rollback(self, mark: int = None):
+        """
+        Revert every mutation made since the checkpoint (default: the latest one)
+        """
+        assert self._journal is not None and len(self._journal.marks), "No open checkpoint"
+        mark = self._journal.marks[-1] if mark is None else mark
+        self._journal.rollback(mark)
+        self.release(mark)
+
+    def release(self, mark: int = None):
+        """
+        Close the checkpoint (default: the latest one) and keep its mutations
+        """
+        assert self._journal is not None and len(self._journal.marks), "No open checkpoint"
+        mark = self._journal.marks[-1] if mark is None else mark
+        assert mark in self._journal.marks, f"Unknown checkpoint {mark}"
+        while self._journal.marks[-1] != mark:
+            self._journal.marks.pop()
+        self._journal.marks.pop()
+        if not len(self._journal.marks):
+            self._set_journal(None)
+
+    @contextmanager
+    def trial(self):
+        """
+        Try some placements and roll them back on exit:
+
+            with soc.trial():
+                soc.push_task(task, acc, stream)
+                latency = soc.commit_all_tasks()
+        """
+        mark = self.checkpoint()
+        try:
+            yield self
+        finally:
+            self.rollback(mark)
+
     def eval(self,
              curr_task: Tuple[AccTask, "AcceleratorName"],
-             input_tasks: List[Tuple[AccTask, "AcceleratorName"]]
+             input_tasks: List[Tuple[AccTask, "AcceleratorName"]],
+             start_time: float = None
              ):
         acc_name, task = curr_task
         acc = self.accelerator_graph.nodes[acc_name]['acc']
         params = task.get_params()
                      
         fetch_data_cost = max(
-            task_from.get_output_data_volume() / 1e9 /
-            self.accelerator_graph[acc_from][acc_name]['bandwidth']
+            self.transfer_time(task_from.get_output_data_volume(), acc_from, acc_name, start_time, reserve=False)
             for acc_from, task_from in input_tasks
         ) if len(input_tasks) else 0
 
@@ -421,13 +1073,19 @@ class SoCBase(object):
 
     def eval_communication(self, 
         curr_task: Tuple[AccTask, "AcceleratorName"], 
-        input_tasks: List[Tuple[AccTask, "AcceleratorName"]]
+        input_tasks: List[Tuple[AccTask, "AcceleratorName"]],
+        start_time: float = None
     ):
+        """
+        With link contention and a start_time, the reserved traffic
+        is taken into account but nothing is reserved
+        """
         acc_name, _  = curr_task
-        fetch_data_cost = sum(
-            task_from.get_output_data_volume() / 1e9 / self.accelerator_graph[acc_from][acc_name]['bandwidth']
-            for acc_from, task_from in input_tasks
-        ) if len(input_tasks) else 0
+        fetch_data_cost = 0
+        for acc_from, task_from in input_tasks:
+            transfer_start = None if start_time is None else start_time + fetch_data_cost
+            fetch_data_cost += self.transfer_time(task_from.get_output_data_volume(), acc_from, acc_name,
+                                                  transfer_start, reserve=False)
         
         return fetch_data_cost
 
@@ -439,6 +1097,100 @@ class SoCBase(object):
         acc = self.accelerator_graph.nodes[acc_name]['acc']
         return acc.spatial_used_pes(*task.get_params())
 
+    def prefetch(self, tasks: List[AccTask], pool=None):
+        """
+        Evaluate the compute cost of the tasks on every accelerator
+        in parallel before mapping. Return the number of MAESTRO runs.
+        """
+        from ..utils import MaestroEvaluationPool
+        # accelerators with their own cost model don't use MAESTRO
+        accs = [acc for _, acc in self.accelerator_graph.nodes.data('acc')
+                if type(acc).evaluate_compute is AcceleratorBase.evaluate_compute
+                and acc.get_cost_model() == "maestro"]
+        if not len(accs):
+            return 0
+        own_pool = pool is None
+        pool = MaestroEvaluationPool() if own_pool else pool
+        num_runs = 0
+        try:
+            for acc in accs:
+                num_runs += acc.prefetch(tasks, pool)
+        finally:
+            if own_pool:
+                pool.close()
+        return num_runs
+
+    def build_cost_tables(self, table: "TaskTable"):
+        """
+        Precompute the compute time and PE usage of every task of the
+        table on every accelerator, unsupported pairs cost inf.
+        This is needed by eval_batch.
+        """
+        num_tasks, num_accs = len(table), len(self.acc_names)
+        self.compute_table = np.full((num_tasks, num_accs), np.inf)
+        self.pe_table = np.zeros((num_tasks, num_accs), dtype=np.int64)
+        pred_ptr, pred_idx = table.csr()
+        self._pred_ptr = pred_ptr
+        self._pred_idx = pred_idx
+        self._volumes = table.output_volume[:num_tasks].astype(np.float64)
+        accs = [self.accelerator_graph.nodes[name]['acc'] for name in self.acc_names]
+        costs = {}
+        for row in range(num_tasks):
+            task_kind = table.task_kind(row)
+            params = table.get_params(row)
+            for acc_id, acc in enumerate(accs):
+                if task_kind not in acc.supported_task:
+                    continue
+                key = (acc_id, task_kind, params)
+                if key not in costs:
+                    costs[key] = (acc.evaluate_compute(*params)[0], acc.spatial_used_pes(*params))
+                self.compute_table[row, acc_id], self.pe_table[row, acc_id] = costs[key]
+
+    def _gather_predecessors(self, task_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the predecessor rows of the tasks concatenated in order,
+        and the number of predecessors of each task
+        """
+        starts = self._pred_ptr[task_ids]
+        counts = self._pred_ptr[task_ids + 1] - starts
+        offsets = np.cumsum(counts) - counts
+        segment = np.repeat(np.arange(len(task_ids)), counts)
+        preds = self._pred_idx[np.arange(len(segment)) - offsets[segment] + starts[segment]]
+        return preds, counts
+
+    def eval_batch(self, task_ids: np.ndarray, acc_ids: np.ndarray, pred_placements: np.ndarray = None,
+                   reduce: str = "sum") -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Evaluate many (task row, accelerator index) candidates at once.
+        pred_placements gives the accelerator index of every task row,
+        the predecessors that are not placed (-1, or None for all of
+        them) are assumed to be on the candidate accelerator.
+        The fetch times of a task are summed like eval_communication,
+        or reduced with max like eval.
+        Return (compute time, fetch time, PE usage) arrays.
+        """
+        assert self.compute_table is not None, "Call build_cost_tables first"
+        assert reduce in ["sum", "max"]
+        task_ids = np.asarray(task_ids, dtype=np.int64)
+        acc_ids = np.broadcast_to(np.asarray(acc_ids, dtype=np.int64), task_ids.shape)
+        compute = self.compute_table[task_ids, acc_ids]
+        pe_usage = self.pe_table[task_ids, acc_ids]
+        fetch = np.zeros(len(task_ids))
+        preds, counts = self._gather_predecessors(task_ids)
+        if len(preds):
+            dst = np.repeat(acc_ids, counts)
+            if pred_placements is None:
+                src = dst
+            else:
+                src = np.asarray(pred_placements, dtype=np.int64)[preds]
+                src = np.where(src < 0, dst, src)
+            times = self._volumes[preds] / 1e9 / self.bandwidth[src, dst] + self.latency[src, dst]
+            nonempty = counts > 0
+            offsets = (np.cumsum(counts) - counts)[nonempty]
+            ufunc = np.add if reduce == "sum" else np.maximum
+            fetch[nonempty] = ufunc.reduceat(times, offsets)
+        return compute, fetch, pe_usage
+
     def get_acc2task_kinds(self):
         return {acc_name: acc.supported_task for acc_name, acc in self.accelerator_graph.nodes.data('acc')}
 
@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class EvaluationCache(object):
+    """
+    Content-addressed on-disk store of accelerator evaluations.
+    The key is a hash of the mapping text together with every hardware
+    parameter, so different accelerators and configurations never collide.
+    It is backed by sqlite in WAL mode, several processes can read and
+    write the same file. The number of entries can be bounded, the least
+    recently used ones are evicted first.
+    """
+    EVICT_INTERVAL = 64
+
+    def __init__(self, path: str, max_entries: Optional[int] = None, timeout: float = 60) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._num_puts = 0
+        self._conn = None
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        self._pid = os.getpid()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS evaluations ("
+            "key TEXT PRIMARY KEY, "
+            "kind TEXT, "
+            "accelerator TEXT, "
+            "args TEXT, "
+            "hardware TEXT, "
+            "runtime REAL, "
+            "power REAL, "
+            "results TEXT, "
+            "last_access REAL)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS evaluations_access ON evaluations (last_access)")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared with forked workers
+        if self._conn is None or self._pid != os.getpid():
+            self._connect()
+        return self._conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_conn"] = None
+        state["_pid"] = None
+        return state
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+
+    @staticmethod
+    def make_key(kind: str, mapping: str, hardware: Dict[str, Any]) -> str:
+        contents = json.dumps([kind, mapping, sorted(hardware.items())])
+        return hashlib.sha256(contents.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[float, float]]:
+        """
+        Return (runtime cycles, power) or None
+        """
+        row = self.conn.execute(
+            "SELECT runtime, power FROM evaluations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE evaluations SET last_access = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def get_results(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the stored MaestroResults fields (lists of values) or None,
+        None too if the entry has no results
+        """
+        row = self.conn.execute(
+            "SELECT results FROM evaluations WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute(
+            "UPDATE evaluations SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, runtime: float, power: float, kind: str = "", accelerator: str = "",
+            args: Tuple[int] = (), hardware: Dict[str, Any] = {}, results: Dict[str, Any] = None):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, accelerator, json.dumps(list(args)), json.dumps(hardware),
+             float(runtime), float(power), json.dumps(results) if results is not None else None,
+             time.time()))
+        self._num_puts += 1
+        if self.max_entries is not None and self._num_puts % EvaluationCache.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """
+        Drop the least recently used entries beyond max_entries
+        """
+        if self.max_entries is None:
+            return
+        self.conn.execute(
+            "DELETE FROM evaluations WHERE key IN "
+            "(SELECT key FROM evaluations ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def records(self, kind: Optional[str] = None, accelerator: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Return the stored evaluations, optionally filtered
+        """
+        query = "SELECT kind, accelerator, args, hardware, runtime, power, results FROM evaluations"
+        conditions = []
+        values = []
+        if kind is not None:
+            conditions.append("kind = ?")
+            values.append(kind)
+        if accelerator is not None:
+            conditions.append("accelerator = ?")
+            values.append(accelerator)
+        if len(conditions):
+            query += " WHERE " + " AND ".join(conditions)
+        ret = []
+        for kind, accelerator, args, hardware, runtime, power, results in self.conn.execute(query, values):
+            ret.append({"kind": kind,
+                        "accelerator": accelerator,
+                        "args": tuple(json.loads(args)),
+                        "hardware": json.loads(hardware),
+                        "runtime": runtime,
+                        "power": power,
+                        "results": json.loads(results) if results is not None else None})
+        return ret
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def flush(self):
+        self.evict()
+        self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
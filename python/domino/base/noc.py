@@ -0,0 +1,161 @@
+import bisect
+from typing import Dict, List, Tuple
+
+INF = float("inf")
+# loads below this are treated as idle
+EPS = 1e-12
+
+
+class LinkTimeline(object):
+    """
+    Piecewise-constant bandwidth load of one link.
+    times are sorted breakpoints, loads[i] is the load (GB/s)
+    on [times[i], times[i+1]), the last segment is always idle.
+    """
+    __slots__ = ["capacity", "times", "loads"]
+
+    def __init__(self, capacity: float) -> None:
+        self.capacity = capacity
+        self.times = [0.0]
+        self.loads = [0.0]
+
+    def _split(self, time: float) -> int:
+        """
+        Make time a breakpoint and return its position
+        """
+        pos = bisect.bisect_right(self.times, time) - 1
+        if pos < 0:
+            self.times.insert(0, time)
+            self.loads.insert(0, 0.0)
+            return 0
+        if self.times[pos] == time:
+            return pos
+        self.times.insert(pos + 1, time)
+        self.loads.insert(pos + 1, self.loads[pos])
+        return pos + 1
+
+    def add(self, start: float, end: float, rate: float):
+        if end <= start:
+            return
+        first = self._split(start)
+        last = self._split(end)
+        for pos in range(first, last):
+            self.loads[pos] += rate
+            if abs(self.loads[pos]) <= EPS:
+                self.loads[pos] = 0.0
+        self._merge(first, last)
+
+    def _merge(self, first: int, last: int):
+        """
+        Drop the breakpoints in [first, last] that separate equal loads,
+        e.g., the ones left by a released reservation
+        """
+        times, loads = self.times, self.loads
+        lo, hi = max(first, 1), min(last + 1, len(times))
+        keep = [pos for pos in range(lo, hi) if abs(loads[pos] - loads[pos - 1]) > EPS]
+        if len(keep) < hi - lo:
+            times[lo:hi] = [times[pos] for pos in keep]
+            loads[lo:hi] = [loads[pos] for pos in keep]
+
+    def segment(self, time: float) -> Tuple[float, float]:
+        """
+        Return (free bandwidth at time, end of the current segment)
+        """
+        pos = bisect.bisect_right(self.times, time) - 1
+        load = self.loads[pos] if pos >= 0 else 0.0
+        end = self.times[pos + 1] if pos + 1 < len(self.times) else INF
+        return max(self.capacity - load, 0.0), end
+
+    def prune(self, time: float):
+        """
+        Drop the breakpoints before time, they can't affect new transfers.
+        Reservations before time can't be rolled back afterwards.
+        """
+        pos = bisect.bisect_right(self.times, time) - 1
+        if pos > 0:
+            del self.times[:pos]
+            del self.loads[:pos]
+
+
+class ContentionModel(object):
+    """
+    Link-level NoC contention.
+    A transfer follows its route and, at every instant, moves data at the
+    smallest of its uncontended pairwise bandwidth and the free bandwidth
+    of the links on the route. Bandwidth already reserved by earlier
+    transfers is kept, so the result only depends on the commit order.
+    Reservations are journaled when a journal is attached.
+    """
+
+    def __init__(self, capacities: Dict[Tuple[int, int], float], routes) -> None:
+        """
+        capacities: (src, dst) link -> bandwidth (GB/s)
+        routes: (src, dst) accelerator indices -> list of links
+        """
+        self.links = {link: LinkTimeline(capacity) for link, capacity in capacities.items()}
+        self.routes = routes
+        self._route_cache: Dict[Tuple[int, int], List[LinkTimeline]] = {}
+        self._journal = None
+
+    def route(self, src: int, dst: int) -> List[LinkTimeline]:
+        key = (src, dst)
+        if key not in self._route_cache:
+            self._route_cache[key] = [self.links[link] for link in self.routes(src, dst)]
+        return self._route_cache[key]
+
+    def transfer(self, volume: float, src: int, dst: int, bandwidth: float, start: float, reserve: bool = True) -> float:
+        """
+        Move volume GB from src to dst starting at start with at most
+        bandwidth GB/s, return the finish time.
+        Without reserve the links are only inspected.
+        """
+        links = self.route(src, dst)
+        if not len(links) or volume <= 0:
+            return start + volume / bandwidth
+        segments = []
+        time = start
+        remaining = volume
+        while remaining > EPS * volume:
+            rate = bandwidth
+            end = INF
+            for link in links:
+                free, seg_end = link.segment(time)
+                rate = min(rate, free)
+                end = min(end, seg_end)
+            if rate <= EPS:
+                # the route is saturated, wait for the next release
+                assert end < INF
+                time = end
+                continue
+            duration = remaining / rate
+            if time + duration <= end:
+                segments.append((time, time + duration, rate))
+                time += duration
+                break
+            segments.append((time, end, rate))
+            remaining -= rate * (end - time)
+            time = end
+        if reserve:
+            for seg_start, seg_end, rate in segments:
+                for link in links:
+                    link.add(seg_start, seg_end, rate)
+            if self._journal is not None:
+                self._journal.record(self._release, links, segments)
+        return time
+
+    def _release(self, links: List[LinkTimeline], segments: List[Tuple[float, float, float]]):
+        for seg_start, seg_end, rate in segments:
+            for link in links:
+                link.add(seg_start, seg_end, -rate)
+
+    def prune(self, time: float):
+        """
+        Drop the reservations ending before time, no transfer can start before it
+        """
+        for link in self.links.values():
+            link.prune(time)
+
+    def reset(self):
+        for link in self.links.values():
+            link.times = [0.0]
+            link.loads = [0.0]
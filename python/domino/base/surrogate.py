@@ -0,0 +1,97 @@
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class SurrogateModel(object):
+    """
+    Nearest-neighbour interpolation of MAESTRO results.
+    Points are grouped by (accelerator, kind, hardware params), the
+    mapping args are compared in log space and the log runtime and
+    log power of the k nearest points are averaged with inverse
+    distance weights. The confidence of a prediction decays with the
+    distance to the neighbours, an exact match has confidence 1.
+    Only the points with as many args as the query are compared, e.g.,
+    the tuned records have their dataflow params after the mapping args.
+    """
+
+    def __init__(self, k: int = 4, threshold: float = 0.5, min_points: int = 8) -> None:
+        self.k = k
+        # predictions below the threshold should be evaluated by MAESTRO
+        self.threshold = threshold
+        # groups with fewer points are never trusted
+        self.min_points = min_points
+        self._points: Dict[Tuple, Dict[Tuple[int], Tuple[float, float]]] = {}
+        # (key, number of args) -> (X, Y)
+        self._arrays: Dict[Tuple, Tuple[np.ndarray, np.ndarray]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(accelerator: str, kind: str, hardware: Dict[str, Any]) -> Tuple:
+        return (accelerator, kind, tuple(sorted(hardware.items())))
+
+    def __len__(self):
+        return sum(len(points) for points in self._points.values())
+
+    def add(self, key: Tuple, mapping_args: Tuple[int], runtime: float, power: float):
+        """
+        Add one evaluated point, runtime is in cycles
+        """
+        if runtime <= 0 or power <= 0:
+            return
+        self._points.setdefault(key, {})[tuple(mapping_args)] = (runtime, power)
+        self._arrays.pop((key, len(mapping_args)), None)
+
+    def fit(self, records: List[Dict[str, Any]]):
+        """
+        Add the records of an EvaluationCache
+        """
+        for record in records:
+            if record["hardware"] is None:
+                continue
+            key = SurrogateModel.make_key(record["accelerator"], record["kind"], record["hardware"])
+            self.add(key, record["args"], record["runtime"], record["power"])
+
+    def _get_arrays(self, key: Tuple, num_args: int):
+        if (key, num_args) not in self._arrays:
+            points = [(args, value) for args, value in self._points[key].items() if len(args) == num_args]
+            X = np.log1p(np.array([args for args, _ in points], dtype=np.float64).reshape(len(points), num_args))
+            Y = np.log(np.array([value for _, value in points], dtype=np.float64).reshape(len(points), 2))
+            self._arrays[(key, num_args)] = (X, Y)
+        return self._arrays[(key, num_args)]
+
+    def predict(self, key: Tuple, mapping_args: Tuple[int]) -> Optional[Tuple[float, float, float]]:
+        """
+        Return (runtime cycles, power, confidence) or None
+        """
+        points = self._points.get(key, None)
+        if points is None:
+            return None
+        mapping_args = tuple(mapping_args)
+        if mapping_args in points:
+            return points[mapping_args] + (1.0,)
+        X, Y = self._get_arrays(key, len(mapping_args))
+        if len(X) < self.min_points:
+            return None
+        x = np.log1p(np.array(mapping_args, dtype=np.float64))
+        distance = np.sqrt(((X - x) ** 2).sum(axis=1))
+        k = min(self.k, len(distance))
+        nearest = np.argpartition(distance, k - 1)[:k]
+        weights = 1 / distance[nearest]
+        runtime, power = np.exp((weights[:, None] * Y[nearest]).sum(axis=0) / weights.sum())
+        confidence = 1 / (1 + distance[nearest].mean())
+        return float(runtime), float(power), float(confidence)
+
+    def query(self, key: Tuple, mapping_args: Tuple[int]) -> Optional[Tuple[float, float]]:
+        """
+        Return the predicted (runtime cycles, power) if confident enough
+        """
+        prediction = self.predict(key, mapping_args)
+        if prediction is None or prediction[2] < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return prediction[:2]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "points": len(self)}
@@ -0,0 +1,138 @@
+import numpy as np
+from typing import Dict, List, Tuple
+from .acc_base import AccTask
+
+
+class TaskTable(object):
+    """
+    Struct-of-arrays storage of AccTasks.
+    Each task is one row: kind, shape params, output volume,
+    placement and timing are kept in NumPy columns, and the
+    dependencies are stored in CSR form.
+    Rows can be added from AccTask objects or as bare records,
+    the latter keeps million-task workloads small in memory.
+    """
+    KINDS = ["Conv2d", "Depthwise", "Gemm"]
+    MAX_PARAMS = 10
+
+    def __init__(self, capacity: int = 1024) -> None:
+        capacity = max(capacity, 1)
+        self.size = 0
+        self.kind = np.full(capacity, -1, dtype=np.int8)
+        self.params = np.zeros((capacity, TaskTable.MAX_PARAMS), dtype=np.int64)
+        self.num_params = np.zeros(capacity, dtype=np.int8)
+        self.output_volume = np.zeros(capacity, dtype=np.int64)
+        # placement, -1 means not placed yet
+        self.acc = np.full(capacity, -1, dtype=np.int32)
+        self.stream = np.full(capacity, -1, dtype=np.int32)
+        # timing
+        self.compute_start = np.zeros(capacity, dtype=np.float64)
+        self.compute_finish = np.zeros(capacity, dtype=np.float64)
+        self.pe_start = np.zeros(capacity, dtype=np.int64)
+        self.pe_finish = np.zeros(capacity, dtype=np.int64)
+        # dependencies in CSR form
+        self._pred_ptr = [0]
+        self._pred_idx = []
+        # accelerator names are stored by index
+        self.acc_names: List[str] = []
+        self._acc_ids: Dict[str, int] = {}
+        # AccTask unique id to row, only for rows added from AccTask
+        self._rows: Dict[int, int] = {}
+        self.tasks: List[AccTask] = []
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self):
+        if self.size < len(self.kind):
+            return
+        capacity = 2 * len(self.kind)
+        for name in ["kind", "num_params", "output_volume", "acc", "stream",
+                     "compute_start", "compute_finish", "pe_start", "pe_finish"]:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.acc[self.size:] = -1
+        self.stream[self.size:] = -1
+        params = np.zeros((capacity, TaskTable.MAX_PARAMS), dtype=np.int64)
+        params[:len(self.params)] = self.params
+        self.params = params
+
+    def add_record(self, task_kind: str, params: Tuple[int], output_volume: int, preds: List[int] = []) -> int:
+        """
+        Add a task row without an AccTask object.
+        preds are the rows of the parent tasks.
+        """
+        assert len(params) <= TaskTable.MAX_PARAMS, f"Too many params: {params}"
+        self._grow()
+        row = self.size
+        self.kind[row] = TaskTable.KINDS.index(task_kind)
+        self.params[row, :len(params)] = params
+        self.num_params[row] = len(params)
+        self.output_volume[row] = output_volume
+        for pred in preds:
+            assert pred < row, "Tasks should be added in topological order"
+            self._pred_idx.append(pred)
+        self._pred_ptr.append(len(self._pred_idx))
+        self.size += 1
+        return row
+
+    def add(self, task: AccTask) -> int:
+        """
+        Add an AccTask, its parent tasks should be added before.
+        """
+        assert task.unique_id not in self._rows, f"{task} is already in the table"
+        preds = [self._rows[p.unique_id] for p in task.depend_tasks]
+        row = self.add_record(task.task_kind, task.get_params(), task.get_output_data_volume(), preds)
+        self._rows[task.unique_id] = row
+        self.tasks.append(task)
+        return row
+
+    def extend(self, tasks: List[AccTask]) -> List[int]:
+        return [self.add(task) for task in tasks]
+
+    def row(self, task: AccTask) -> int:
+        return self._rows[task.unique_id]
+
+    def has(self, task: AccTask) -> bool:
+        return task.unique_id in self._rows
+
+    def task_kind(self, row: int) -> str:
+        return TaskTable.KINDS[self.kind[row]]
+
+    def get_params(self, row: int) -> Tuple[int]:
+        return tuple(int(x) for x in self.params[row, :self.num_params[row]])
+
+    def predecessors(self, row: int) -> List[int]:
+        return self._pred_idx[self._pred_ptr[row]:self._pred_ptr[row + 1]]
+
+    def csr(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return (pred_ptr, pred_idx), the parents of row i are
+        pred_idx[pred_ptr[i]:pred_ptr[i+1]]
+        """
+        return np.array(self._pred_ptr, dtype=np.int64), np.array(self._pred_idx, dtype=np.int64)
+
+    def acc_id(self, acc: str) -> int:
+        if acc not in self._acc_ids:
+            self._acc_ids[acc] = len(self.acc_names)
+            self.acc_names.append(acc)
+        return self._acc_ids[acc]
+
+    def place(self, row: int, acc: str, stream: int):
+        self.acc[row] = self.acc_id(acc)
+        self.stream[row] = stream
+
+    def sync(self):
+        """
+        Copy placement and timing of the committed AccTasks into the columns
+        """
+        for task in self.tasks:
+            row = self._rows[task.unique_id]
+            if task.acc is not None:
+                self.place(row, task.acc, task.stream)
+            self.compute_start[row] = task.compute_start
+            self.compute_finish[row] = task.compute_finish
+            self.pe_start[row] = task.pe_start
+            self.pe_finish[row] = task.pe_finish
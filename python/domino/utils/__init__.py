@@ -1,3 +1,5 @@
 from .maestro_evaluator import *
+from .maestro_pool import MaestroEvaluationPool, MaestroJob
 from .onnx_convertor import ONNXConvertor
-from .tflite_convertor import TfliteConvertor
\ No newline at end of file
+from .tflite_convertor import TfliteConvertor
+from .results_store import ResultsStore
@@ -1,7 +1,10 @@
+import io
 import os
+import re
+import csv
 import json
+import tempfile
 from subprocess import Popen, PIPE
-import pandas as pd
 import numpy as np
 from collections import namedtuple
 
@@ -97,60 +100,182 @@ def maestro_results_as_json(results: MaestroResults):
     return json.dumps(results._asdict())
 
 
-def run_maestro(mapping_file_name, command):
-    process = Popen(command, stdout=PIPE, stdin=PIPE)
+# MaestroResults field -> MAESTRO CSV column, the column names are
+# matched after stripping the spaces MAESTRO puts around them
+MAESTRO_CSV_COLUMNS = {
+    "runtime": "Runtime (Cycles)",
+    "runtime_series": "Runtime (Cycles)",
+    "throughput": "Throughput (MACs/Cycle)",
+    "energy": "Activity count-based Energy (nJ)",
+    "area": "Area",
+    "power": "Power",
+    "l1_size": "L1 SRAM Size Req (Bytes)",
+    "l2_size": "L2 SRAM Size Req (Bytes)",
+    "l1_size_series": "L1 SRAM Size Req (Bytes)",
+    "l2_size_series": "L2 SRAM Size Req (Bytes)",
+    "l1_input_read": "input l1 read",
+    "l1_weight_read": "filter l1 read",
+    "l1_output_read": "output l1 read",
+    "l1_input_write": "input l1 write",
+    "l1_weight_write": "filter l1 write",
+    "l1_output_write": "output l1 write",
+    "l2_input_read": "input l2 read",
+    "l2_weight_read": "filter l2 read",
+    "l2_output_read": "output l2 read",
+    "l2_input_write": "input l2 write",
+    "l2_weight_write": "filter l2 write",
+    "l2_output_write": "output l2 write",
+    "mac": "Num MACs",
+}
+MAESTRO_CSV_DTYPE = np.dtype([(column, np.float64) for column in dict.fromkeys(MAESTRO_CSV_COLUMNS.values())])
+
+
+def parse_maestro_csv(stream, layers=None):
+    """
+    Parse a MAESTRO result CSV from a text stream or string.
+    The header is read once, the columns are located by index
+    and every row fills one record of a NumPy structured array.
+    With layers, the rows are those of the named layers in order,
+    matched by the Layer Number column.
+    """
+    if isinstance(stream, str):
+        stream = io.StringIO(stream)
+    reader = csv.reader(stream)
+    header = [name.strip() for name in next(reader)]
+    try:
+        indices = [header.index(column) for column in MAESTRO_CSV_DTYPE.names]
+    except ValueError as e:
+        raise ValueError(f"Unexpected MAESTRO CSV header: {header}") from e
+    rows = [row for row in reader if len(row)]
+    if layers is not None:
+        layer_idx = header.index("Layer Number")
+        by_name = {row[layer_idx].strip(): row for row in rows}
+        missing = [layer for layer in layers if layer not in by_name]
+        if len(missing):
+            raise ValueError(f"Layers {missing} are not in the MAESTRO CSV")
+        rows = [by_name[layer] for layer in layers]
+    table = np.empty(len(rows), dtype=MAESTRO_CSV_DTYPE)
+    for i, row in enumerate(rows):
+        table[i] = tuple(float(row[idx]) for idx in indices)
+    return MaestroResults(*[table[MAESTRO_CSV_COLUMNS[field]] for field in MaestroResults._fields])
+
+
+def run_maestro(mapping_file_name, command, cwd=None, layers=None):
+    """
+    Run MAESTRO and parse ./<mapping_file_name>.csv.
+    The paths are relative to cwd (default: the current directory),
+    layers selects the rows, see parse_maestro_csv.
+    """
+    cwd = "." if cwd is None else cwd
+    process = Popen(command, stdout=PIPE, stdin=PIPE, cwd=cwd)
     stdout, stderr = process.communicate()
     process.wait()
-    
+    csv_file = os.path.join(cwd, f"{mapping_file_name}.csv")
+
     try:
-        df = pd.read_csv(f"./{mapping_file_name}.csv")
-        layer_name = df[" Layer Number"]
-        runtime = np.array(df[" Runtime (Cycles)"])
-        runtime_series = np.array(df[" Runtime (Cycles)"])
-        throughput = np.array(df[" Throughput (MACs/Cycle)"])
-        energy = np.array(
-            df[" Activity count-based Energy (nJ)"])
-        area = np.array(df[" Area"])
-        power = np.array(df[" Power"])
-        l1_size = np.array(df[" L1 SRAM Size Req (Bytes)"])
-        l2_size = np.array(df["  L2 SRAM Size Req (Bytes)"])
-        l1_size_series = np.array(
-            df[" L1 SRAM Size Req (Bytes)"])
-        l2_size_series = np.array(
-            df["  L2 SRAM Size Req (Bytes)"])
-        l1_input_read = np.array(df[" input l1 read"])
-        l1_input_write = np.array(df[" input l1 write"])
-        l1_weight_read = np.array(df["filter l1 read"])
-        l1_weight_write = np.array(df[" filter l1 write"])
-        l1_output_read = np.array(df["output l1 read"])
-        l1_output_write = np.array(df[" output l1 write"])
-        l2_input_read = np.array(df[" input l2 read"])
-        l2_input_write = np.array(df[" input l2 write"])
-        l2_weight_read = np.array(df[" filter l2 read"])
-        l2_weight_write = np.array(df[" filter l2 write"])
-        l2_output_read = np.array(df[" output l2 read"])
-        l2_output_write = np.array(df[" output l2 write"])
-        mac = np.array(df[" Num MACs"])
-        if os.path.exists(f"{mapping_file_name}.csv") and os.path.isfile(f"{mapping_file_name}.csv"):
-            os.remove(f"{mapping_file_name}.csv")
-        return MaestroResults(
-            runtime, runtime_series,
-            throughput, energy, area,
-            power, l1_size, l2_size, l1_size_series,
-            l2_size_series, l1_input_read, l1_weight_read,
-            l1_output_read, l1_input_write, l1_weight_write,
-            l1_output_write, l2_input_read, l2_weight_read,
-            l2_output_read, l2_input_write, l2_weight_write,
-            l2_output_write, mac
-        )
+        # MAESTRO can only write the CSV to a file, read it in one go
+        with open(csv_file, "r") as fin:
+            contents = fin.read()
+        os.remove(csv_file)
+        return parse_maestro_csv(contents, layers)
     except Exception as e:
         print(stdout)
-        with open(f"./{mapping_file_name}.m", "r") as fin:
+        with open(os.path.join(cwd, f"{mapping_file_name}.m"), "r") as fin:
             for line in fin:
                 print(line, end="")
         raise e
 
 
+def evaluate_maestro_mapping(
+    mapping_contents,
+    noc_bw,
+    off_chip_bw,
+    num_pes,
+    l1_size,
+    l2_size,
+    mapping_file_name="sample_mapping",
+    maestro_path=None,
+    layers=None,
+):
+    """
+    Evaluate one mapping in its own scratch directory.
+    Nothing is written to the current directory, so several
+    evaluations can run at the same time.
+    """
+    maestro_path = find_maestro() if maestro_path is None else maestro_path
+    with tempfile.TemporaryDirectory(prefix="maestro_") as scratch:
+        with open(os.path.join(scratch, f"{mapping_file_name}.m"), "w") as fout:
+            fout.write(mapping_contents)
+        command = generate_maestro_command(
+            maestro_path,
+            mapping_file_name,
+            noc_bw,
+            off_chip_bw,
+            num_pes,
+            l1_size,
+            l2_size,
+        )
+        return run_maestro(mapping_file_name, command, cwd=scratch, layers=layers)
+
+
+def network_layers(mapping_contents):
+    """
+    Return the Layer blocks of a "Network name { ... }" mapping
+    """
+    begin = mapping_contents.index("{")
+    end = mapping_contents.rindex("}")
+    assert mapping_contents[:begin].strip().startswith("Network"), "Not a MAESTRO network"
+    return mapping_contents[begin + 1:end].strip("\n")
+
+
+def network_layer_names(num_layers):
+    return [f"L{i}" for i in range(num_layers)]
+
+
+def pack_network(mappings, network_name="sample_net"):
+    """
+    Pack the layers of many single-layer mappings into one network,
+    the layers are renamed by network_layer_names so the CSV rows can be matched
+    """
+    layers = []
+    for name, mapping_contents in zip(network_layer_names(len(mappings)), mappings):
+        layer = re.sub(r"Layer\s+\S+\s*\{", f"Layer {name} {{", network_layers(mapping_contents), count=1)
+        layers.append(layer)
+    return f"Network {network_name} {{\n" + "\n".join(layers) + "\n}\n"
+
+
+def split_results(results: MaestroResults, num_layers):
+    """
+    Split the per-layer rows of a network run into per-layer MaestroResults,
+    the rows are in the order of the layers (see parse_maestro_csv)
+    """
+    assert len(results.runtime) == num_layers, f"Expect {num_layers} layers, got {len(results.runtime)}"
+    return [MaestroResults(*[np.asarray(field)[i:i + 1] for field in results]) for i in range(num_layers)]
+
+
+def evaluate_maestro_network(
+    mappings,
+    noc_bw,
+    off_chip_bw,
+    num_pes,
+    l1_size,
+    l2_size,
+    mapping_file_name="sample_network",
+    maestro_path=None,
+):
+    """
+    Evaluate many mappings on the same hardware with one MAESTRO run,
+    return the MaestroResults of each mapping in order
+    """
+    if len(mappings) == 1:
+        return [evaluate_maestro_mapping(mappings[0], noc_bw, off_chip_bw, num_pes, l1_size, l2_size,
+                                         maestro_path=maestro_path)]
+    results = evaluate_maestro_mapping(
+        pack_network(mappings), noc_bw, off_chip_bw, num_pes, l1_size, l2_size,
+        mapping_file_name=mapping_file_name, maestro_path=maestro_path, layers=network_layer_names(len(mappings)))
+    return split_results(results, len(mappings))
+
+
 if __name__ == "__main__":
     maestro_path = find_maestro()
     print(maestro_path)
@@ -0,0 +1,121 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List
+from .maestro_evaluator import evaluate_maestro_mapping, evaluate_maestro_network, find_maestro
+
+
+MaestroJob = namedtuple(
+    "MaestroJob",
+    [
+        "mapping_contents",
+        "noc_bw",
+        "off_chip_bw",
+        "num_pes",
+        "l1_size",
+        "l2_size",
+    ]
+)
+
+
+def evaluate_batch(jobs: List[MaestroJob], maestro_path: str):
+    """
+    Evaluate jobs on the same hardware with one MAESTRO run.
+    If the network fails, the jobs are evaluated one by one.
+    """
+    hardware = jobs[0][1:]
+    try:
+        return evaluate_maestro_network([job.mapping_contents for job in jobs], *hardware,
+                                        maestro_path=maestro_path)
+    except Exception:
+        if len(jobs) == 1:
+            raise
+        return [evaluate_maestro_mapping(*job, maestro_path=maestro_path) for job in jobs]
+
+
+class MaestroEvaluationPool(object):
+    """
+    A pool of MAESTRO subprocesses.
+    Every job runs in its own scratch directory, so jobs can be
+    evaluated concurrently. The work is done by the MAESTRO
+    subprocesses, a thread pool is enough in most cases.
+    Jobs on the same hardware are packed into networks of up to
+    batch_size layers, each network is a single MAESTRO run.
+    MAESTRO is only looked up when the first job is evaluated, so a pool
+    can be created when every shape may already be cached.
+    """
+
+    def __init__(self, num_workers: int = None, use_processes: bool = False, batch_size: int = 32) -> None:
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        assert self.num_workers > 0
+        assert batch_size > 0
+        self.use_processes = use_processes
+        self.batch_size = batch_size
+        self._maestro_path = None
+        self._executor = None
+
+    @property
+    def maestro_path(self):
+        if self._maestro_path is None:
+            self._maestro_path = find_maestro()
+        return self._maestro_path
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(self.num_workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.num_workers)
+        return self._executor
+
+    def submit(self, job: MaestroJob):
+        return self.executor.submit(evaluate_maestro_mapping, *job, maestro_path=self.maestro_path)
+
+    def batches(self, jobs: List[MaestroJob]) -> List[List[int]]:
+        """
+        Group the job indices by hardware, the groups are split so that
+        every worker gets some work and no network exceeds batch_size
+        """
+        groups = {}
+        for idx, job in enumerate(jobs):
+            groups.setdefault(job[1:], []).append(idx)
+        ret = []
+        for indices in groups.values():
+            size = min(self.batch_size, -(-len(indices) // self.num_workers))
+            ret += [indices[i:i + size] for i in range(0, len(indices), size)]
+        return ret
+
+    def evaluate_batch(self, jobs: List[MaestroJob]):
+        return evaluate_batch(jobs, self.maestro_path)
+
+    def evaluate_many(self, jobs: List[MaestroJob]):
+        """
+        Evaluate the jobs in parallel, return the MaestroResults in order
+        """
+        if len(jobs) == 0:
+            return []
+        batches = self.batches(jobs)
+        if self.num_workers == 1 or len(batches) == 1:
+            batch_results = [self.evaluate_batch([jobs[idx] for idx in batch]) for batch in batches]
+        else:
+            # a module-level function, the pool itself can't be sent to worker processes
+            futures = [self.executor.submit(evaluate_batch, [jobs[idx] for idx in batch], self.maestro_path)
+                       for batch in batches]
+            batch_results = [future.result() for future in futures]
+        ret = [None] * len(jobs)
+        for batch, results in zip(batches, batch_results):
+            for idx, result in zip(batch, results):
+                ret[idx] = result
+        return ret
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
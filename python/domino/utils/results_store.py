@@ -0,0 +1,249 @@
+import os
+import json
+import numpy as np
+from typing import Dict, Any, List, Sequence, Tuple, Union
+
+# the mapping args are padded to MAX_ARGS with -1
+MAX_ARGS = 12
+# categorical columns store int32 codes, the names are kept in the meta file
+CATEGORICAL_COLUMNS = ["accelerator", "kind"]
+HARDWARE_COLUMNS = ["freq", "num_pes", "noc_bw", "off_chip_bw", "l1_size", "l2_size"]
+# MaestroResults field -> column
+RESULT_COLUMNS = {
+    "runtime": "runtime",
+    "energy": "energy",
+    "power": "power",
+    "area": "area",
+    "throughput": "throughput",
+    "l1_size": "l1_size_req",
+    "l2_size": "l2_size_req",
+    "l1_input_read": "l1_input_read",
+    "l1_weight_read": "l1_weight_read",
+    "l1_output_read": "l1_output_read",
+    "l1_input_write": "l1_input_write",
+    "l1_weight_write": "l1_weight_write",
+    "l1_output_write": "l1_output_write",
+    "l2_input_read": "l2_input_read",
+    "l2_weight_read": "l2_weight_read",
+    "l2_output_read": "l2_output_read",
+    "l2_input_write": "l2_input_write",
+    "l2_weight_write": "l2_weight_write",
+    "l2_output_write": "l2_output_write",
+    "mac": "mac",
+}
+COLUMNS = ([(name, np.int32, ()) for name in CATEGORICAL_COLUMNS]
+           + [("args", np.int64, (MAX_ARGS,))]
+           + [(name, np.float64, ()) for name in HARDWARE_COLUMNS]
+           + [(name, np.float64, ()) for name in RESULT_COLUMNS.values()])
+
+
+class ResultsStore(object):
+    """
+    Append-only columnar store of evaluation results.
+    Every column is a memory-mapped .npy file under path, rows are
+    appended without rewriting the store and the capacity doubles
+    when it is full. Queries work on the columns directly, so
+    millions of rows can be filtered and grouped in seconds.
+    """
+
+    def __init__(self, path: str, initial_capacity: int = 1024) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta_file = os.path.join(path, "meta.json")
+        if os.path.exists(meta_file):
+            with open(meta_file, "r") as fin:
+                meta = json.load(fin)
+            self.num_rows = meta["num_rows"]
+            self.categories = meta["categories"]
+            capacity = meta["capacity"]
+            mode = "r+"
+        else:
+            self.num_rows = 0
+            self.categories = {name: [] for name in CATEGORICAL_COLUMNS}
+            capacity = initial_capacity
+            mode = "w+"
+        self._codes = {name: {value: code for code, value in enumerate(values)}
+                       for name, values in self.categories.items()}
+        self.columns = {name: self._open(name, dtype, shape, capacity, mode) for name, dtype, shape in COLUMNS}
+        if mode == "w+":
+            self.flush()
+
+    def _open(self, name, dtype, shape, capacity, mode, suffix=""):
+        file = os.path.join(self.path, f"{name}.npy{suffix}")
+        if mode == "r+":
+            return np.lib.format.open_memmap(file, mode="r+")
+        return np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=(capacity,) + shape)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.columns["runtime"])
+
+    def __len__(self):
+        return self.num_rows
+
+    def _reserve(self, num_rows: int):
+        capacity = self.capacity
+        if num_rows <= capacity:
+            return
+        while capacity < num_rows:
+            capacity *= 2
+        for name, dtype, shape in COLUMNS:
+            # the old file is replaced, not truncated, views of it stay valid
+            column = self._open(name, dtype, shape, capacity, "w+", suffix=".tmp")
+            column[:self.num_rows] = self.columns[name][:self.num_rows]
+            column.flush()
+            os.replace(os.path.join(self.path, f"{name}.npy.tmp"), os.path.join(self.path, f"{name}.npy"))
+            self.columns[name] = column
+
+    def _code(self, name: str, value: str) -> int:
+        codes = self._codes[name]
+        if value not in codes:
+            codes[value] = len(self.categories[name])
+            self.categories[name].append(value)
+        return codes[value]
+
+    def append(self, accelerator: str, kind: str, args: Sequence[int], hardware: Dict[str, Any], results):
+        """
+        Append one evaluation, results is a MaestroResults
+        """
+        self.append_many([(accelerator, kind, args, hardware, results)])
+
+    def append_many(self, rows: List[Tuple[str, str, Sequence[int], Dict[str, Any], Any]]):
+        """
+        Append (accelerator, kind, args, hardware, results) rows
+        """
+        start = self.num_rows
+        self._reserve(start + len(rows))
+        columns = self.columns
+        for i, (accelerator, kind, args, hardware, results) in enumerate(rows, start):
+            assert len(args) <= MAX_ARGS, f"At most {MAX_ARGS} args are supported"
+            columns["accelerator"][i] = self._code("accelerator", accelerator)
+            columns["kind"][i] = self._code("kind", kind)
+            columns["args"][i] = -1
+            columns["args"][i, :len(args)] = args
+            for name in HARDWARE_COLUMNS:
+                columns[name][i] = hardware.get(name, np.nan)
+            for field, name in RESULT_COLUMNS.items():
+                value = getattr(results, field, None)
+                # the results of a single layer are one-element arrays
+                columns[name][i] = np.nan if value is None else np.asarray(value).reshape(-1)[0]
+        self.num_rows = start + len(rows)
+
+    def flush(self):
+        for column in self.columns.values():
+            column.flush()
+        with open(os.path.join(self.path, "meta.json"), "w") as fout:
+            json.dump({"num_rows": self.num_rows, "capacity": self.capacity, "categories": self.categories}, fout)
+
+    def close(self):
+        self.flush()
+        self.columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Return the filled part of a column, categorical columns are codes
+        """
+        return self.columns[name][:self.num_rows]
+
+    def decode(self, name: str, codes: np.ndarray) -> np.ndarray:
+        return np.array(self.categories[name], dtype=object)[codes]
+
+    def mask(self, **filters) -> np.ndarray:
+        """
+        Return the rows matching every filter.
+        A filter is a value, a list of values, or a (low, high) range of a
+        numeric column, args can be filtered by position as arg0, arg1...
+        """
+        ret = np.ones(self.num_rows, dtype=bool)
+        for name, value in filters.items():
+            if name.startswith("arg") and name[3:].isdigit():
+                column = self.column("args")[:, int(name[3:])]
+            else:
+                column = self.column(name)
+            if name in CATEGORICAL_COLUMNS:
+                values = value if isinstance(value, list) else [value]
+                value = [self._codes[name].get(v, -1) for v in values]
+            if isinstance(value, tuple):
+                low, high = value
+                ret &= (column >= low) & (column <= high)
+            elif isinstance(value, list):
+                ret &= np.isin(column, value)
+            else:
+                ret &= column == value
+        return ret
+
+    def select(self, columns: List[str], mask: np.ndarray = None, **filters) -> Dict[str, np.ndarray]:
+        """
+        Return the given columns of the matching rows, categorical columns are decoded
+        """
+        if mask is None:
+            mask = self.mask(**filters)
+        ret = {}
+        for name in columns:
+            values = self.column(name)[mask]
+            ret[name] = self.decode(name, values) if name in CATEGORICAL_COLUMNS else values
+        return ret
+
+    def group_by(self, keys: Union[str, List[str]], value: str, reduce: str = "min", mask: np.ndarray = None):
+        """
+        Reduce value over the groups of keys with 'min', 'max', 'sum',
+        'mean' or 'count'. Return ({key: group keys}, reduced values)
+        """
+        keys = [keys] if isinstance(keys, str) else keys
+        rows = np.arange(self.num_rows) if mask is None else np.nonzero(mask)[0]
+        # combine the codes of the key columns one by one, they stay dense
+        inverse = np.zeros(len(rows), dtype=np.int64)
+        for name in keys:
+            column = self.column(name)[rows]
+            for sub in column.reshape(len(rows), -1).T:
+                uniques, codes = np.unique(sub, return_inverse=True)
+                _, inverse = np.unique(inverse * len(uniques) + codes.reshape(-1), return_inverse=True)
+                inverse = inverse.reshape(-1)
+        num_groups = int(inverse.max()) + 1 if len(rows) else 0
+        order = np.argsort(inverse, kind="stable")
+        starts = np.searchsorted(inverse[order], np.arange(num_groups))
+        values = self.column(value)[rows][order]
+        if reduce == "count":
+            reduced = np.diff(np.append(starts, len(rows)))
+        elif reduce == "sum":
+            reduced = np.add.reduceat(values, starts) if num_groups else values[:0]
+        elif reduce == "mean":
+            reduced = np.add.reduceat(values, starts) / np.diff(np.append(starts, len(rows))) if num_groups else values[:0]
+        elif reduce in ["min", "max"]:
+            ufunc = np.minimum if reduce == "min" else np.maximum
+            reduced = ufunc.reduceat(values, starts) if num_groups else values[:0]
+        else:
+            raise ValueError(f"Unknown reduce {reduce}")
+        first = rows[order[starts]]
+        ret = {}
+        for name in keys:
+            group_keys = self.column(name)[first]
+            ret[name] = self.decode(name, group_keys) if name in CATEGORICAL_COLUMNS else group_keys
+        return ret, reduced
+
+    def pareto(self, objectives: List[str] = ["runtime", "energy"], mask: np.ndarray = None) -> np.ndarray:
+        """
+        Return the row indices on the Pareto front, every objective is minimized
+        """
+        rows = np.arange(self.num_rows) if mask is None else np.nonzero(mask)[0]
+        points = np.stack([self.column(name)[rows] for name in objectives], axis=1)
+        # sorted lexicographically, a point can only be dominated by earlier ones
+        order = np.lexsort(points.T[::-1])
+        points, rows = points[order], rows[order]
+        if len(objectives) == 2:
+            # strictly better in the second objective than every earlier point
+            best = np.minimum.accumulate(points[:, 1])
+            keep = np.ones(len(points), dtype=bool)
+            keep[1:] = points[1:, 1] < best[:-1]
+            return rows[keep]
+        front = []
+        for i, point in enumerate(points):
+            if not len(front) or not np.any(np.all(points[front] <= point, axis=1)):
+                front.append(i)
+        return rows[front]
@@ -1,27 +1,32 @@
 from typing import Dict, Any, List, Set, Optional, Union, Tuple
 import networkx as nx 
 import os 
-from itertools import combinations, product
+from itertools import combinations, product, groupby
 from functools import reduce
+from collections import deque
 import math
 import random
 import time 
 from PIL import Image, ImageDraw
 import numpy as np
 import pickle as pkl
+import hashlib
 
 from domino.utils import ONNXConvertor
 from domino.graph_pass import set_graph_precision, GraphPrinter, GraphVisitor
 from domino.graph_ir import Op, SubGraph, Graph, Tensor, Attribute
-from domino.base import AcceleratorBase, AccTask, AccStream, SoCBase
+from domino.base import AcceleratorBase, AccTask, AccStream, SoCBase, TaskTable
 from domino.accelerator import ConvAccelerator, MeshSoC, NVDLA, GemmTPU, DepthwiseShiDianNao
 from domino.program_ir import ConstInt, ConstUInt, ConstFloat, ConstString, ExprList
 import matplotlib.pyplot as plt
 from domino import global_timer
 
 class ParallelMachineScheduler:
-    def __init__(self):
-        self.__cache = []
+    '''
+    With max_history > 0 the inputs of the last max_history schedule calls are kept for store
+    '''
+    def __init__(self, max_history: int = 0):
+        self.__cache = deque(maxlen=max_history)
     def schedule(self, 
                 num_resources: int, 
                 machines: List[str], 
@@ -30,14 +35,21 @@ class ParallelMachineScheduler:
                 timing: List[Dict[str, float]]):
         raise NotImplementedError()
     def regsiter(self, data):
-        self.__cache.append(data)
+        if self.__cache.maxlen:
+            self.__cache.append(data)
     def store(self, path):
         with open(path, 'wb') as f:
-            pkl.dump(self.__cache, f)
+            pkl.dump(list(self.__cache), f)
 
 class GreedyScheduler(ParallelMachineScheduler):
-    def __init__(self, resource_limit:Union[None, List[Tuple[int, Any]]] = None):
-        super(GreedyScheduler, self).__init__()
+    '''
+    List scheduling, the jobs are placed longest first on the machine finishing them earliest.
+    A job runs next to the jobs committed on the machine with it until a resource overflows,
+    then it waits for all of them. The resources of the machines are rows of a matrix, all 
+    candidate machines of a job are tried at once.
+    '''
+    def __init__(self, resource_limit:Union[None, List[Tuple[int, Any]]] = None, max_history: int = 0):
+        super(GreedyScheduler, self).__init__(max_history)
         self.resource_limit = resource_limit 
 
     def __str__(self):
@@ -51,72 +63,71 @@ class GreedyScheduler(ParallelMachineScheduler):
                 timing: List[Dict[str, float]]):
         self.regsiter((num_resources, machines, resource_costraint, resource_requirement, timing))
 
+        machine_ids = {machine: i for i, machine in enumerate(machines)}
+        constraint = np.array([resource_costraint[machine] for machine in machines], dtype=np.float64).reshape(len(machines), num_resources)
         if self.resource_limit is not None:
             for rid, limit in self.resource_limit: 
-                for acc in resource_costraint:
-                    resource_costraint[acc][rid] = min(resource_costraint[acc][rid], limit)
+                constraint[:, rid] = np.minimum(constraint[:, rid], limit)
         
-        resource_used = {machine: [0] * num_resources for machine in machines} # 
-        machine_commit_time = {machine: 0 for machine in machines}
-        machine_finish_time = {machine: 0 for machine in machines}
-        ids = sorted(range(len(resource_requirement)), key = lambda i: np.min(list(timing[i].values())), reverse= True) 
-        resource_occupancy = {machine: [0]*num_resources for machine in machines}
+        # the candidate machines of all jobs in the order of timing, the first best one is taken
+        cand_machines = []
+        cand_times = []
+        cand_requirements = []
+        offsets = [0]
+        for job_timing, job_requirement in zip(timing, resource_requirement):
+            for machine, job_time in job_timing.items():
+                cand_machines.append(machine_ids[machine])
+                cand_times.append(job_time)
+                cand_requirements.append(job_requirement[machine])
+            offsets.append(len(cand_machines))
+        cand_machines = np.array(cand_machines, dtype=np.int64)
+        cand_times = np.array(cand_times, dtype=np.float64)
+        cand_requirements = np.array(cand_requirements, dtype=np.float64).reshape(len(cand_machines), num_resources)
         
-        def put(machine, job_id):  
-            machine_resource_constraint = resource_costraint[machine] 
-            commit_time = machine_commit_time[machine]
-            job_time = timing[job_id][machine]
-            finish_time = max(commit_time + job_time, machine_finish_time[machine])
-            resource_usage_before = resource_used[machine]
-            resource_usage_after = [x+y for x, y in zip(resource_requirement[job_id][machine], resource_usage_before)]
-            need_reset = reduce(lambda x,y: x or y, [x>y for x,y in zip(resource_usage_after, machine_resource_constraint)], False)
-            if need_reset:
-                resource_usage_before = [0] * num_resources 
-                resource_usage_after = resource_requirement[job_id][machine]
-                commit_time = machine_finish_time[machine] 
-                finish_time = commit_time + job_time 
-            return finish_time, commit_time, job_time, resource_usage_before, resource_usage_after  
+        resource_used = np.zeros((len(machines), num_resources))
+        machine_commit_time = np.zeros(len(machines))
+        machine_finish_time = np.zeros(len(machines))
+        resource_occupancy = np.zeros((len(machines), num_resources))
+        # longest first, the ties keep their order
+        ids = np.argsort(-np.minimum.reduceat(cand_times, offsets[:-1]), kind="stable").tolist() if len(timing) else []
         
         placement = {}
         schedule = {}
-                
+        elapsed = 0
         for id in ids:
-            best_finish_time = math.inf 
-            best_machine = None
-            for machine in timing[id].keys():
-                finish_time, commit_time,job_time,_,_ = put(machine, id)
-                if finish_time < best_finish_time: 
-                    best_finish_time = finish_time
-                    best_machine = machine 
+            begin, end = offsets[id], offsets[id + 1]
+            cand, job_time, requirement = cand_machines[begin:end], cand_times[begin:end], cand_requirements[begin:end]
+            resource_usage_after = resource_used[cand] + requirement
+            need_reset = (resource_usage_after > constraint[cand]).any(axis=1)
+            finish_time = np.where(need_reset, 
+                                   machine_finish_time[cand] + job_time, 
+                                   np.maximum(machine_commit_time[cand] + job_time, machine_finish_time[cand]))
+            best = int(np.argmin(finish_time))
+            best_finish_time = finish_time[best]
             assert best_finish_time < math.inf 
-            finish_time, commit_time, job_time, resource_usage_before, resource_usage_after = put(best_machine, id)
-            placement[id] = (best_machine, resource_usage_before)
-            schedule[id] = commit_time
-            resource_used[best_machine] = resource_usage_after 
-            machine_finish_time[best_machine] = finish_time 
-            machine_commit_time[best_machine] = commit_time
-            for i, r in enumerate(resource_requirement[id][best_machine]):
-                resource_occupancy[best_machine][i] += job_time * r       
-        
-        elapsed = max(list(machine_finish_time.values()))
-        
-        for machine in machines: 
-            for i in range(num_resources):
-                if elapsed * resource_costraint[machine][i] == 0:
-                    print ('resource constraint', resource_costraint)
-                    print('timing', timing)
-                    print ('resource requirement', resource_requirement)
-                    print ('elapsed: ', elapsed, 'machine', machine, 'i', i)
-                resource_occupancy[machine][i] /= elapsed * resource_costraint[machine][i]
-        # print (f'schedule {len(timing)} to {len(machines)} machines, resource_occypancy is {resource_occupancy}')
-        # # print('elapsed', elapsed)
-        # print('timing', timing)
-        # print('resource usage', resource_requirement)
-        # print('resource constraint', resource_costraint)
+            machine = cand[best]
+            if need_reset[best]:
+                resource_usage_before = [0] * num_resources 
+                resource_used[machine] = requirement[best]
+                machine_commit_time[machine] = machine_finish_time[machine]
+            else:
+                resource_usage_before = [int(x) if x.is_integer() else x for x in resource_used[machine].tolist()]
+                resource_used[machine] = resource_usage_after[best]
+            machine_finish_time[machine] = best_finish_time
+            placement[id] = (machines[machine], resource_usage_before)
+            schedule[id] = machine_commit_time[machine].item()
+            resource_occupancy[machine] += job_time[best] * requirement[best]
+            # the makespan is a running max of the finish times
+            elapsed = max(elapsed, best_finish_time.item())
         
-        # print('placement', placement)
-        # print('schedule', schedule)
-        # print('resource_occupancy', resource_occupancy)
+        if (elapsed * constraint == 0).any():
+            print ('resource constraint', resource_costraint)
+            print('timing', timing)
+            print ('resource requirement', resource_requirement)
+            print ('elapsed: ', elapsed)
+            raise ZeroDivisionError('the makespan or a resource constraint is 0')
+        resource_occupancy /= elapsed * constraint
+        resource_occupancy = {machine: resource_occupancy[i].tolist() for i, machine in enumerate(machines)}
         
         return elapsed, placement, schedule, resource_occupancy 
 
@@ -183,9 +194,10 @@ class ComputationGraph:
             acc2busyPeriod[acc].append([node['start'], node['end'], node, nid])
         return True
 
-    def map(self, soc: SoCBase) -> float:
+    def map(self, soc: SoCBase, deadline: Optional[float] = None, checkpoint: Optional[str] = None) -> float:
         self.reset()
-        return self.mapper(soc)
+        soc.prefetch([task for _, task in self.g.nodes.data('task')])
+        return self.mapper.map(soc, deadline, checkpoint)
         # assert (self.check())
 
     def lower_bound(self, soc: SoCBase):
@@ -195,10 +207,11 @@ class ComputationGraph:
         for nid in nx.topological_sort(self.g):
             node = self.g.nodes[nid]
             task = node['task']
-            acc_name = accs[MapperBase.op2task[node['op'].name]][0]
-            acc = soc.accelerator_graph.nodes[acc_name]['acc']
             params = task.get_params()
-            exec_time[nid] = acc.evaluate_compute(*params)[0] + (max(exec_time[pred] for pred in self.g.pred[nid]) if self.g.pred[nid] else 0)
+            # the fastest accelerator of the node
+            compute_time = min(soc.accelerator_graph.nodes[acc_name]['acc'].evaluate_compute(*params)[0] 
+                               for acc_name in accs[MapperBase.op2task[node['op'].name]])
+            exec_time[nid] = compute_time + (max(exec_time[pred] for pred in self.g.pred[nid]) if self.g.pred[nid] else 0)
         return max(exec_time.values())
 
     def visualize_packing(self, soc: SoCBase, complete_time: float, filepath: str = "packing"):
@@ -233,25 +246,100 @@ class MapperBase:
         Op.OpName.MatrixOp.Gemm:"Gemm",
         Op.OpName.MatrixOp.MatMul:"Gemm"
     }
+    # seconds between two periodic checkpoints of the search state
+    checkpoint_interval = 60
     # the complete time if we map op to acc 
     def __init__(self, verbose: bool = False):
         self.g = nx.DiGraph()
         self.verbose = verbose 
+        self.deadline = None
+        self.checkpoint_path = None
+        self.last_checkpoint = 0
+        self.search_settings = None
+    
+    '''
+    Anytime mapping. The search stops at the deadline (seconds from now) and maps with the best 
+    state so far. With a checkpoint path, the search state is saved every checkpoint_interval
+    seconds and at the end, and a later run of the same mapper on the same graph and settings resumes from it.
+    '''
+    def map(self, soc: SoCBase, deadline: Optional[float] = None, checkpoint: Optional[str] = None) -> float:
+        self.deadline = None if deadline is None else time.time() + deadline
+        self.checkpoint_path = checkpoint
+        self.search_settings = MapperBase.get_search_settings(soc)
+        self.last_checkpoint = time.time()
+        return self(soc)
+    
+    def out_of_time(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+    
+    def checkpoint_due(self) -> bool:
+        return self.checkpoint_path is not None and time.time() - self.last_checkpoint >= MapperBase.checkpoint_interval
+    
+    @staticmethod
+    def get_search_settings(soc: SoCBase) -> Dict[str, Any]:
+        '''
+        The settings the latencies of a search depend on, a checkpoint is only resumed with the same ones
+        '''
+        accs = [soc.accelerator_graph.nodes[acc]['acc'] for acc in soc.acc_names]
+        return {'cost_model': [acc.get_cost_model() for acc in accs],
+                'tune': [acc.tuner is not None for acc in accs],
+                'event_driven': soc.event_driven,
+                'contention': soc.contention is not None}
+    
+    def save_search_state(self, state: Any):
+        if self.checkpoint_path is None:
+            return
+        # written aside and renamed, an interrupted save keeps the old checkpoint
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pkl.dump({'mapper': type(self).__name__, 'tasks': self.task_nids, 'settings': self.search_settings, 'state': state}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+        self.last_checkpoint = time.time()
+    
+    def load_search_state(self) -> Any:
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, 'rb') as f:
+            data = pkl.load(f)
+        if data['mapper'] != type(self).__name__ or data['tasks'] != self.task_nids or data.get('settings') != self.search_settings:
+            print(f'[WARNING] {self.checkpoint_path} is the checkpoint of another search, ignored')
+            return None
+        return data['state']
     
     def set_cg(self, cg:ComputationGraph):
         self.cg = cg 
+        # rows of the tasks for SoCBase.eval_batch
+        self.task_table = TaskTable(len(cg.g.nodes))
+        self.task_rows = {}
+        self.task_nids = []
+        for nid in nx.topological_sort(cg.g):
+            self.task_rows[nid] = self.task_table.add(cg.g.nodes[nid]['task'])
+            self.task_nids.append(nid)
+    
+    def batch_placements(self, task_placement: Dict[int, Tuple[str, int]]) -> np.ndarray:
+        '''
+        Accelerator index of every task row for SoCBase.eval_batch, -1 if not placed
+        '''
+        ret = np.full(len(self.task_nids), -1, dtype=np.int64)
+        for nid, (acc, _) in task_placement.items():
+            ret[self.task_rows[nid]] = self.soc.acc_index[acc]
+        return ret
     
     '''
     Commit a bunch of ops. 
+    With simulate=True the SoC is rolled back afterwards, only the complete time is returned.
     '''
     def commit(self, soc: SoCBase, nodes: List[int], streams: Tuple[Tuple[AcceleratorBase, int]], simulate: bool = False):
         current_time = soc.elapsed_time
         assert len(nodes) == len(streams)
+        mark = soc.checkpoint() if simulate else None
         for id, stream in zip(nodes, streams):
             soc.push_task(self.cg.g.nodes[id]['task'], *stream)
         
         complete_time = soc.commit_all_tasks() 
-        if not simulate:
+        if simulate:
+            soc.rollback(mark)
+        else:
             for id, stream in zip(nodes, streams):
                 if self.verbose:
                     print(f'Bind {id} to {stream} at {current_time} to {complete_time}')
@@ -265,6 +353,7 @@ class MapperBase:
     def commit_rr(self, soc: SoCBase, nodes: List[int], simulate: bool = False):
         current_time = soc.elapsed_time
         streams = soc.get_all_streams()
+        mark = soc.checkpoint() if simulate else None
         
         counter = {task_kind: 0 for task_kind in streams}
         
@@ -275,7 +364,9 @@ class MapperBase:
             counter[task.task_kind] = (idx+1) % len(streams[task.task_kind])
         
         complete_time = soc.commit_all_tasks() 
-        if not simulate:
+        if simulate:
+            soc.rollback(mark)
+        else:
             for id, stream in zip(nodes, streams):
                 if self.verbose:
                     print(f'Bind {id} to {stream} at {current_time} to {complete_time}')
@@ -427,34 +518,95 @@ def visualize_subgraph(graph, subgraphs: List[List[int]], name = 'g'):
     cmd = f'dot -Tpng tmp.gv -o {name}.png'
     os.system(cmd)
 
-def get_graph(models: List[str]):
+MODEL_PATHS = {
+    'resnet18': "./graph/raw_resnet18.onnx",
+    'mobilenet': "./graph/raw_mobilenetv2.onnx",
+    'resnet50': "./graph/raw_resnet50.onnx",
+    'yolo': "./graph/yolov5s_640x640.simplify.onnx",
+    'GoogLeNet': "./graph/googlenet-12.onnx",
+    'SSD-M': './graph/ssd_mobilenet_v1_10.onnx',
+    'efficientnet': './graph/efficientnet-lite4-11.onnx',
+    'super_resolution': "./graph/super_resolution.onnx",
+    'bert': "./graph/simplified_bert_base.onnx",
+    'lstm': "./graph/multi_layer_lstm.onnx",
+}
+
+# sha256 of the onnx file -> (converted graph, number of ops of the model)
+model_cache: Dict[str, Tuple[nx.DiGraph, int]] = {}
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_model(model_path: str, cache_dir: Optional[str] = None) -> Tuple[nx.DiGraph, int]:
+    '''
+    Parse and convert an onnx model once, the graph is kept in memory and,
+    with cache_dir, pickled to disk keyed by the hash of the file.
+    The graph is a template, use replicate_graph to get graphs to map.
+    '''
+    key = file_hash(model_path)
+    if key in model_cache:
+        return model_cache[key]
+    cache_file = os.path.join(cache_dir, f'graph-{key}.pkl') if cache_dir is not None else None
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            model_cache[key] = pkl.load(f)
+        return model_cache[key]
+    convertor = ONNXConvertor(model_path, inference=True)
     irConverter = GraphIRConverter()
-    n_node = 0
-    for model in models:
-        if model == 'resnet18':
-            model_path = "./graph/raw_resnet18.onnx"
-        elif model == "mobilenet":
-            model_path = "./graph/raw_mobilenetv2.onnx"
-        elif model == "resnet50":
-            model_path = "./graph/raw_resnet50.onnx"
-        elif model == "yolo": 
-            model_path = "./graph/yolov5s_640x640.simplify.onnx"
-        elif model == "GoogLeNet":
-            model_path = "./graph/googlenet-12.onnx"
-        elif model == "SSD-M":
-            model_path = './graph/ssd_mobilenet_v1_10.onnx'
-        elif model == 'efficientnet':
-            model_path = './graph/efficientnet-lite4-11.onnx'
-        elif model == "super_resolution":
-            model_path = "./graph/super_resolution.onnx"
-        elif model == 'bert':
-            model_path = "./graph/simplified_bert_base.onnx"
-        elif model == "lstm":
-            model_path = "./graph/multi_layer_lstm.onnx"
-        else:
+    irConverter(convertor.parse())
+    g = irConverter.postprocess()
+    # the ids of the ops not kept in g are skipped too
+    model_cache[key] = (g, len(irConverter.op2index))
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(cache_file + '.tmp', 'wb') as f:
+                pkl.dump(model_cache[key], f)
+            os.replace(cache_file + '.tmp', cache_file)
+        except (pkl.PicklingError, RecursionError) as e:
+            print(f'[WARNING] {model_path} is not cached on disk: {e}')
+    return model_cache[key]
+
+def replicate_graph(g: nx.DiGraph, copies: int, stride: Optional[int] = None, base: int = 0, out: Optional[nx.DiGraph] = None) -> nx.DiGraph:
+    '''
+    Stamp copies of g into out, copy k has the ids of g shifted by base + k * stride.
+    The ops are shared with g, every copy has its own tasks.
+    '''
+    nodes = list(g.nodes)
+    if stride is None:
+        stride = max(nodes) + 1 if nodes else 0
+    index = {nid: i for i, nid in enumerate(nodes)}
+    preds = [[index[p] for p in g.pred[nid]] for nid in nodes]
+    templates = [g.nodes[nid]['task'] for nid in nodes]
+    ids = np.array(nodes, dtype=np.int64)
+    edges = np.array(list(g.edges), dtype=np.int64).reshape(-1, 2)
+    ret = nx.DiGraph() if out is None else out
+    for k in range(copies):
+        shift = base + k * stride
+        new_ids = (ids + shift).tolist()
+        tasks = [AccTask(f'T{nid}', task.task_kind, task.params) for nid, task in zip(new_ids, templates)]
+        for task, pred in zip(tasks, preds):
+            task.depend_tasks = [tasks[i] for i in pred]
+        ret.add_nodes_from((nid, dict(g.nodes[old], task = task)) for nid, old, task in zip(new_ids, nodes, tasks))
+        ret.add_edges_from((edges + shift).tolist())
+    return ret
+
+def get_graph(models: List[str], cache_dir: Optional[str] = None):
+    '''
+    The graph of the models mapped together, each model is parsed once and the 
+    repeated ones are replicated, the node ids are the same as converting the models one by one
+    '''
+    ret = nx.DiGraph()
+    n_op = 0
+    for model, group in groupby(models):
+        if model not in MODEL_PATHS:
             raise RuntimeError(f'unknown model {model}')
-        convertor = ONNXConvertor(model_path, inference=True)
-        graph  = convertor.parse()
-        irConverter(graph)
-    
-    return irConverter.postprocess()
+        copies = len(list(group))
+        g, num_ops = load_model(MODEL_PATHS[model], cache_dir)
+        replicate_graph(g, copies, stride = num_ops, base = n_op, out = ret)
+        n_op += copies * num_ops
+    return ret
@@ -0,0 +1,241 @@
+from typing import Dict, Any, List, Optional, Tuple
+import networkx as nx
+import io
+import time
+import random
+import tracemalloc
+import contextlib
+import numpy as np
+
+from domino.graph_ir import Op
+from domino.base import AcceleratorBase, AccTask, SoCBase
+from domino.accelerator import MeshSoC, NVDLA, GemmTPU, DepthwiseShiDianNao
+
+from base import ComputationGraph, MapperBase, GreedyScheduler
+from h2h_mapper import GreedyMapper
+from evolution_mapper import EvolutionMapper, Population
+from dp_mapper import DPMapper, SimpleGrouper, SimplePlacer
+from bnb_mapper import BranchAndBoundMapper
+
+'''
+Timing benchmark of the mappers on synthetic graphs, no onnx model and no MAESTRO needed.
+The tasks are costed by the analytical model.
+'''
+
+KIND2OP = {
+    'Conv2d': Op.OpName.ConvOp.Conv2d,
+    'Depthwise': Op.OpName.ConvOp.DepthwiseConv2d,
+    'Gemm': Op.OpName.MatrixOp.Gemm
+}
+
+# a few shapes per kind, the cost tables only have a few distinct entries
+SHAPES = {
+    'Conv2d': [{'H': h, 'W': h, 'P': h, 'Q': h, 'K': k, 'C': c, 'R': 3, 'S': 3, 'stride_h': 1, 'stride_w': 1}
+               for h in [14, 28, 56] for k in [32, 64, 128] for c in [32, 64]],
+    'Depthwise': [{'H': h, 'W': h, 'P': h, 'Q': h, 'K': k, 'M': 1, 'R': 3, 'S': 3, 'stride_h': 1, 'stride_w': 1}
+                  for h in [14, 28, 56] for k in [32, 64, 128]],
+    'Gemm': [{'B': 1, 'M': m, 'N': n, 'K': k} for m in [64, 256] for n in [64, 256, 512] for k in [64, 256]]
+}
+
+class SyntheticOp:
+    '''
+    Stands for a graph_ir op, the mappers only read its name and config
+    '''
+    def __init__(self, name, config: Dict[str, int]):
+        self.name = name
+        self.config = config
+    def get_config(self):
+        return self.config
+
+def make_graph(n: int, edges: List[Tuple[int, int]], mix: Dict[str, float], seed: int = 0) -> nx.DiGraph:
+    '''
+    The graph of n tasks with the attributes of get_graph, the kinds are drawn with the weights of mix
+    '''
+    rng = np.random.default_rng(seed)
+    kinds = list(mix.keys())
+    weights = np.array([mix[k] for k in kinds], dtype=np.float64)
+    task_kinds = rng.choice(len(kinds), size=n, p=weights / weights.sum())
+    ops = {kind: [SyntheticOp(KIND2OP[kind], shape) for shape in SHAPES[kind]] for kind in kinds}
+    shapes = [rng.integers(len(ops[kind]), size=n) for kind in kinds]
+    g = nx.DiGraph()
+    for nid in range(n):
+        kind = task_kinds[nid]
+        op = ops[kinds[kind]][shapes[kind][nid]]
+        g.add_node(nid, op = op, task = AccTask(f'T{nid}', kinds[kind], op.get_config()), start = 0.0, end = 0.0, acc = (None, None))
+    g.add_edges_from(edges)
+    for nid in g.nodes:
+        g.nodes[nid]['task'].depend_tasks = [g.nodes[i]['task'] for i in g.pred[nid]]
+    return g
+
+def layered_dag(n: int, width: int = 8, mix: Dict[str, float] = {'Conv2d': 2, 'Depthwise': 1, 'Gemm': 1},
+                seed: int = 0, max_fan_in: int = 2) -> nx.DiGraph:
+    '''
+    Layers of 1 to width tasks, every task depends on 1 to max_fan_in tasks of the layer before
+    '''
+    rng = np.random.default_rng(seed)
+    edges = []
+    prev = []
+    nid = 0
+    while nid < n:
+        layer = list(range(nid, min(n, nid + int(rng.integers(1, width + 1)))))
+        if prev:
+            for v in layer:
+                fan_in = min(len(prev), int(rng.integers(1, max_fan_in + 1)))
+                edges += [(prev[i], v) for i in rng.choice(len(prev), size=fan_in, replace=False)]
+        prev = layer
+        nid += len(layer)
+    return make_graph(n, edges, mix, seed)
+
+def series_parallel_dag(n: int, width: int = 8, mix: Dict[str, float] = {'Conv2d': 2, 'Depthwise': 1, 'Gemm': 1},
+                        seed: int = 0, max_branch: int = 4) -> nx.DiGraph:
+    '''
+    A chain of blocks like the modules of a network, a block is a single task or
+    a fork of 2 to width branches (chains of 1 to max_branch tasks) joined by one task
+    '''
+    rng = np.random.default_rng(seed)
+    edges = []
+    tail = None
+    nid = 0
+    def chain(start, length):
+        edges.extend((i, i + 1) for i in range(start, start + length - 1))
+        return start, start + length - 1
+    while nid < n:
+        num_branches = int(rng.integers(1, width + 1))
+        lengths = rng.integers(1, max_branch + 1, size=num_branches)
+        if num_branches == 1 or nid + lengths.sum() + 1 > n:
+            if tail is not None:
+                edges.append((tail, nid))
+            tail = nid
+            nid += 1
+            continue
+        join = nid + int(lengths.sum())
+        for length in lengths:
+            head, last = chain(nid, int(length))
+            if tail is not None:
+                edges.append((tail, head))
+            edges.append((last, join))
+            nid += int(length)
+        tail = join
+        nid += 1
+    return make_graph(n, edges, mix, seed)
+
+GENERATORS = {
+    'layered': layered_dag,
+    'series_parallel': series_parallel_dag
+}
+
+def make_soc() -> SoCBase:
+    return MeshSoC([[NVDLA('NVDLA(0,0)', 2), NVDLA('NVDLA(0,1)', 2)],
+                    [DepthwiseShiDianNao("ShiDianNao(1,0)"), GemmTPU("GemmTPU(1,1)", 2)]])
+
+def make_mapper(alg: str, beam_width: int = 4, node_budget: int = 10000) -> MapperBase:
+    if alg == 'H2H':
+        return GreedyMapper(scheduler = GreedyScheduler(resource_limit=[(0,1)]))
+    elif alg == 'COMB':
+        return EvolutionMapper(scheduler = GreedyScheduler())
+    elif alg == 'MAGMA':
+        return EvolutionMapper(scheduler = GreedyScheduler(resource_limit=[(0,1)]))
+    elif alg == 'DP':
+        return DPMapper(SimpleGrouper(), SimplePlacer(), beam_width = beam_width)
+    elif alg == 'BNB':
+        return BranchAndBoundMapper(scheduler = GreedyScheduler(resource_limit=[(0,1)]), node_budget = node_budget)
+    raise RuntimeError(f'unknow alg {alg}')
+
+# the placer of DP tries every accelerator combination of a group of tasks,
+# it blows up on wide graphs, larger graphs are skipped
+MAX_NODES = {
+    'DP': 200
+}
+
+class EvaluationCounter:
+    '''
+    Count the placements evaluated through the soc and the scheduler of a mapper
+    '''
+    def __init__(self):
+        self.count = 0
+    def wrap(self, obj, method: str, size = lambda *args, **kwargs: 1):
+        func = getattr(obj, method)
+        def counted(*args, **kwargs):
+            self.count += size(*args, **kwargs)
+            return func(*args, **kwargs)
+        setattr(obj, method, counted)
+
+def run_mapper(alg: str, graph_fn, trace_memory: bool = False, deadline: Optional[float] = None, **mapper_kwargs) -> Dict[str, Any]:
+    random.seed(1)
+    np.random.seed(1)
+    g = graph_fn()
+    mapper = make_mapper(alg, **mapper_kwargs)
+    cg = ComputationGraph(g, mapper)
+    with contextlib.redirect_stdout(io.StringIO()):
+        soc = make_soc()
+    counter = EvaluationCounter()
+    counter.wrap(soc, 'eval_batch', lambda task_ids, *args, **kwargs: len(task_ids))
+    counter.wrap(soc, 'eval_communication')
+    if getattr(mapper, 'scheduler', None) is not None:
+        counter.wrap(mapper.scheduler, 'schedule')
+    if trace_memory:
+        tracemalloc.start()
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        latency = cg.map(soc, deadline)
+    seconds = time.time() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'latency': latency, 'seconds': seconds, 'evaluations': counter.count, 'peak_memory': peak,
+            'lower_bound': cg.lower_bound(soc)}
+
+def main(algs: List[str], sizes: List[int], shapes: List[str], width: int = 8, mix: Dict[str, float] = {'Conv2d': 2, 'Depthwise': 1, 'Gemm': 1},
+         seed: int = 0, trace_memory: bool = False, deadline: Optional[float] = None, output: Optional[str] = None, **mapper_kwargs):
+    '''
+    Map every graph with every mapper, the evaluations are the placements scored by the soc 
+    and the scheduler, the ratio is the latency over the critical path bound. The peak memory is measured in a second run as tracing slows the mapper down
+    '''
+    columns = ['shape', 'nodes', 'alg', 'seconds', 'evals/s', 'peak MB', 'latency', 'lower_bound', 'ratio']
+    rows = []
+    print(' '.join(f'{c:>15}' for c in columns))
+    for shape in shapes:
+        for n in sizes:
+            graph_fn = lambda: GENERATORS[shape](n, width, mix, seed)
+            for alg in algs:
+                if n > MAX_NODES.get(alg, n):
+                    print(f'{shape:>15} {n:>15} {alg:>15} {"skipped":>15}')
+                    continue
+                res = run_mapper(alg, graph_fn, deadline = deadline, **mapper_kwargs)
+                if trace_memory:
+                    res['peak_memory'] = run_mapper(alg, graph_fn, True, deadline, **mapper_kwargs)['peak_memory']
+                row = [shape, n, alg, res['seconds'], res['evaluations'] / max(res['seconds'], 1e-9),
+                       None if res['peak_memory'] is None else res['peak_memory'] / 2**20,
+                       res['latency'], res['lower_bound'], res['latency'] / res['lower_bound']]
+                rows.append(dict(zip(columns, row)))
+                print(' '.join(f'{x:>15.6g}' if isinstance(x, float) else f'{str(x):>15}' for x in row))
+    if output is not None:
+        with open(output, 'w') as f:
+            f.write(','.join(columns) + '\n')
+            for row in rows:
+                f.write(','.join(str(row[c]) for c in columns) + '\n')
+    return rows
+
+import argparse
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--alg', choices = ['H2H', 'COMB', 'MAGMA', 'DP', 'BNB'], nargs = '+', default = ['H2H', 'COMB', 'DP', 'BNB'])
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10, 100, 1000])
+    parser.add_argument('--shape', choices = list(GENERATORS.keys()), nargs = '+', default = list(GENERATORS.keys()))
+    parser.add_argument('--width', type = int, default = 8, help = "most tasks of a layer or branches of a block")
+    parser.add_argument('--mix', type = str, default = 'Conv2d=2,Depthwise=1,Gemm=1', help = "weights of the task kinds")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--generations', type = int, default = Population.num_generations, help = "generations of COMB and MAGMA")
+    parser.add_argument('--beam_width', type = int, default = 4, help = "frontiers tried per DP state")
+    parser.add_argument('--node_budget', type = int, default = 10000, help = "search nodes of BNB")
+    parser.add_argument('--deadline', type = float, default = None, help = "seconds of search per mapper")
+    parser.add_argument('--memory', action = 'store_true', help = "measure the peak memory in a traced second run")
+    parser.add_argument('--output', type = str, default = None, help = "csv of the results")
+    args = parser.parse_args()
+
+    AcceleratorBase.set_default_cost_model("analytical")
+    Population.num_generations = args.generations
+    mix = {kind: float(weight) for kind, weight in (item.split('=') for item in args.mix.split(','))}
+    main(args.alg, args.sizes, args.shape, args.width, mix, args.seed, args.memory, args.deadline, args.output,
+         beam_width = args.beam_width, node_budget = args.node_budget)
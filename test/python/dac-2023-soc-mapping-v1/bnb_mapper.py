@@ -0,0 +1,235 @@
+from typing import Dict, Any, List, Set, Optional, Union, Tuple
+import networkx as nx 
+import os 
+import sys
+import math
+import random
+import time 
+import numpy as np
+
+from domino.base import AcceleratorBase, AccTask, AccStream, SoCBase
+from domino.accelerator import ConvAccelerator, MeshSoC, NVDLA, GemmTPU, DepthwiseShiDianNao
+from domino import global_timer
+
+from base import ComputationGraph, MapperBase, get_graph, visualize, ParallelMachineScheduler, GreedyScheduler
+from h2h_mapper import GreedyMapper
+
+class BranchAndBoundMapper(GreedyMapper):
+    '''
+    Branch and bound over the mappings of GreedyMapper: the frontiers are committed one by one 
+    with a global synchronization, every task of a frontier gets an (accelerator, stream), 
+    the streams of an accelerator are used in order. A complete frontier is simulated by the SoC 
+    and rolled back when the search backtracks. 
+    The greedy mapping is the first incumbent. A partial mapping is pruned by the elapsed time plus
+    - for the current frontier, the longest mapped task (compute and fetch) or unmapped task (fastest compute),
+      the PE-time of the mapped tasks on every accelerator and of all the tasks on all the PEs 
+    - for the later frontiers, the sum of the same bounds (the critical path through the frontiers)
+    The result is optimal if the search finishes within node_budget and the deadline, 
+    otherwise gap bounds the distance to the optimum. The checkpoint is the incumbent.
+    '''
+    def __init__(self, scheduler: ParallelMachineScheduler, node_budget: int = 100000, verbose: bool = False):
+        super(BranchAndBoundMapper, self).__init__(scheduler, verbose)
+        self.node_budget = node_budget 
+        # relative slack of the bounds against the rounding of the simulated times
+        self.tolerance = 1e-9
+    
+    def prepare_bounds(self):
+        soc = self.soc
+        num_pes = np.array([soc.accelerator_graph.nodes[acc]['acc'].num_pes for acc in soc.acc_names], dtype=np.float64)
+        self.num_pes = num_pes
+        total_pes = num_pes.sum()
+        # fastest compute time and smallest PE-time (PE x seconds) of every task
+        self.min_compute = {}
+        self.min_area = {}
+        for nid in self.cg.g.nodes:
+            row = self.task_rows[nid]
+            acc_ids = [soc.acc_index[acc] for acc in self.accs[MapperBase.op2task[self.cg.g.nodes[nid]['op'].name]]]
+            self.min_compute[nid] = soc.compute_table[row, acc_ids].min()
+            self.min_area[nid] = (soc.compute_table[row, acc_ids] * soc.pe_table[row, acc_ids]).min()
+        # bounds of the unmapped tasks of a frontier from position i
+        self.rest_compute = []
+        self.rest_area = []
+        for level in self.level_list:
+            rest_compute = [0.0]
+            rest_area = [0.0]
+            for nid in reversed(level):
+                rest_compute.append(max(rest_compute[-1], self.min_compute[nid]))
+                rest_area.append(rest_area[-1] + self.min_area[nid])
+            self.rest_compute.append(rest_compute[::-1])
+            self.rest_area.append(rest_area[::-1])
+        self.total_pes = total_pes
+        # bound of the frontiers from l on
+        self.suffix_bound = [0.0] * (len(self.level_list) + 1)
+        for l in reversed(range(len(self.level_list))):
+            level_bound = max(self.rest_compute[l][0], self.rest_area[l][0] / total_pes)
+            self.suffix_bound[l] = self.suffix_bound[l + 1] + level_bound
+    
+    def greedy_incumbent(self):
+        soc = self.soc
+        mark = soc.checkpoint()
+        task_accs = {}
+        assignments = []
+        for level in self.level_list:
+            candidate = self.place(soc, level, task_accs)
+            for nid, stream in zip(level, candidate):
+                soc.push_task(self.cg.g.nodes[nid]['task'], *stream)
+            elapsed_time = soc.commit_all_tasks()
+            task_accs.update((x, acc) for x, (acc, _) in zip(level, candidate))
+            assignments.append(list(candidate))
+        soc.rollback(mark)
+        return elapsed_time, assignments
+    
+    def simulate(self, assignments) -> Optional[float]:
+        '''
+        The latency of the streams of every level, e.g., of a loaded incumbent, None if they don't fit the levels
+        '''
+        soc = self.soc
+        if len(assignments) != len(self.level_list) or any(len(level) != len(streams) 
+                                                           for level, streams in zip(self.level_list, assignments)):
+            return None
+        for streams in assignments:
+            for acc, stream in streams:
+                if acc not in soc.acc_index or stream >= soc.accelerator_graph.nodes[acc]['acc'].num_streams():
+                    return None
+        mark = soc.checkpoint()
+        elapsed_time = soc.elapsed_time
+        for level, streams in zip(self.level_list, assignments):
+            for nid, stream in zip(level, streams):
+                soc.push_task(self.cg.g.nodes[nid]['task'], *stream)
+            elapsed_time = soc.commit_all_tasks()
+        soc.rollback(mark)
+        return elapsed_time
+    
+    def search_level(self, l: int, elapsed_time: float):
+        if l == len(self.level_list):
+            if elapsed_time < self.best_latency:
+                self.best_latency = elapsed_time 
+                self.best_assignments = [list(x) for x in self.assignments]
+                if self.checkpoint_due():
+                    self.save_search_state((self.best_latency, self.best_assignments))
+            return
+        soc = self.soc
+        level = self.level_list[l]
+        # compute and fetch time of every task on every candidate accelerator, the predecessors are mapped
+        rows = []
+        acc_ids = []
+        for nid in level:
+            for acc in self.accs[MapperBase.op2task[self.cg.g.nodes[nid]['op'].name]]:
+                rows.append(self.task_rows[nid])
+                acc_ids.append(soc.acc_index[acc])
+        compute_time, fetch_time, pe_usage = soc.eval_batch(rows, acc_ids, self.placements)
+        costs = (compute_time + fetch_time).tolist()
+        areas = (compute_time * pe_usage).tolist()
+        self.level_costs = []
+        offset = 0
+        for nid in level:
+            cands = []
+            for acc in self.accs[MapperBase.op2task[self.cg.g.nodes[nid]['op'].name]]:
+                cands.append((costs[offset], areas[offset], acc))
+                offset += 1
+            self.level_costs.append(sorted(cands))
+        self.assignments.append([])
+        level_state = (self.level_costs, {}, np.zeros(len(soc.acc_names)))
+        self.search_task(l, 0, elapsed_time, 0.0, 0.0, level_state)
+        self.assignments.pop()
+    
+    def search_task(self, l: int, pos: int, elapsed_time: float, longest: float, area: float, level_state):
+        level = self.level_list[l]
+        soc = self.soc
+        if pos == len(level):
+            mark = soc.checkpoint()
+            for nid, stream in zip(level, self.assignments[-1]):
+                soc.push_task(self.cg.g.nodes[nid]['task'], *stream)
+            level_elapsed_time = soc.commit_all_tasks()
+            if (level_elapsed_time + self.suffix_bound[l + 1]) * (1 - self.tolerance) < self.best_latency:
+                rows = [self.task_rows[nid] for nid in level]
+                self.placements[rows] = [soc.acc_index[acc] for acc, _ in self.assignments[-1]]
+                self.search_level(l + 1, level_elapsed_time)
+                self.placements[rows] = -1
+            soc.rollback(mark)
+            return 
+        level_costs, used_streams, acc_areas = level_state
+        nid = level[pos]
+        for cost, task_area, acc in level_costs[pos]:
+            acc_id = soc.acc_index[acc]
+            acc_areas[acc_id] += task_area
+            bound = elapsed_time + max(longest, cost, self.rest_compute[l][pos + 1], 
+                                       acc_areas[acc_id] / self.num_pes[acc_id], 
+                                       (area + task_area + self.rest_area[l][pos + 1]) / self.total_pes) + self.suffix_bound[l + 1]
+            # the bound of the other accelerators doesn't change with acc 
+            bound = max(bound, elapsed_time + (acc_areas / self.num_pes).max() + self.suffix_bound[l + 1])
+            if bound * (1 - self.tolerance) < self.best_latency:
+                num_used = used_streams.get(acc, 0)
+                for stream in range(min(num_used + 1, soc.accelerator_graph.nodes[acc]['acc'].num_streams())):
+                    if self.num_nodes >= self.node_budget or self.out_of_time():
+                        self.open_bound = min(self.open_bound, bound)
+                        break
+                    self.num_nodes += 1
+                    used_streams[acc] = max(num_used, stream + 1)
+                    self.assignments[-1].append((acc, stream))
+                    self.search_task(l, pos + 1, elapsed_time, max(longest, cost), area + task_area, level_state)
+                    self.assignments[-1].pop()
+                    used_streams[acc] = num_used
+            acc_areas[acc_id] -= task_area
+    
+    def __call__(self, soc: SoCBase):
+        assert self.scheduler is not None
+        self.g = self.cg.g.copy()
+        self.prepare(soc)
+        soc.build_cost_tables(self.task_table)
+        self.level_list = self.levels()
+        self.prepare_bounds()
+        
+        start_time = soc.elapsed_time
+        root_bound = start_time + max(self.suffix_bound[0], self.cg.lower_bound(soc))
+        self.best_latency, self.best_assignments = self.greedy_incumbent()
+        greedy_latency = self.best_latency
+        incumbent = self.load_search_state()
+        if incumbent is not None:
+            # the saved latency isn't trusted, the incumbent is simulated on this soc
+            latency = self.simulate(incumbent[1])
+            if latency is not None and latency < self.best_latency:
+                self.best_latency, self.best_assignments = latency, incumbent[1]
+        self.num_nodes = 0
+        self.open_bound = math.inf
+        self.assignments = []
+        self.placements = np.full(len(self.task_nids), -1, dtype=np.int64)
+        # the search goes one frame deeper per task
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, 3 * len(self.task_nids) + 1000))
+        try:
+            self.search_level(0, start_time)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+        
+        self.save_search_state((self.best_latency, self.best_assignments))
+        self.optimal = self.open_bound == math.inf 
+        self.lower_bound = max(root_bound, min(self.open_bound, self.best_latency))
+        self.gap = (self.best_latency - self.lower_bound) / self.best_latency if self.best_latency > 0 else 0.0
+        
+        for level, assignment in zip(self.level_list, self.best_assignments):
+            complete_time = self.commit(soc, level, assignment)
+        
+        print(f"complete at {complete_time}, greedy {greedy_latency}, lower bound {self.lower_bound}, "
+              f"gap {self.gap:.2%}, {self.num_nodes} nodes{', optimal' if self.optimal else ''}")
+        return complete_time
+
+def main():
+    models = ['resnet18']
+    graph = get_graph(models)
+    print(graph)
+    mapper = BranchAndBoundMapper(GreedyScheduler(), node_budget=10000)
+    cg = ComputationGraph(graph, mapper)
+    accs = [[NVDLA("NVDLA(0)", 2), DepthwiseShiDianNao("ShiDianNao(1)"), GemmTPU("GemmTPU(2)")]]
+    soc = MeshSoC(accs)
+    complete_time = cg.map(soc)
+    soc.report()
+    print("compute lowerbound is ", cg.lower_bound(soc))
+    print("compute uses ", complete_time)
+
+if __name__ == "__main__":
+    random.seed(1)
+    os.system("mkdir -p .cache")
+    AcceleratorBase.load_cache()
+    main()
+    AcceleratorBase.store_cache()
@@ -1,10 +1,11 @@
 from typing import Dict, Any, List, Set, Optional, Union, Tuple
 import networkx as nx 
 import os 
-from itertools import combinations, product
+from itertools import combinations, product, accumulate
 import math
 import random
 import time 
+import numpy as np
 
 from domino.utils import ONNXConvertor
 from domino.graph_pass import set_graph_precision, GraphPrinter, GraphVisitor
@@ -17,95 +18,223 @@ from domino import global_timer
 
 from base import GraphIRConverter, ComputationGraph, get_graph, MapperBase, visualize
 
+def iter_bits(mask: int):
+    """
+    Yield the set bits of mask in ascending order
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def connected_components(mask: int, adj_masks: List[int]) -> List[int]:
+    """
+    Split the nodes of mask into the weakly connected components, adj_masks[i] are the neighbours of i
+    """
+    ret = []
+    while mask:
+        comp = mask & -mask
+        todo = comp
+        while todo:
+            low = todo & -todo
+            todo ^= low
+            new = adj_masks[low.bit_length() - 1] & mask & ~comp
+            comp |= new
+            todo |= new
+        ret.append(comp)
+        mask &= ~comp
+    return ret
+
 class GrouperBase:
     def group(self, cg: "nx.graph") -> List[List[int]]: 
         raise NotImplementedError()
 
+    def group_bits(self, remaining: int, succ_masks: List[int]) -> List[int]:
+        """
+        The frontiers of the remaining nodes as bitmasks, bit i is task row i.
+        Groupers without it are called with the remaining subgraph.
+        """
+        raise NotImplementedError()
+
 class PlacerBase:
     def place(self, soc: SoCBase, acc: str, configs: List[Tuple[float, float]],) -> Tuple["Latency", Dict[AccTask, "streamid"], Dict[AccTask, "start_time"]]:
         raise NotImplementedError()
 
 class DPMapper(MapperBase):
-    def __init__(self, grouper:GrouperBase, placer: PlacerBase, verbose: bool = False):
+    """
+    The DP state is the bitmask of the remaining nodes, bit i is task row i (topological order).
+    beam_width bounds the frontiers tried per state, once max_states states
+    are solved or the deadline is reached only the first frontier of the grouper is tried.
+    The checkpoint is the DP table without the placement vectors.
+    """
+    def __init__(self, grouper:GrouperBase, placer: PlacerBase, verbose: bool = False,
+                 beam_width: Optional[int] = None, max_states: Optional[int] = None):
         super(DPMapper, self).__init__(verbose)
         self.grouper = grouper 
         self.placer = placer
+        self.beam_width = beam_width
+        self.max_states = max_states
+
+    def build_masks(self):
+        num_tasks = len(self.task_nids)
+        self.succ_masks = [0] * num_tasks
+        self.pred_masks = [0] * num_tasks
+        for nid in self.task_nids:
+            row = self.task_rows[nid]
+            for succ in self.cg.g.succ[nid]:
+                self.succ_masks[row] |= 1 << self.task_rows[succ]
+            for pred in self.cg.g.pred[nid]:
+                self.pred_masks[row] |= 1 << self.task_rows[pred]
+        self.adj_masks = [succ | pred for succ, pred in zip(self.succ_masks, self.pred_masks)]
+
+    def frontiers(self, remaining: int) -> List[int]:
+        if type(self.grouper).group_bits is not GrouperBase.group_bits:
+            ret = self.grouper.group_bits(remaining, self.succ_masks)
+        else:
+            graph = self.cg.g.subgraph([self.task_nids[row] for row in iter_bits(remaining)])
+            ret = [sum(1 << self.task_rows[nid] for nid in frontier) for frontier in self.grouper.group(graph)]
+        if self.out_of_time():
+            if not self.deadline_reached:
+                # the states solved so far tried every frontier, keep them
+                self.deadline_reached = True
+                self.save_search_state(self.dp_state())
+            return ret[:1]
+        if self.max_states is not None and len(self.__cache) >= self.max_states:
+            return ret[:1]
+        if self.beam_width is not None:
+            return ret[:self.beam_width]
+        return ret
 
+    def solve(self, remaining: int, frontiers: List[int]):
+        accs = self.soc.get_all_accs()
+        best_lat = math.inf
+        for frontier in frontiers:
+            child = remaining & ~frontier
+            clock, _, _, _, placements, _ = self.__cache[child]
+            # every row of a group is ascending, i.e., in topological order
+            groups = [list(iter_bits(comp)) for comp in connected_components(frontier, self.adj_masks)]
+            # the frontier is not placed, so the predecessors in the same group are on the same accelerator
+            # evaluate every group on every candidate accelerator at once
+            # todo: consider heterogeneity when doing grouping 
+            group_accs = [accs[MapperBase.op2task[self.cg.g.nodes[self.task_nids[group[0]]]['op'].name]] for group in groups]
+            rows = []
+            acc_ids = []
+            for order, cand_accs in zip(groups, group_accs):
+                for acc in cand_accs:
+                    rows += order
+                    acc_ids += [self.soc.acc_index[acc]] * len(order)
+            compute_time, fetch_time, resource_usage = self.soc.eval_batch(rows, acc_ids, placements, reduce="max")
+            task_times = (compute_time + fetch_time).tolist()
+            resource_usage = resource_usage.tolist()
+            group_costs = {} # (gid, acc) -> (time, resource, Dict[row, start time])
+            offset = 0
+            for gid, (order, cand_accs) in enumerate(zip(groups, group_accs)):
+                for acc in cand_accs:
+                    start_times = list(accumulate(task_times[offset:offset + len(order)], initial=0))
+                    group_costs[gid, acc] = (start_times[-1], 
+                                             max(resource_usage[offset:offset + len(order)]), 
+                                             dict(zip(order, start_times)))
+                    offset += len(order)
+
+            candidates = product(*group_accs)    
+            for cand in candidates:
+                
+                acc2groups = {}
+                for gid, acc in enumerate(cand):                        
+                    if acc not in acc2groups:
+                        acc2groups[acc] = []
+                    acc2groups[acc].append(gid)
+                    
+                elapsed_time = 0
+                curr_task_placement = {}
+                curr_task_timing = {}
+                for acc, acc_groups in acc2groups.items():
+                    configs = [group_costs[gid, acc][:2] for gid in acc_groups] # List[Tuple[time, resource]]
+                    # placement: List[stream_id], timing: List[float]
+                    group_elapsed_time, placement, timing = self.placer.place(self.soc, acc, configs)
+                    elapsed_time = max(group_elapsed_time, elapsed_time)
+                    for i, gid in enumerate(acc_groups):
+                        task_time = group_costs[gid, acc][2]
+                        for row in groups[gid]:
+                            nid = self.task_nids[row]
+                            curr_task_placement[nid] = (acc, placement[i]) 
+                            curr_task_timing[nid] = clock + timing[i] + task_time[row]
+                
+                elapsed_time += clock 
+                if best_lat > elapsed_time:
+                    best_lat = elapsed_time
+                    best_cand = (frontier, curr_task_placement, curr_task_timing, placements, child)
+        frontier, task_placement, task_timing, placements, child = best_cand
+        # the accelerator of every placed row, shared by the parent states
+        placements = placements.copy()
+        for nid, (acc, _) in task_placement.items():
+            placements[self.task_rows[nid]] = self.soc.acc_index[acc]
+        nids = [self.task_nids[row] for row in iter_bits(frontier)]
+        return (best_lat, nids, task_placement, task_timing, placements, child)
+
+    def dp(self, remaining: int):
+        """
+        Solve the state and every state it depends on, without recursion
+        """
+        stack = [remaining]
+        pending = {} # state -> frontiers
+        while len(stack):
+            state = stack[-1]
+            if state in self.__cache:
+                stack.pop()
+                continue
+            if not state:
+                self.__cache[state] = (0, [], {}, {}, np.full(len(self.task_nids), -1, dtype=np.int64), None)
+                stack.pop()
+                continue
+            if state not in pending:
+                pending[state] = self.frontiers(state)
+                assert len(pending[state]), "The grouper returns no frontier"
+            missing = [state & ~frontier for frontier in pending[state] if state & ~frontier not in self.__cache]
+            if len(missing):
+                stack += missing
+                continue
+            self.__cache[state] = self.solve(state, pending.pop(state))
+            stack.pop()
+            if self.checkpoint_due() and not self.deadline_reached:
+                self.save_search_state(self.dp_state())
+        return self.__cache[remaining]
     
-        
-    def dp(self, graph: "networkx.graph"):
-        key = tuple(sorted([i for i in graph.nodes if not graph.succ[i]]))
-        if key not in self.__cache:
-            if not len(key):
-                self.__cache[key] = (0, [], {}, {})
+    def dp_state(self):
+        return {state: entry[:4] + entry[5:] for state, entry in self.__cache.items()}
+    
+    def restore_dp_state(self, dp_state):
+        # a child state has fewer nodes, its placements are rebuilt first
+        for state in sorted(dp_state, key=lambda x: bin(x).count('1')):
+            latency, nids, task_placement, task_timing, child = dp_state[state]
+            if child is None:
+                placements = np.full(len(self.task_nids), -1, dtype=np.int64)
             else:
-                accs = self.soc.get_all_accs()
-                best_lat = math.inf
-                for frontier in self.grouper.group(graph):
-                    frontier_graph = graph.subgraph(frontier)
-                    groups = [list(x) for x in  nx.weakly_connected_components(frontier_graph)]
-                    remain_graph = graph.subgraph([x for x in graph.nodes if x not in frontier])
-                    clock, _, task_placement, _ = self.dp(remain_graph)
-                    # todo: consider heterogeneity when doing grouping 
-                    candidates = product(*[accs[MapperBase.op2task[self.cg.g.nodes[group[0]]['op'].name]] for group in groups])    
-                    for cand in candidates:
-                        
-                        acc2groups = {}
-                        for group, acc in zip(groups, cand):                        
-                            if acc not in acc2groups:
-                                acc2groups[acc] = []
-                            acc2groups[acc].append(group)
-                            
-                        elapsed_time = 0
-                        curr_task_placement = {}
-                        curr_task_timing = {}
-                        for acc, acc_groups in acc2groups.items():
-                            configs = [] # List[Tuple[time, resource]]
-                            task_time = {}
-                            for gid, group in enumerate(acc_groups):
-                                group_graph = frontier_graph.subgraph(group)
-                                total_time = 0
-                                max_resource_usage = 0
-                                for task in nx.topological_sort(group_graph):
-                                    task_time[task] = total_time
-                                    time, resource_usage = self.soc.eval(
-                                        (acc, self.cg.g.nodes[task]['task']), 
-                                        [(task_placement[pred][0] if pred not in group else acc, self.cg.g.nodes[pred]['task']) for pred in self.cg.g.pred[task]]) 
-                                    total_time += time 
-                                    max_resource_usage = max(max_resource_usage, resource_usage)
-                                configs.append((total_time, max_resource_usage))
-                            # placement: List[stream_id], timing: List[float]
-                            group_elapsed_time, placement, timing = self.placer.place(self.soc, acc, configs)
-                            elapsed_time = max(group_elapsed_time, elapsed_time)
-                            for i, group in enumerate(acc_groups):
-                                for task in group:
-                                    curr_task_placement[task] = (acc, placement[i]) 
-                                    curr_task_timing[task] = clock + timing[i] + task_time[task]
-                        
-                        elapsed_time += clock 
-                        if best_lat > elapsed_time:
-                            best_lat = elapsed_time
-                            best_cand = (elapsed_time, frontier, curr_task_placement, curr_task_timing)
-                best_cand[2].update(task_placement)
-                self.__cache[key] = best_cand
-        
-        return self.__cache[key]
+                placements = self.__cache[child][4].copy()
+            for nid, (acc, _) in task_placement.items():
+                placements[self.task_rows[nid]] = self.soc.acc_index[acc]
+            self.__cache[state] = (latency, nids, task_placement, task_timing, placements, child)
     
     def __call__(self, soc: SoCBase):
-        self.__cache = {} # Dict[Tuple[Node], Tuple[latency, Dict[task, (Accelerator, Stream)], Dict[task, float]]]]
+        self.__cache = {} # remaining mask -> (latency, frontier, Dict[task, (Accelerator, Stream)], Dict[task, float], placements, child mask)
         self.soc = soc
-        self.dp(self.cg.g)
+        soc.build_cost_tables(self.task_table)
+        self.build_masks()
+        self.deadline_reached = False
+        dp_state = self.load_search_state()
+        if dp_state is not None:
+            self.restore_dp_state(dp_state)
+        state = (1 << len(self.task_nids)) - 1
+        self.dp(state)
+        if not self.deadline_reached:
+            self.save_search_state(self.dp_state())
         
         self.g = self.cg.g.copy()
         
-        nodes = set(self.g.nodes)
         groups = []
-        while len(nodes):
-            key = tuple(sorted([nid for nid in nodes if not len(nodes.intersection(self.g.succ[nid]))]))
-            assert key in self.__cache 
-            _, group, task_placement, task_timing = self.__cache[key]
-            nodes.difference_update(group)
-            groups = [(group, task_placement, task_timing)] + groups
+        while state:
+            _, group, task_placement, task_timing, _, state = self.__cache[state]
+            groups = [(list(group), task_placement, task_timing)] + groups
         
         for group, task_placement, task_timing in groups:
             group.sort(key=lambda t: task_timing[t])
@@ -150,6 +279,9 @@ class SimpleGrouper(GrouperBase):
     def group(self, graph):
         return [[i for i in graph.nodes if not graph.succ[i]]]
 
+    def group_bits(self, remaining, succ_masks):
+        return [sum(1 << i for i in iter_bits(remaining) if not succ_masks[i] & remaining)]
+
 def main():
     models = ['resnet18', 'resnet50', 'yolo', 'resnet50', 'resnet50']
     graph = get_graph(models)
@@ -1,13 +1,14 @@
 from typing import Dict, Any, List, Set, Optional, Union, Tuple
 import networkx as nx 
 import os 
-from itertools import combinations, product
+from itertools import combinations, product, accumulate
 import math
 import random
 import time 
 import numpy as np
 from functools import reduce
 import pickle as pkl
+from concurrent.futures import ProcessPoolExecutor
 
 from domino.utils import ONNXConvertor
 from domino.graph_pass import set_graph_precision, GraphPrinter, GraphVisitor
@@ -34,6 +35,11 @@ class Individual:
         self.latency = math.inf
         self.topo_order = list()
         self.layers: List[Tuple[float, List[int]]] = list()
+        # dp window length and occupancy of every prefix
+        self.steps: List[int] = list()
+        self.occupancy: List[float] = list()
+        # prefix length -> (dp entries, placements) of the last max_depth prefixes
+        self.checkpoints: Dict[int, Tuple[Dict[int, Any], Dict[int, np.ndarray]]] = dict()
     
     def __str__(self):
         return f'lat={self.latency},ave_occupancy={np.mean([x[0]for x in self.layers])}'
@@ -41,6 +47,16 @@ class Individual:
     def __repr__(self):
         return f'lat={self.latency},ave_occupancy={np.mean([x[0]for x in self.layers])}'
     
+    def compact(self):
+        # the dp checkpoints are left out, they are rebuilt by the next evaluation
+        return (self.latency, self.topo_order, self.layers, self.steps, self.occupancy)
+    
+    @staticmethod
+    def from_compact(data):
+        ret = Individual()
+        ret.latency, ret.topo_order, ret.layers, ret.steps, ret.occupancy = data
+        return ret
+    
 class Population:
     num_generations = 20
     size = 8
@@ -79,28 +95,58 @@ class Population:
         for i, idv in enumerate(self.population):
             print(f'{i}: {idv}')
             
+
+# the mapper of a worker process, shipped once by the pool initializer
+_worker_mapper = None
+
+def _init_worker(mapper):
+    global _worker_mapper
+    _worker_mapper = mapper
+
+def _make_offspring(op, parents, seed):
+    return _worker_mapper.make_offspring(op, parents, seed)
             
 class EvolutionMapper(MapperBase):
-    def __init__(self, placer: Union[PlacerBase, None] = None, scheduler: Union[ParallelMachineScheduler, None] = None, file_path:Union[str, None] = None, verbose: bool = False, cached = False):
+    '''
+    With num_workers > 1 the offspring of a generation are created and evaluated in a process pool.
+    Every offspring is made with its own seed drawn by the main process, so the search only 
+    depends on the seed, not on num_workers.
+    The search stops at the deadline after the current generation. The checkpoint holds the 
+    population, the best individual and the random state after a generation, a resumed search
+    goes on as if it had not been interrupted.
+    '''
+    def __init__(self, placer: Union[PlacerBase, None] = None, scheduler: Union[ParallelMachineScheduler, None] = None, file_path:Union[str, None] = None, verbose: bool = False, cached = False, num_workers: int = 1):
         super(EvolutionMapper, self).__init__(verbose)
         self.file_path = file_path
         self.placer = placer
         self.cached = cached
         self.scheduler = scheduler
+        self.num_workers = num_workers
         self.max_depth = 20
         self.max_mapping_candidate = 100
+        # the dp state is kept every checkpoint_interval tasks of the order, 
+        # an offspring resumes from the last checkpoint before its first change
+        self.checkpoint_interval = 32
         
     # dp[:idx] = max_{j}{dp[:idx-j] + self.placer(dp[idx-j:idx])}  
-    def dp(self):
+    # dp[:idx] only depends on topo_order[:idx], with a checkpoint (see Individual.checkpoints)
+    # of a prefix of topo_order the dp starts after it
+    def dp(self, start: int = 0, checkpoint = None):
         self.__cache.clear()
         self.__cache[0] = (0, 0, {}, {}, {})
+        # accelerator index of the placed tasks of each prefix for eval_batch
+        self.__placements = {0: np.full(len(self.cg.g.nodes), -1, dtype=np.int64)}
+        if checkpoint is not None:
+            entries, placements = checkpoint
+            self.__cache.update(entries)
+            self.__placements.update({idx: placement.astype(np.int64) for idx, placement in placements.items()})
+        acc_index = self.soc.acc_index
         accs = self.soc.get_all_accs()
-        compute_times = self.get_compute_time(accs)
         resource_usages = self.get_resource_usage(accs)
         reversed_topo_order = {x:i for i,x in enumerate(self.topo_order)}
         acc2task_kinds = self.soc.get_acc2task_kinds()
         
-        for idx in range(1, len(self.cg.g.nodes)+1):
+        for idx in range(start + 1, len(self.cg.g.nodes)+1):
             best_lat = math.inf
             for j in range(1, min(idx, self.max_depth)+1):
                 frontier_graph = self.cg.g.subgraph(self.topo_order[idx-j:idx]) 
@@ -128,20 +174,28 @@ class EvolutionMapper(MapperBase):
                 
                 clock, _, task_placement, _, _ = self.__cache[idx - j]
                 
+                # evaluate every group on every candidate accelerator at once, 
+                # the tasks of the window are not placed yet, so their 
+                # predecessors in the same group are on the same accelerator
+                rows = []
+                acc_ids = []
+                for group in groups:
+                    group_rows = [self.task_rows[nid] for nid in group]
+                    for acc in accs[MapperBase.op2task[self.cg.g.nodes[group[0]]['op'].name]]:
+                        rows += group_rows
+                        acc_ids += [acc_index[acc]] * len(group_rows)
+                compute_time, comm_time, _ = self.soc.eval_batch(rows, acc_ids, self.__placements[idx - j])
+                task_times = (compute_time + comm_time).tolist()
+                
                 group_times = [] # List[Dict[Accelerator, List[time]]]
                 group_resource_usage = [] 
+                offset = 0
                 for group in groups:
                     acc_times = {}
                     acc_resource_usage = {}
                     for acc in accs[MapperBase.op2task[self.cg.g.nodes[group[0]]['op'].name]]:
-                        start_times = [0]
-                        for nid in group:
-                            compute_time = compute_times[nid][acc]
-                            comm_time = self.soc.eval_communication(
-                                    (acc, self.cg.g.nodes[nid]['task']), 
-                                    [(task_placement[pred][0] if pred not in group else acc, self.cg.g.nodes[pred]['task']) for pred in self.cg.g.pred[nid]]) 
-                            start_times.append(start_times[-1] + (compute_time + comm_time))
-                        acc_times[acc] = start_times
+                        acc_times[acc] = list(accumulate(task_times[offset:offset + len(group)], initial=0))
+                        offset += len(group)
                         acc_resource_usage[acc] = max(resource_usages[nid][acc] for nid in group)
                     group_times.append(acc_times)
                     group_resource_usage.append(acc_resource_usage)
@@ -205,8 +259,11 @@ class EvolutionMapper(MapperBase):
                 else:
                     raise RuntimeError('at least one of scheudler and placer is not none')
             assert best_lat < math.inf
-            best_cand[2].update(self.__cache[idx - best_cand[1]][2])
             self.__cache[idx] = best_cand
+            placement = self.__placements[idx - best_cand[1]].copy()
+            for nid in self.topo_order[idx - best_cand[1]:idx]:
+                placement[self.task_rows[nid]] = acc_index[best_cand[2][nid][0]]
+            self.__placements[idx] = placement
                 
         return self.__cache[len(self.cg.g.nodes)]
    
@@ -235,6 +292,7 @@ class EvolutionMapper(MapperBase):
    
     def fuzz_test(self, soc):
         self.soc = soc
+        soc.build_cost_tables(self.task_table)
         self.closure_graph = nx.transitive_closure(self.cg.g)
         
         
@@ -407,6 +465,7 @@ class EvolutionMapper(MapperBase):
 
     def __call__(self, soc: SoCBase):
         self.soc = soc
+        soc.build_cost_tables(self.task_table)
         
         if self.cached and os.path.exists(self.file_path):
             with open(self.file_path, 'rb') as f:
@@ -441,31 +500,98 @@ class EvolutionMapper(MapperBase):
         print(f"complete at {complete_time}, estimated {self.__cache[len(self.cg.g.nodes)][0]}")
         return complete_time
     
-    def init_population(self):
+    def init_population(self, executor = None):
         pop = Population()
-        for _ in range(Population.size):
-            pop.add(self.eval(self.dfs(self.cg.g)))
+        for idv in self.make_offsprings([('init', (), random.getrandbits(32)) for _ in range(Population.size)], executor):
+            pop.add(idv)
             #pop.add(self.eval(self.bfs_dfs(self.cg.g)))
         return pop 
     
-    def eval(self, topo_order:List[int]):
+    def make_offspring(self, op: str, parents: List[Individual], seed: int):
+        random.seed(seed)
+        np.random.seed(seed)
+        if op == 'init':
+            return self.eval(self.dfs(self.cg.g))
+        elif op == 'mutate':
+            return self.mutate(*parents)
+        elif op == 'crossover':
+            return self.crossover(*parents)
+        raise RuntimeError(f'unknown op {op}')
+    
+    def make_offsprings(self, jobs: List[Tuple[str, List[Individual], int]], executor = None) -> List[Individual]:
+        '''
+        Make the offspring of every (op, parents, seed), in the pool if executor is not None
+        '''
+        if executor is not None:
+            return list(executor.map(_make_offspring, *zip(*jobs)))
+        # the global random state of the main process is left untouched, like in a worker
+        state = random.getstate(), np.random.get_state()
+        ret = [self.make_offspring(*job) for job in jobs]
+        random.setstate(state[0])
+        np.random.set_state(state[1])
+        return ret
+    
+    def executor(self):
+        '''
+        A process pool, the graph and the cost tables are shipped once per worker
+        '''
+        if self.num_workers <= 1:
+            return None
+        return ProcessPoolExecutor(self.num_workers, initializer=_init_worker, initargs=(self,))
+    
+    def resume_point(self, topo_order: List[int], parents: List[Individual]) -> Tuple[int, Union[Individual, None]]:
+        '''
+        The longest checkpointed prefix of the parents shared by topo_order
+        '''
+        start, ret = 0, None
+        for parent in parents:
+            prefix = 0
+            for x, y in zip(parent.topo_order, topo_order):
+                if x != y: break
+                prefix += 1
+            for k in parent.checkpoints:
+                if start < k <= prefix:
+                    start, ret = k, parent 
+        return start, ret
+    
+    def eval(self, topo_order:List[int], parents: List[Individual] = ()):
         ret = Individual()
         ret.topo_order = topo_order 
         self.topo_order = topo_order 
         self.__cache = {}
-        ret.latency = self.dp()[0]
+        num_tasks = len(self.cg.g.nodes)
+        start, parent = self.resume_point(topo_order, parents)
+        ret.latency = self.dp(start, parent.checkpoints[start] if parent is not None else None)[0]
         assert ret.latency < math.inf
+        
+        if parent is not None:
+            ret.steps = parent.steps[:start + 1]
+            ret.occupancy = parent.occupancy[:start + 1]
+            ret.checkpoints = {k: v for k, v in parent.checkpoints.items() if k <= start}
+        else:
+            ret.steps = [0]
+            ret.occupancy = [0.0]
+        for idx in range(start + 1, num_tasks + 1):
+            _, j, _, _, acc_occupancy = self.__cache[idx]
+            ret.steps.append(j)
+            ret.occupancy.append(np.mean(list(acc_occupancy.values())))
+        if self.checkpoint_interval is not None:
+            for k in range(start + self.checkpoint_interval - start % self.checkpoint_interval, num_tasks, self.checkpoint_interval):
+                window = range(max(0, k - self.max_depth + 1), k + 1)
+                # the accelerator indices fit int16, the placements are only read back
+                ret.checkpoints[k] = ({idx: self.__cache[idx] for idx in window}, 
+                                      {idx: self.__placements[idx].astype(np.int16) for idx in window})
+        
         ret.layers = []
-
-        i = len(self.cg.g.nodes)
+        i = num_tasks
         while i != 0:
-            _, j, _, _, acc_occupancy = self.__cache[i]
-            ret.layers.append((np.mean(list(acc_occupancy.values())), ret.topo_order[i-j:i]))
+            j = ret.steps[i]
+            ret.layers.append((ret.occupancy[i], ret.topo_order[i-j:i]))
             i -= j
         
         return ret
         
-    def gen_idv_with_fixed(self, fixed: List[List[int]]):
+    def gen_idv_with_fixed(self, fixed: List[List[int]], parents: List[Individual] = ()):
         graph = self.cg.g.copy()
         old2new = {i:i for i in graph.nodes}
         new_edges = []
@@ -490,7 +616,7 @@ class EvolutionMapper(MapperBase):
                 print(nid, ':', self.cg.g.pred[nid])
             assert False
             
-        return self.eval(topo_order)
+        return self.eval(topo_order, parents)
     
     def crossover(self, x: Individual, y: Individual):
         parents = [x,y]
@@ -527,7 +653,7 @@ class EvolutionMapper(MapperBase):
         fixed = [parents[x%2].layers[x//2][1] for x in compatible_graph.nodes]                            
 
 
-        return self.gen_idv_with_fixed(fixed)
+        return self.gen_idv_with_fixed(fixed, parents)
         
     def mutate(self, x: Individual):
         fixed = []
@@ -537,36 +663,70 @@ class EvolutionMapper(MapperBase):
         # for layer in x.layers:
         #     if random.random() > Population.layer_mutate_rate: 
         #         fixed.append(layer[1])
-        return self.gen_idv_with_fixed(fixed)
+        return self.gen_idv_with_fixed(fixed, [x])
     
     def export(self, key):
         with open(f"evolve_search/{key}.pkl", 'wb') as f:
             pkl.dump(self.best_lats, f)
     
+    def evolution_state(self, generation: int, pop: Population, best_idv: Individual):
+        return {'generation': generation, 
+                'population': [idv.compact() for idv in pop.population], 
+                'best': best_idv.compact(), 
+                'best_lats': list(self.best_lats), 
+                'random': random.getstate(), 
+                'np_random': np.random.get_state()}
+    
     def evolve_search(self):
-        pop = self.init_population()
-        best_idv = pop.select(best=True)
-        self.best_lats = []
-        for generation in range(Population.num_generations):
+        state = self.load_search_state()
+        executor = self.executor()
+        try:
+            if state is None:
+                start = 0
+                pop = self.init_population(executor)
+                best_idv = pop.select(best=True)
+                self.best_lats = []
+            else:
+                start = state['generation']
+                pop = Population()
+                pop.population = [Individual.from_compact(x) for x in state['population']]
+                best_idv = Individual.from_compact(state['best'])
+                self.best_lats = state['best_lats']
+                random.setstate(state['random'])
+                np.random.set_state(state['np_random'])
+            for generation in range(start, Population.num_generations):
+                if self.out_of_time():
+                    print(f'deadline reached at generation {generation}')
+                    break
+                self.best_lats.append(pop.get_best_lat())
+                pop.show()
+                new_pop = Population()
+                print (f"generation {generation}, score {pop.select(best=True)}")
+                # the parents and seeds are drawn in order, the offspring can be made in parallel
+                jobs = []
+                for i in range(Population.size):
+                    if random.random() < Population.mutate_rate:
+                        # direct pass the chronosome down
+                        print(f"{generation}, {i}: mutate") 
+                        jobs.append(('mutate', [pop.select()[0]], random.getrandbits(32)))
+                    else:
+                        print(f'{generation}, {i}: crossover')
+                        jobs.append(('crossover', list(pop.select(2)), random.getrandbits(32)))
+                for offspring in self.make_offsprings(jobs, executor):
+                    print (f'offspring:{offspring}')
+                    new_pop.add(offspring)
+                    if best_idv.latency > offspring.latency:
+                        best_idv = offspring
+                pop = new_pop
+                if self.checkpoint_due():
+                    self.save_search_state(self.evolution_state(generation + 1, pop, best_idv))
+            else:
+                generation = Population.num_generations
+            self.save_search_state(self.evolution_state(generation, pop, best_idv))
             self.best_lats.append(pop.get_best_lat())
-            pop.show()
-            new_pop = Population()
-            print (f"generation {generation}, score {pop.select(best=True)}")
-            for i in range(Population.size):
-                if random.random() < Population.mutate_rate:
-                    # direct pass the chronosome down
-                    print(f"{generation}, {i}: mutate") 
-                    offspring = self.mutate(pop.select()[0])
-                else:
-                    print(f'{generation}, {i}: crossover')
-                    x, y = pop.select(2)
-                    offspring = self.crossover(x,y)
-                print (f'offspring:{offspring}')
-                new_pop.add(offspring)
-                if best_idv.latency > offspring.latency:
-                    best_idv = offspring
-            pop = new_pop
-        self.best_lats.append(pop.get_best_lat())
+        finally:
+            if executor is not None:
+                executor.shutdown()
         return best_idv
     
 class SimplePlacer(PlacerBase):
@@ -22,40 +22,15 @@ class GreedyMapper(MapperBase):
         self.scheduler = scheduler 
         super(GreedyMapper, self).__init__(verbose)
     
-    def __call__(self, soc: SoCBase):
-        assert self.scheduler is not None
-        self.g = self.cg.g.copy()
-        self.soc = soc
-        
-        machines = soc.get_machines()
-        resource_constraint = soc.get_all_resource_limit() 
-        
-        
-        pred_cnt = {x:len(self.g.pred[x]) for x in self.g.nodes}
+    def levels(self) -> List[List[int]]:
+        '''
+        The frontiers in mapping order, a task is ready when all its predecessors are mapped
+        '''
+        pred_cnt = {x:len(self.cg.g.pred[x]) for x in self.cg.g.nodes}
         frontiers = [x for x, cnt in pred_cnt.items() if cnt == 0]
-        
-        accs = soc.get_all_accs()
-        compute_times = self.get_compute_time(accs)
-        resource_usages = self.get_resource_usage(accs)
-
+        ret = []
         while len(frontiers):
-            timing = []          
-            for x in frontiers:
-                acc_timing = {}
-                for acc in accs[MapperBase.op2task[self.cg.g.nodes[x]['op'].name]]:
-                    compute_time = compute_times[x][acc]
-                    comm_time = soc.eval_communication(
-                        (acc, self.cg.g.nodes[x]['task']),
-                        [(self.cg.g.nodes[pred]['acc'][0], self.cg.g.nodes[pred]['task']) for pred in self.cg.g.pred[x]]
-                    )
-                    acc_timing[acc] = compute_time + comm_time
-                timing.append(acc_timing)
-            resource_usage = [resource_usages[x] for x in frontiers]  
-            _, placement, _, _ = self.scheduler.schedule(2, machines, resource_constraint, resource_usage, timing)
-            
-            candidate = tuple((placement[i][0], placement[i][1][0]) for i in range(len(frontiers)))
-            elapsed_time = self.commit(soc, frontiers, candidate, False)
-            
+            ret.append(list(frontiers))
             l = len(frontiers)
             for i in range(l):
                 x = frontiers[i]
@@ -64,6 +39,56 @@ class GreedyMapper(MapperBase):
                     if pred_cnt[succ] == 0:
                         frontiers.append(succ)
             frontiers = frontiers[l:]
+        return ret
+    
+    def prepare(self, soc: SoCBase):
+        self.soc = soc
+        self.machines = soc.get_machines()
+        self.resource_constraint = soc.get_all_resource_limit() 
+        self.accs = soc.get_all_accs()
+        self.compute_times = self.get_compute_time(self.accs)
+        self.resource_usages = self.get_resource_usage(self.accs)
+    
+    def place(self, soc: SoCBase, frontiers: List[int], task_accs: Dict[int, str]) -> Tuple[Tuple[str, int]]:
+        '''
+        The (accelerator, stream) of every frontier task, task_accs gives the accelerator of the mapped tasks
+        '''
+        timing = []          
+        for x in frontiers:
+            acc_timing = {}
+            for acc in self.accs[MapperBase.op2task[self.cg.g.nodes[x]['op'].name]]:
+                compute_time = self.compute_times[x][acc]
+                comm_time = soc.eval_communication(
+                    (acc, self.cg.g.nodes[x]['task']),
+                    [(task_accs[pred], self.cg.g.nodes[pred]['task']) for pred in self.cg.g.pred[x]]
+                )
+                acc_timing[acc] = compute_time + comm_time
+            timing.append(acc_timing)
+        resource_usage = [self.resource_usages[x] for x in frontiers]  
+        _, placement, _, _ = self.scheduler.schedule(2, self.machines, self.resource_constraint, resource_usage, timing)
+        
+        return tuple((placement[i][0], placement[i][1][0]) for i in range(len(frontiers)))
+    
+    def __call__(self, soc: SoCBase):
+        assert self.scheduler is not None
+        self.g = self.cg.g.copy()
+        self.prepare(soc)
+        
+        # the greedy mapping is the fallback of the other mappers, it ignores the deadline. 
+        # the checkpoint is the placement of the mapped frontiers
+        placed = self.load_search_state() or []
+        task_accs = {}
+        for i, frontiers in enumerate(self.levels()):
+            if i < len(placed):
+                candidate = placed[i]
+            else:
+                candidate = self.place(soc, frontiers, task_accs)
+                placed.append(candidate)
+                if self.checkpoint_due():
+                    self.save_search_state(placed)
+            elapsed_time = self.commit(soc, frontiers, candidate, False)
+            task_accs.update((x, acc) for x, (acc, _) in zip(frontiers, candidate))
+        self.save_search_state(placed)
         return elapsed_time 
 def get_graph(path: str):
     convertor = ONNXConvertor(path, inference=True)
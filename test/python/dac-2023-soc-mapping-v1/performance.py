@@ -8,18 +8,21 @@ import time
 import copy
 import numpy as np
 import pickle as pkl
+import json
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from domino.utils import ONNXConvertor
 from domino.graph_pass import set_graph_precision, GraphPrinter, GraphVisitor
 from domino.graph_ir import Op, SubGraph, Graph, Tensor, Attribute
 from domino.base import AcceleratorBase, AccTask, AccStream, SoCBase
-from domino.accelerator import ConvAccelerator, MeshSoC, NVDLA, GemmTPU, DepthwiseShiDianNao, ConvShiDianNao, GemmNVDLA
+from domino.accelerator import ConvAccelerator, MeshSoC, NVDLA, GemmTPU, DepthwiseShiDianNao, ConvShiDianNao, GemmNVDLA, calibrate, DataflowTuner
 from domino.program_ir import ConstInt, ConstUInt, ConstFloat, ConstString, ExprList
 import matplotlib.pyplot as plt
 from domino import global_timer
 
 from base import GraphIRConverter, ComputationGraph, get_graph, MapperBase, visualize, GreedyScheduler
 from evolution_mapper import SimplePlacer, EvolutionMapper
+from bnb_mapper import BranchAndBoundMapper
 from h2h_mapper import GreedyMapper 
 
 graphs = {
@@ -64,15 +67,15 @@ socs = {
 }
 }
 
-def run(alg: str, model_tag: str, soc_tag: str, bandwidth: str, verbose = False, cached = False):
-    assert alg in ['H2H', 'COMB', 'MAGMA']
+def run(alg: str, model_tag: str, soc_tag: str, bandwidth: str, verbose = False, cached = False, event_driven = False, contention = False, num_workers = 1, deadline = None, checkpoint_dir = None):
+    assert alg in ['H2H', 'COMB', 'MAGMA', 'BNB']
     if 'nlp' in model_tag and 'GEMM' not in soc_tag:
         soc_tag += "-GEMM"
     print (f'running {alg} {model_tag} {soc_tag} {bandwidth}')
     models = []
     for network, batch_size in graphs[model_tag]:
         models += [network] * batch_size
-    graph = get_graph(models)
+    graph = get_graph(models, cache_dir = '.cache')
     if verbose: 
         visualize(graph, f'pics/{model_tag}')
     print(f'Graph: {models}', graph)
@@ -82,11 +85,14 @@ def run(alg: str, model_tag: str, soc_tag: str, bandwidth: str, verbose = False,
     elif alg == 'COMB':
         file_path = '.cache/'+'_'.join([alg, model_tag, soc_tag, bandwidth]) + '.pkl'
         scheduler = GreedyScheduler()
-        mapper = EvolutionMapper(scheduler = scheduler, verbose = verbose, file_path=file_path, cached = cached)
+        mapper = EvolutionMapper(scheduler = scheduler, verbose = verbose, file_path=file_path, cached = cached, num_workers = num_workers)
     elif alg == 'MAGMA':
         file_path = '.cache/'+'_'.join([alg, model_tag, soc_tag, bandwidth]) + '.pkl'
         scheduler = GreedyScheduler(resource_limit=[(0,1)]) # constraint the stream usage
-        mapper = EvolutionMapper(scheduler = scheduler, verbose = verbose, file_path = file_path, cached = cached)
+        mapper = EvolutionMapper(scheduler = scheduler, verbose = verbose, file_path = file_path, cached = cached, num_workers = num_workers)
+    elif alg == 'BNB':
+        scheduler = GreedyScheduler(resource_limit=[(0,1)])
+        mapper = BranchAndBoundMapper(scheduler = scheduler, verbose = verbose)
     else:
         raise RuntimeError(f'unknow alg {alg}')    
     cg = ComputationGraph(graph, mapper, verbose)
@@ -95,11 +101,22 @@ def run(alg: str, model_tag: str, soc_tag: str, bandwidth: str, verbose = False,
         soc_args['off_chip_nearest_bw'] = 3.2
     elif bandwidth == 'lowBW':
         soc_args['off_chip_nearest_bw'] = 0.8
+    soc_args['event_driven'] = event_driven
+    soc_args['contention'] = contention
     soc = MeshSoC(**soc_args)
     if verbose: 
         print("compute lowerbound is ", cg.lower_bound(soc))
         print (f'soc with accs: {soc.accelerator_graph.nodes}')
-    complete_time = cg.map(soc)
+    checkpoint = None
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok = True)
+        # runs with other settings keep their own checkpoints
+        settings = [AcceleratorBase.default_cost_model]
+        settings += ['event'] if event_driven else []
+        settings += ['contention'] if contention else []
+        settings += ['tune'] if any(soc.accelerator_graph.nodes[acc]['acc'].tuner is not None for acc in soc.acc_names) else []
+        checkpoint = os.path.join(checkpoint_dir, '_'.join([alg, model_tag, soc_tag, bandwidth] + settings) + '.ckpt')
+    complete_time = cg.map(soc, deadline, checkpoint)
     # scheduler.store('./schedules.pkl')
     energy_consumption = soc.get_current_energy_consumption()
     filename = '_'.join([alg, model_tag, soc_tag, bandwidth])
@@ -119,39 +136,116 @@ def run(alg: str, model_tag: str, soc_tag: str, bandwidth: str, verbose = False,
     print("compute uses ", complete_time, 'energy: ', energy_consumption)
     return complete_time, energy_consumption
 
-def main(algs, models, socs, bandwidths, store_path = "res", cached = False):
-    results = {}
+GRID_COLUMNS = ['model', 'soc', 'alg', 'bandwidth', 'latency', 'energy', 'seconds']
+
+def grid_cells(algs, models, soc_tags, bandwidths):
+    return [(model_tag, soc_tag, alg, bw) for model_tag in models for soc_tag in soc_tags for alg in algs for bw in bandwidths]
+
+def load_manifest(path: str, settings: Dict[str, Any]) -> Dict[Tuple[str, str, str, str], Dict[str, Any]]:
+    '''
+    The completed cells of a grid run with settings, the manifest has one json row per cell
+    '''
+    ret = {}
+    if not os.path.exists(path):
+        return ret
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            # a crash can leave a partial last line
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            # the cells of a run with other settings are run again
+            if row.get('settings') != settings:
+                continue
+            ret[(row['model'], row['soc'], row['alg'], row['bandwidth'])] = row
+    return ret
+
+def run_cell(cell, run_kwargs: Dict[str, Any], seed: int = 1) -> Dict[str, Any]:
+    model_tag, soc_tag, alg, bw = cell
+    # every cell has its own seed, its result doesn't depend on the other cells
+    random.seed(seed)
+    np.random.seed(seed)
+    key = '_'.join([model_tag, soc_tag, alg])
+    global_timer.start(key)
+    start = time.time()
+    complete_time, energy_consumption = run(alg, model_tag, soc_tag, bw, **run_kwargs)
+    global_timer.stop(key)
+    # the worker shares its evaluations with the others
+    AcceleratorBase.store_cache()
+    # the workers of a pool don't run atexit handlers, the store is saved after every cell
+    if AcceleratorBase.results_store is not None:
+        AcceleratorBase.results_store.flush()
+    return dict(zip(GRID_COLUMNS, [model_tag, soc_tag, alg, bw, float(complete_time), float(energy_consumption), time.time() - start]))
+
+def init_grid_worker(setup: Dict[str, Any]):
+    '''
+    Set up a worker like the main process, every worker opens the shared evaluation cache
+    '''
+    AcceleratorBase.load_cache()
+    AcceleratorBase.set_default_cost_model(setup['cost_model'])
+    AcceleratorBase.calibration = setup['calibration']
+    AcceleratorBase.surrogate = setup['surrogate']
+    if setup['results_store'] is not None:
+        # a results store has a single writer
+        AcceleratorBase.open_results_store(os.path.join(setup['results_store'], f'worker-{os.getpid()}'))
+    if setup['tune']:
+        tuner = DataflowTuner()
+        for soc in socs.values():
+            for row in soc['accelerator_matrix']:
+                for acc in row:
+                    acc.set_tuner(tuner)
+
+def main(algs, models, socs, bandwidths, store_path = "res", cached = False, event_driven = False, contention = False, num_workers = 1, deadline = None, checkpoint_dir = None, jobs = 1, setup = None):
+    '''
+    Run the grid of (model, soc, alg, bandwidth) cells, in jobs processes if jobs > 1.
+    Every finished cell is appended to result/{store_path}.jsonl with the settings of the run,
+    a rerun with the same settings skips them.
+    The table of all the cells is written to result/{store_path}.csv and .pkl.
+    '''
+    run_kwargs = dict(cached = cached, event_driven = event_driven, contention = contention, num_workers = num_workers, deadline = deadline, checkpoint_dir = checkpoint_dir)
+    settings = {'cost_model': AcceleratorBase.default_cost_model, 'tune': setup is not None and setup['tune'],
+                'event_driven': event_driven, 'contention': contention, 'deadline': deadline}
+    manifest_path = f'./result/{store_path}.jsonl'
+    done = load_manifest(manifest_path, settings)
+    cells = grid_cells(algs, models, socs, bandwidths)
+    todo = [cell for cell in cells if cell not in done]
+    print(f'{len(cells) - len(todo)} of {len(cells)} cells done before')
     failed = []
-    for model_tag in models:
-        for soc_tag in socs:
-            for alg in algs:
-                for bw in bandwidths:
-                    # try: 
-                    key = '_'.join([model_tag, soc_tag, alg])
-                    global_timer.start(key)
-                    results[(model_tag, soc_tag, alg, bw)] = run(alg, model_tag, soc_tag, bw, cached = cached)
-                    global_timer.stop(key)
-                    # except:
-                    #     print (f'[WARNING] run{alg}, {model_tag}, {soc_tag}, {bw} failed')
-                    #     failed.append((alg, model_tag, soc_tag, bw))
+    with open(manifest_path, 'a') as manifest:
+        def record(row):
+            manifest.write(json.dumps(dict(row, settings = settings)) + '\n')
+            manifest.flush()
+            done[(row['model'], row['soc'], row['alg'], row['bandwidth'])] = row
+        
+        if jobs <= 1:
+            for cell in todo:
+                try:
+                    record(run_cell(cell, run_kwargs))
+                except Exception as e:
+                    print (f'[WARNING] run {cell} failed: {e}')
+                    failed.append(cell)
+        else:
+            with ProcessPoolExecutor(jobs, initializer = init_grid_worker, initargs = (setup,)) as executor:
+                futures = {executor.submit(run_cell, cell, run_kwargs): cell for cell in todo}
+                for future in as_completed(futures):
+                    try:
+                        record(future.result())
+                    except Exception as e:
+                        print (f'[WARNING] run {futures[future]} failed: {e}')
+                        failed.append(futures[future])
+    
+    results = {cell: (done[cell]['latency'], done[cell]['energy']) for cell in cells if cell in done}
     with open(f'./result/{store_path}.pkl', 'wb') as f:
         pkl.dump(results, f)
+    with open(f'./result/{store_path}.csv', 'w') as f:
+        f.write(','.join(GRID_COLUMNS) + '\n')
+        for cell in cells:
+            if cell in done:
+                f.write(','.join(str(done[cell][name]) for name in GRID_COLUMNS) + '\n')
     for k, v in results.items():
         print(k, v)
-    iter = 0
-    # while failed:
-    #     new_failed = []
-    #     for config in failed:
-    #         try: 
-    #             results[config] = run(*config)
-    #         except:
-    #             new_failed.append(config)
-    #     failed = new_failed
-    #     iter += 1 
-    #     for k, v in results:
-    #         print(k, v)
-    #     with open(f'./result/{store_path}.pkl', 'wb') as f:
-    #         pkl.dump(results, f)
     
     print("failed: ", failed)
     global_timer.show()
@@ -160,12 +254,21 @@ import argparse
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--alg', type = str, nargs = '+', default=['COMB', 'H2H', 'MAGMA'], choices = ['COMB', 'H2H', 'MAGMA'])
+    parser.add_argument('--alg', type = str, nargs = '+', default=['COMB', 'H2H', 'MAGMA'], choices = ['COMB', 'H2H', 'MAGMA', 'BNB'])
     parser.add_argument('--model', type = str, nargs = '+',default=graphs.keys())
     parser.add_argument('--soc', type = str, nargs = '+', default=socs.keys(), choices = socs.keys())
     parser.add_argument('--bandwidth', type = str, nargs = '+', default=['highBW'], choices = ['highBW', 'lowBW'])
     parser.add_argument('--store_path', type = str, default = "res")
     parser.add_argument('--cached', action = "store_true")
+    parser.add_argument('--event_driven', action = "store_true")
+    parser.add_argument('--contention', action = "store_true")
+    parser.add_argument('--cost_model', type = str, default = 'maestro', choices = AcceleratorBase.COST_MODELS)
+    parser.add_argument('--tune', action = "store_true", help = "search the dataflow of every layer")
+    parser.add_argument('--results_store', type = str, default = None, help = "append every MAESTRO result to this directory")
+    parser.add_argument('--deadline', type = float, default = None, help = "seconds of search per mapping, the best mapping so far is used after")
+    parser.add_argument('--checkpoint_dir', type = str, default = None, help = "save the search states here and resume from them")
+    parser.add_argument('--jobs', type = int, default = 1, help = "cells of the grid run in parallel")
+    parser.add_argument('--num_workers', type = int, default = 1, help = "processes evaluating the offspring of COMB and MAGMA")
     args = parser.parse_args()
     
     random.seed(1)
@@ -173,8 +276,26 @@ if __name__ == "__main__":
     os.system("mkdir -p pics")
     os.system("mkdir -p result")
     AcceleratorBase.load_cache()
-    main(args.alg, args.model, args.soc, args.bandwidth, args.store_path, args.cached)
+    AcceleratorBase.set_default_cost_model(args.cost_model)
+    if args.results_store is not None:
+        AcceleratorBase.open_results_store(args.results_store)
+    if args.cost_model == 'analytical':
+        accs = [acc for soc in socs.values() for row in soc['accelerator_matrix'] for acc in row]
+        print("calibration: ", calibrate(accs))
+    elif args.cost_model == 'surrogate':
+        print("surrogate: ", AcceleratorBase.train_surrogate().stats())
+    if args.tune:
+        tuner = DataflowTuner()
+        for soc in socs.values():
+            for row in soc['accelerator_matrix']:
+                for acc in row:
+                    acc.set_tuner(tuner)
+    setup = {'cost_model': args.cost_model, 'calibration': AcceleratorBase.calibration, 'surrogate': AcceleratorBase.surrogate,
+             'tune': args.tune, 'results_store': args.results_store}
+    main(args.alg, args.model, args.soc, args.bandwidth, args.store_path, args.cached, args.event_driven, args.contention, 
+         args.num_workers, args.deadline, args.checkpoint_dir, args.jobs, setup)
     # run('COMB', 'vision', 'LargeSoC', True)
     # main()
     AcceleratorBase.store_cache()
+    AcceleratorBase.close_results_store()
               
\ No newline at end of file
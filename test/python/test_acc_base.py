@@ -0,0 +1,268 @@
+from domino.base import AcceleratorBase, AccTask, AccStream, SoCBase, TaskTable
+from domino.accelerator import MeshSoC, XYRouting, TorusRouting, ShortestPathRouting
+import numpy as np
+
+
+class FakeConvAccelerator(AcceleratorBase):
+    """Conv accelerator with a closed-form cost, no MAESTRO needed"""
+
+    def __init__(self, name, n_stream=1, num_pes=256):
+        super(FakeConvAccelerator, self).__init__(
+            name, n_stream, ["Conv2d"], num_pes=num_pes)
+
+    def evaluate_compute(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
+        return P * Q * K * C * R * S / self.num_pes * 1e-9, 1.0
+
+    def spatial_used_pes(self, H, W, P, Q, K, C, R, S, stride_h, stride_w):
+        return min(K * 16, self.num_pes)
+
+
+def make_conv_task(name, K, C=16, depend_tasks=[]):
+    params = {"H": 16, "W": 16, "P": 16, "Q": 16, "K": K, "C": C,
+              "R": 3, "S": 3, "stride_h": 1, "stride_w": 1}
+    return AccTask(name, "Conv2d", params, depend_tasks)
+
+
+def make_soc(event_driven):
+    accs = [[FakeConvAccelerator("A(0,0)", 3), FakeConvAccelerator("A(0,1)", 2)]]
+    return MeshSoC(accs, event_driven=event_driven)
+
+
+def push_workload(soc):
+    tasks = []
+    for i in range(12):
+        deps = [tasks[i - 2]] if i >= 2 else []
+        task = make_conv_task(f"T{i}", K=4 + 4 * (i % 3), depend_tasks=deps)
+        tasks.append(task)
+        acc = "A(0,0)" if i % 2 == 0 else "A(0,1)"
+        soc.push_task(task, acc, i % (3 if acc == "A(0,0)" else 2))
+    return tasks
+
+
+def test_event_driven_commit():
+    phase_soc = make_soc(False)
+    push_workload(phase_soc)
+    phase_time = phase_soc.commit_all_tasks()
+
+    event_soc = make_soc(True)
+    tasks = push_workload(event_soc)
+    event_time = event_soc.commit_all_tasks()
+
+    assert 0 < event_time <= phase_time
+    for name, acc in event_soc.accelerator_graph.nodes.data("acc"):
+        phase_acc = phase_soc.accelerator_graph.nodes[name]["acc"]
+        assert len(acc.pe_usages) > 0
+        for idx in range(acc.num_streams()):
+            assert acc[idx].empty()
+            assert len(acc[idx].logs) == len(phase_acc[idx].logs)
+    for task in tasks:
+        assert task.compute_finish <= event_time
+        assert task.pe_finish - task.pe_start <= 256
+
+
+def test_event_driven_pe_ranges():
+    # short tasks on streams 0 and 2 finish before the long one on stream 1
+    soc = MeshSoC([[FakeConvAccelerator("A(0,0)", 3)]], event_driven=True)
+    tasks = []
+    for i in range(4):
+        for idx, K in enumerate([4, 8, 4]):
+            task = make_conv_task(f"T{i}_{idx}", K=K if idx != 1 else 8 * (i + 1))
+            tasks.append(task)
+            soc.push_task(task, "A(0,0)", idx)
+    soc.commit_all_tasks()
+    for task in tasks:
+        assert 0 <= task.pe_start < task.pe_finish <= 256
+    for a in tasks:
+        for b in tasks:
+            if a is not b and a.compute_start < b.compute_finish and b.compute_start < a.compute_finish:
+                assert a.pe_finish <= b.pe_start or b.pe_finish <= a.pe_start, (a.name, b.name)
+
+
+def soc_state(soc):
+    state = {"elapsed": soc.elapsed_time, "bind": dict(soc._bind_table)}
+    for name, acc in soc.accelerator_graph.nodes.data("acc"):
+        state[name] = (acc.total_energy, len(acc.pe_usages), len(acc.board),
+                       [(list(acc[i]._stream), len(acc[i].logs), acc[i]._elapsed_time)
+                        for i in range(acc.num_streams())])
+    return state
+
+
+def test_checkpoint_rollback():
+    for event_driven in [False, True]:
+        soc = make_soc(event_driven)
+        tasks = push_workload(soc)
+        soc.commit_all_tasks()
+        before = soc_state(soc)
+        finish_times = [task.compute_finish for task in tasks]
+
+        with soc.trial():
+            push_workload(soc)
+            soc.commit_all_tasks()
+            assert soc_state(soc) != before
+        assert soc_state(soc) == before
+
+        mark = soc.checkpoint()
+        inner = soc.checkpoint()
+        for i, task in enumerate(tasks):
+            soc.push_task(task, "A(0,1)", i % 2)
+        soc.commit_all_tasks()
+        soc.rollback(inner)
+        soc.commit_all_tasks()
+        soc.rollback(mark)
+        assert soc_state(soc) == before
+        assert [task.compute_finish for task in tasks] == finish_times
+        assert soc._journal is None
+
+
+def test_stream_find():
+    stream = AccStream(0)
+    tasks = [make_conv_task(f"T{i}", K=4) for i in range(5)]
+    for task in tasks:
+        stream.add(task)
+    stream.prepare_to_commit()
+    stream.retire(tasks[0], 0, 1)
+    assert stream.find(tasks[0]) == -1
+    assert stream.find(tasks[3]) == 2
+    assert stream.head() is tasks[1]
+    assert stream.num_tasks() == 4
+
+
+def test_task_table():
+    soc = make_soc(False)
+    tasks = push_workload(soc)
+    table = TaskTable(capacity=4)
+    rows = table.extend(tasks)
+    assert len(table) == len(tasks)
+    for row, task in zip(rows, tasks):
+        assert table.row(task) == row
+        assert table.task_kind(row) == task.task_kind
+        assert table.get_params(row) == task.get_params()
+        assert table.output_volume[row] == task.get_output_data_volume()
+        assert table.predecessors(row) == [table.row(p) for p in task.depend_tasks]
+
+    soc.commit_all_tasks()
+    table.sync()
+    for row, task in zip(rows, tasks):
+        assert table.acc_names[table.acc[row]] == task.acc
+        assert table.compute_finish[row] == task.compute_finish
+
+
+def test_mesh_topology():
+    soc = MeshSoC([[FakeConvAccelerator(f"A({i},{j})") for j in range(3)] for i in range(2)])
+    assert soc.accelerator_graph.number_of_edges() == 14
+    for acc_from in soc.acc_names:
+        for acc_to in soc.acc_names:
+            (i, j), (u, v) = soc.accelerator_graph.nodes[acc_from]["acc"].topo_id, soc.accelerator_graph.nodes[acc_to]["acc"].topo_id
+            distance = abs(u - i) + abs(v - j)
+            bw = soc.on_chip_bw if distance == 0 else soc.off_chip_nearest_bw / distance
+            assert np.isclose(soc.transfer_time(1e9, acc_from, acc_to), 1 / bw)
+    src, dst = np.array([0, 1, 5]), np.array([5, 1, 0])
+    assert np.allclose(soc.transfer_times([1e9] * 3, src, dst), 1 / soc.bandwidth[src, dst])
+
+    xy = XYRouting(16, 16)
+    hops = xy.hop_matrix()
+    assert np.array_equal(ShortestPathRouting(16, 16).hop_matrix(), hops)
+    assert len(xy.route(0, 255)) == hops[0, 255] == 30
+    torus = TorusRouting(16, 16)
+    assert torus.hop_matrix()[0, 255] == 2
+    route = torus.route(0, 255)
+    assert len(route) == 2 and route[0][0] == 0 and route[-1][1] == 255
+    assert set(route) <= set(torus.links())
+    soc = MeshSoC([[FakeConvAccelerator(f"B({i},{j})") for j in range(16)] for i in range(16)], routing="torus")
+    assert soc.hops.max() == 16
+
+
+def test_link_contention():
+    accs = [[FakeConvAccelerator(f"A(0,{j})") for j in range(3)]]
+    soc = MeshSoC(accs, off_chip_nearest_bw=1, contention=True)
+    # one GB over 2 hops alone takes 2s
+    assert np.isclose(soc.transfer_time(1e9, "A(0,0)", "A(0,2)", 0), 2)
+    # the first link has 0.5 GB/s left until t=2
+    assert np.isclose(soc.transfer_time(0.5e9, "A(0,0)", "A(0,1)", 0, reserve=False), 1)
+    assert np.isclose(soc.transfer_time(1.5e9, "A(0,0)", "A(0,1)", 0, reserve=False), 2.5)
+    assert np.isclose(soc.transfer_time(1e9, "A(0,1)", "A(0,0)", 0), 1)
+    assert np.isclose(soc.transfer_time(1e9, "A(0,0)", "A(0,1)", 0), 2)
+    # now the first link is saturated until t=2
+    assert np.isclose(soc.transfer_time(0.5e9, "A(0,0)", "A(0,1)", 0), 2.5)
+    assert np.isclose(soc.transfer_time(1e9, "A(0,0)", "A(0,0)", 0), 1 / soc.on_chip_bw)
+
+    # the reservations are rolled back with the rest of the SoC
+    for event_driven in [False, True]:
+        latencies = []
+        for contention in [False, True]:
+            soc = MeshSoC([[FakeConvAccelerator("A(0,0)", 2), FakeConvAccelerator("A(0,1)", 2)]],
+                          event_driven=event_driven, off_chip_nearest_bw=0.001, contention=contention)
+            with soc.trial():
+                for i in range(4):
+                    parent = make_conv_task(f"P{i}", K=4)
+                    child = make_conv_task(f"C{i}", K=4, depend_tasks=[parent])
+                    soc.push_task(parent, "A(0,0)", i % 2)
+                    soc.push_task(child, "A(0,1)", i % 2)
+                latencies.append(soc.commit_all_tasks())
+        assert latencies[1] > latencies[0]
+        # the released reservations leave no breakpoints behind
+        assert all(link.loads == [0.0] for link in soc.contention.links.values())
+        # outside a trial the timelines are pruned at the sync
+        for i in range(4):
+            parent = make_conv_task(f"P{i}", K=4)
+            child = make_conv_task(f"C{i}", K=4, depend_tasks=[parent])
+            soc.push_task(parent, "A(0,0)", i % 2)
+            soc.push_task(child, "A(0,1)", i % 2)
+        soc.commit_all_tasks()
+        assert all(len(link.times) == 1 for link in soc.contention.links.values())
+
+
+def test_eval_batch():
+    soc = MeshSoC([[FakeConvAccelerator(f"A({i},{j})") for j in range(2)] for i in range(2)])
+    tasks = []
+    for i in range(8):
+        deps = [tasks[j] for j in range(max(i - 3, 0), i)]
+        tasks.append(make_conv_task(f"T{i}", K=4 * (i + 1), depend_tasks=deps))
+    table = TaskTable()
+    table.extend(tasks)
+    soc.build_cost_tables(table)
+    placement = {task.unique_id: soc.acc_names[i % 4] for i, task in enumerate(tasks)}
+
+    rows = list(range(len(tasks)))
+    placements = [soc.acc_index[placement[task.unique_id]] for task in table.tasks]
+    for acc_name in soc.acc_names:
+        compute, fetch, pe_usage = soc.eval_batch(rows, soc.acc_index[acc_name], placements)
+        _, fetch_max, _ = soc.eval_batch(rows, soc.acc_index[acc_name], placements, reduce="max")
+        for row, task in enumerate(tasks):
+            inputs = [(placement[p.unique_id], p) for p in task.depend_tasks]
+            assert np.isclose(fetch[row], soc.eval_communication((acc_name, task), inputs))
+            time, usage = soc.eval((acc_name, task), inputs)
+            assert np.isclose(compute[row] + fetch_max[row], time)
+            assert pe_usage[row] == usage
+    # the tasks that are not placed are on the candidate accelerator
+    _, fetch, _ = soc.eval_batch(rows, 0, [-1] * len(tasks))
+    _, local, _ = soc.eval_batch(rows, 0)
+    inputs = [(soc.acc_names[0], p) for p in tasks[5].depend_tasks]
+    assert np.allclose(fetch, local) and np.isclose(local[5], soc.eval_communication((soc.acc_names[0], tasks[5]), inputs))
+
+
+def test_prefetch_cached():
+    # every shape is cached, MAESTRO is not needed
+    from domino.accelerator import NVDLA
+    acc = NVDLA("NVDLA(0)", 2)
+    soc = MeshSoC([[acc]])
+    task = make_conv_task("T0", 32)
+    kind, mapping_args, _ = acc.compute_request(*task.get_params())
+    compute_cache = AcceleratorBase.compute_cache
+    AcceleratorBase.compute_cache = {acc._compute_cache_key(kind, mapping_args): (1e-6, 1.0)}
+    try:
+        assert soc.prefetch([task]) == 0
+    finally:
+        AcceleratorBase.compute_cache = compute_cache
+
+
+if __name__ == "__main__":
+    test_event_driven_commit()
+    test_event_driven_pe_ranges()
+    test_checkpoint_rollback()
+    test_stream_find()
+    test_task_table()
+    test_mesh_topology()
+    test_link_contention()
+    test_eval_batch()
+    test_prefetch_cached()
@@ -0,0 +1,147 @@
+import re
+import os
+import tempfile
+import numpy as np
+from collections import namedtuple
+from domino.base import AcceleratorBase, EvaluationCache
+from domino.accelerator import NVDLA, GemmTPU, Dataflow, Sz, SpatialMap, TemporalMap, Cluster, DataflowTuner
+from domino.accelerator.dataflow import channel_parallel_conv_directives
+
+
+FakeResults = namedtuple("FakeResults", ["runtime", "power", "l1_size", "l2_size"])
+
+
+class ClusterPool(object):
+    """Pool whose runtime only depends on the cluster size, large clusters need too much L2"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def evaluate_many(self, jobs):
+        self.jobs.extend(jobs)
+        ret = []
+        for job in jobs:
+            cluster = int(re.search(r"Cluster\((\d+),P\)", job.mapping_contents).group(1))
+            ret.append(FakeResults(np.array([100000 // cluster]), np.array([1.0]),
+                                   np.array([0]), np.array([cluster * 1000])))
+        return ret
+
+
+def test_render():
+    dataflow = Dataflow.conv2d(56, 56, 64, 32, 3, 3, 1, 1, channel_parallel_conv_directives(64))
+    mapping = dataflow.render()
+    assert mapping.startswith("Network sample_net {\nLayer Conv2d {\nType: CONV\n")
+    assert "Stride { X: 1, Y: 1 }" in mapping
+    assert "Dimensions { K: 64, C: 32, R: 3, S: 3, Y: 56, X: 56 }" in mapping
+    assert "        TemporalMap(Sz(R),1) Y;\n" in mapping
+    assert "        Cluster(64,P);\n" in mapping
+    canonical = dataflow.canonical().render()
+    assert "Sz(" not in canonical
+    # C fits in one tile, R and S are single-step loops
+    assert "TemporalMap(32,32) C;" in canonical
+    assert canonical.index("TemporalMap(3,1) Y;") < canonical.index("TemporalMap(3,3) R;")
+
+
+def test_canonical_form():
+    def conv(directives, C=32):
+        return Dataflow.conv2d(56, 56, 64, C, 3, 3, 1, 1, directives)
+
+    # tiles larger than the dimension
+    first = conv([SpatialMap(1, 1, "K"), TemporalMap(64, 64, "C"), Cluster(16), SpatialMap(1, 1, "C")])
+    second = conv([SpatialMap(1, 1, "K"), TemporalMap(128, 1, "C"), Cluster(16), SpatialMap(1, 1, "C")])
+    assert first == second and hash(first) == hash(second)
+    assert first.digest() == second.digest()
+    assert first.canonical().render() == second.canonical().render()
+    assert first != conv([SpatialMap(1, 1, "K"), TemporalMap(64, 64, "C"), Cluster(16), SpatialMap(1, 1, "C")], C=128)
+
+    # single-step loops can be reordered, the others can't
+    first = conv([TemporalMap(Sz("R"), Sz("R"), "R"), TemporalMap(Sz("S"), Sz("S"), "S"), TemporalMap(8, 8, "C")])
+    second = conv([TemporalMap(3, 3, "S"), TemporalMap(8, 8, "C"), TemporalMap(3, 3, "R")])
+    assert first == second
+    assert conv([TemporalMap(8, 8, "C"), TemporalMap(Sz("R"), 1, "Y")]) != conv([TemporalMap(Sz("R"), 1, "Y"), TemporalMap(8, 8, "C")])
+    # but not across clusters
+    assert conv([TemporalMap(3, 3, "R"), Cluster(4), TemporalMap(3, 3, "S")]) != conv([TemporalMap(3, 3, "S"), Cluster(4), TemporalMap(3, 3, "R")])
+    # the kind of map matters
+    assert conv([SpatialMap(1, 1, "K")]) != conv([TemporalMap(1, 1, "K")])
+
+
+def test_accelerator_mapping():
+    acc = NVDLA("acc", num_pes=256)
+    mapping = acc.get_mapping(56, 56, 56, 56, 64, 16, 3, 3, 1, 1)
+    assert mapping == acc.get_dataflow(56, 56, 56, 56, 64, 16, 3, 3, 1, 1).canonical().render()
+    # an equivalent hand-written dataflow shares the cache entry
+    directives = [SpatialMap(1, 1, "K"), TemporalMap(16, 16, "C"), TemporalMap(3, 1, "Y"), TemporalMap(3, 1, "X"),
+                  TemporalMap(3, 3, "S"), TemporalMap(3, 3, "R"), Cluster(64), SpatialMap(1, 1, "C"),
+                  TemporalMap(3, 1, "Y"), TemporalMap(3, 1, "X"), TemporalMap(3, 3, "R"), TemporalMap(3, 3, "S")]
+    other = Dataflow.conv2d(56, 56, 64, 16, 3, 3, 1, 1, directives).canonical().render()
+    assert acc._store_key("conv", mapping) == acc._store_key("conv", other)
+    tpu = GemmTPU("tpu", num_pes=256)
+    mapping = tpu.get_mapping(64, 256, 16)
+    assert "Dimensions { K: 16, M: 64, N: 256 }" in mapping
+    assert "SpatialMap(1,1) M;" in mapping and "Cluster(128,P);" in mapping
+    assert tpu.get_dataflow(64, 256, 16) == tpu.get_dataflow(64, 256, 16)
+
+
+def test_tuner():
+    args = (56, 56, 56, 56, 64, 256, 3, 3, 1, 1)
+    AcceleratorBase.compute_cache = {}
+    acc = NVDLA("acc", num_pes=1024, l2_size=200000)
+    assert acc.tuning_space()["cluster"] == [8, 16, 32, 64, 128, 256, 512, 1024]
+
+    # analytical: the best estimate is used
+    tuner = DataflowTuner()
+    acc.set_cost_model("analytical")
+    acc.set_tuner(tuner)
+    hardware = acc.hardware_params()
+    best = min(acc.tuning_space()["cluster"], key=lambda c: acc.analytical_cost(hardware, *args, cluster=c)[0])
+    assert tuner.best_params(acc, "conv", args) == {"cluster": best}
+    runtime, _ = acc.evaluate_compute(*args)
+    assert runtime == acc.analytical_cost(hardware, *args, cluster=best)[0] / acc.freq
+    assert runtime <= acc.query_analytical("conv", args)[0]
+
+    # MAESTRO: candidates within the slack are evaluated in one batch
+    tuner = DataflowTuner(top_k=8, slack=1e9)
+    pool = ClusterPool()
+    acc.set_cost_model("maestro")
+    acc.set_tuner(tuner)
+    assert tuner.tune(acc, [("conv", args), ("conv", args)], pool) == 8
+    # clusters above 128 need more than 200000 bytes of L2
+    assert tuner.best_params(acc, "conv", args) == {"cluster": 128}
+    assert "Cluster(128,P);" in tuner.best_mapping(acc, "conv", args)
+    runtime, _ = acc.evaluate_compute(*args)
+    assert runtime == (100000 // 128) / acc.freq
+    assert len(pool.jobs) == 8
+    # the PE usage follows the tuned cluster
+    assert acc.spatial_used_pes(*args) == min(64 * 128, acc.num_pes)
+    tuner.best[acc._compute_cache_key("conv", args)] = ({"cluster": 8}, 1, 1)
+    assert acc.spatial_used_pes(*args) == 64 * 8
+
+    # a warm cache rejects the same candidates
+    with tempfile.TemporaryDirectory() as dir:
+        AcceleratorBase.eval_cache = EvaluationCache(os.path.join(dir, "cache.db"))
+        AcceleratorBase.compute_cache = {}
+        acc.set_tuner(DataflowTuner(top_k=8, slack=1e9))
+        assert acc.tuner.tune(acc, [("conv", args)], ClusterPool()) == 8
+        tuner = DataflowTuner(top_k=8, slack=1e9)
+        acc.set_tuner(tuner)
+        pool = ClusterPool()
+        assert tuner.tune(acc, [("conv", args)], pool) == 0 and not len(pool.jobs)
+        assert tuner.best_params(acc, "conv", args) == {"cluster": 128}
+        AcceleratorBase.eval_cache.close()
+        AcceleratorBase.eval_cache = None
+
+    # nothing fits, fall back to the fixed dataflow
+    tuner = DataflowTuner(top_k=2, slack=1e9)
+    tuner.best[acc._compute_cache_key("conv", args)] = (None, 0, 0)
+    acc.set_tuner(tuner)
+    acc.set_cost_model("analytical")
+    assert acc.evaluate_compute(*args) == acc.query_analytical("conv", args)
+    acc.set_tuner(None)
+    AcceleratorBase.compute_cache = {}
+
+
+if __name__ == "__main__":
+    test_render()
+    test_canonical_form()
+    test_accelerator_mapping()
+    test_tuner()
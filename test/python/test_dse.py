@@ -0,0 +1,81 @@
+import numpy as np
+from domino.base import AcceleratorBase, AccTask
+from domino.accelerator import NVDLA, HardwareDSE, ParetoFrontier, design_space, compute_area
+from domino.accelerator.dse import MAC_ENERGY
+from domino.accelerator.analytical import PE_POWER
+
+
+def make_tasks():
+    tasks = []
+    for i, (K, C) in enumerate([(64, 64), (128, 64), (64, 64), (256, 128)]):
+        params = {"H": 58, "W": 58, "P": 56, "Q": 56, "K": K, "C": C, "R": 3, "S": 3, "stride_h": 1, "stride_w": 1}
+        tasks.append(AccTask(f"conv{i}", "Conv2d", params))
+    tasks.append(AccTask("gemm", "Gemm", {"B": 1, "M": 64, "N": 64, "K": 64}))
+    return tasks
+
+
+def test_compute_area():
+    assert np.isclose(compute_area(256, 100, 1000, "888"), 256 * 282 + (100 * 256 + 1000) * 0.086 * 8)
+    areas = compute_area(np.array([256, 1024]), np.array([100, 100]), np.array([1000, 1000]), np.array(["888", "444"]))
+    assert areas.shape == (2,)
+    assert np.isclose(areas[0], compute_area(256, 100, 1000, "888"))
+    assert np.isclose(areas[1], compute_area(1024, 100, 1000, "444"))
+
+
+def test_pareto_frontier():
+    frontier = ParetoFrontier(2)
+    assert frontier.add("a", [3, 3])
+    assert frontier.add("b", [1, 5])
+    assert not frontier.add("c", [4, 4])
+    assert frontier.add("d", [2, 2])
+    assert sorted(frontier.ids) == ["b", "d"]
+    assert frontier.dominated(np.array([2, 2])) and not frontier.dominated(np.array([2, 2]), strict=True)
+    assert not frontier.dominated(np.array([0, 10]))
+
+
+def test_hardware_dse():
+    AcceleratorBase.compute_cache = {}
+    AcceleratorBase.set_default_cost_model("analytical")
+    space = design_space(num_pes=[256, 1024, 4096], l1_size=[1000, 4000], l2_size=[100000, 1000000],
+                         precision=["888", "448"])
+    tasks = make_tasks()
+    dse = HardwareDSE(NVDLA, tasks, objectives=("latency", "area"))
+    # the Gemm isn't supported, the repeated conv is counted twice
+    assert len(dse.shapes) == 3 and list(dse.counts) == [2, 1, 1]
+    front = dse.explore(space)
+    assert dse.num_pruned > 0 and len(dse.results) + dse.num_pruned == 24
+
+    # same frontier as evaluating everything
+    full = HardwareDSE(NVDLA, tasks, objectives=("latency", "area"), prune=False)
+    assert [point for point, _ in full.explore(space)] == [point for point, _ in front]
+    latencies = [values["latency"] for _, values in front]
+    areas = [values["area"] for _, values in front]
+    assert latencies == sorted(latencies) and areas == sorted(areas, reverse=True)
+    for point, values in front:
+        acc = NVDLA("check", num_pes=point["num_pes"], l1_size=point["l1_size"], l2_size=point["l2_size"])
+        latency = sum(acc.evaluate_compute(*task.get_params())[0] for task in tasks if task.task_kind == "Conv2d")
+        assert np.isclose(values["latency"], latency)
+        assert point["precision"] == "448"
+
+    # the energy bound prunes the three objectives too
+    dse = HardwareDSE(NVDLA, tasks)
+    front = dse.explore(space)
+    assert dse.num_pruned > 0 and len(dse.results) + dse.num_pruned == 24
+    full = HardwareDSE(NVDLA, tasks, prune=False)
+    assert [point for point, _ in full.explore(space)] == [point for point, _ in front]
+    macs = 2 * 56 * 56 * 64 * 64 * 9 + 56 * 56 * 128 * 64 * 9 + 56 * 56 * 256 * 128 * 9
+    for point, values in full.results:
+        bound = macs * MAC_ENERGY[point["precision"]] * PE_POWER / NVDLA("check").freq
+        assert bound <= values["energy"]
+    # no bound with MAESTRO unless the energy of a MAC is given
+    AcceleratorBase.set_default_cost_model("maestro")
+    assert HardwareDSE(NVDLA, tasks)._mac_energy(NVDLA("check")) == 0
+    assert HardwareDSE(NVDLA, tasks, mac_energy=1e-12)._mac_energy(NVDLA("check")) == 1e-12
+    AcceleratorBase.set_default_cost_model("maestro")
+    AcceleratorBase.compute_cache = {}
+
+
+if __name__ == "__main__":
+    test_compute_area()
+    test_pareto_frontier()
+    test_hardware_dse()
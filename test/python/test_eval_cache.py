@@ -0,0 +1,229 @@
+import os
+import tempfile
+import numpy as np
+from collections import namedtuple
+from domino.base import AcceleratorBase, AccTask, EvaluationCache, SurrogateModel
+from domino.accelerator import NVDLA, GemmTPU, DepthwiseShiDianNao, calibrate
+from domino.utils import MaestroResults, pack_network, split_results, parse_maestro_csv
+
+
+FakeResults = namedtuple("FakeResults", ["runtime", "power"])
+
+
+class CountingNVDLA(NVDLA):
+    """NVDLA whose MAESTRO run is replaced by a closed-form cost"""
+    num_runs = 0
+
+    def run_mapping(self, kind, mapping_contents):
+        CountingNVDLA.num_runs += 1
+        return FakeResults(np.array([len(mapping_contents) * self.num_pes]), np.array([1.5]))
+
+
+class FakePool(object):
+    """Pool that evaluates MaestroJobs with the same closed-form cost"""
+
+    def __init__(self):
+        self.jobs = []
+
+    def evaluate_many(self, jobs):
+        self.jobs.extend(jobs)
+        return [FakeResults(np.array([len(job.mapping_contents) * job.num_pes]), np.array([1.5])) for job in jobs]
+
+
+def test_cache_key():
+    hw = {"num_pes": 256, "l1_size": 100}
+    key = EvaluationCache.make_key("conv", "mapping", hw)
+    assert key == EvaluationCache.make_key("conv", "mapping", dict(reversed(list(hw.items()))))
+    assert key != EvaluationCache.make_key("conv", "mapping", {"num_pes": 512, "l1_size": 100})
+    assert key != EvaluationCache.make_key("conv", "mapping2", hw)
+
+
+def test_cache_store():
+    with tempfile.TemporaryDirectory() as dir:
+        path = os.path.join(dir, "cache.db")
+        cache = EvaluationCache(path, max_entries=10)
+        for i in range(3 * EvaluationCache.EVICT_INTERVAL):
+            cache.put(f"key{i}", i, 1.0, kind="conv", accelerator="NVDLA", args=(i,), hardware={"num_pes": 256})
+        cache.flush()
+        assert len(cache) == 10
+        assert cache.get("key0") is None
+        last = 3 * EvaluationCache.EVICT_INTERVAL - 1
+        assert cache.get(f"key{last}") == (last, 1.0)
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+        # another connection sees the same entries
+        other = EvaluationCache(path)
+        records = other.records(kind="conv")
+        assert len(records) == 10
+        assert records[0]["hardware"] == {"num_pes": 256}
+        other.close()
+        cache.close()
+
+
+def test_accelerator_cache():
+    with tempfile.TemporaryDirectory() as dir:
+        AcceleratorBase.compute_cache = {}
+        AcceleratorBase.load_cache(dir)
+        args = (56, 56, 56, 56, 64, 64, 3, 3, 1, 1)
+        small = CountingNVDLA("small", num_pes=256)
+        large = CountingNVDLA("large", num_pes=1024)
+        other = CountingNVDLA("other", num_pes=1024)
+        CountingNVDLA.num_runs = 0
+        runtime, power = large.evaluate_compute(*args)
+        assert other.evaluate_compute(*args) == (runtime, power)
+        assert CountingNVDLA.num_runs == 1
+
+        # a fresh process only has the persistent cache
+        AcceleratorBase.compute_cache = {}
+        assert large.evaluate_compute(*args) == (runtime, power)
+        assert CountingNVDLA.num_runs == 1
+        assert AcceleratorBase.eval_cache.stats()["hits"] == 1
+
+        # different hardware never hits the same entry
+        assert small.evaluate_compute(*args)[0] == runtime / 4
+        assert CountingNVDLA.num_runs == 2
+        AcceleratorBase.store_cache(dir)
+        # the cache isn't written anywhere else
+        try:
+            AcceleratorBase.store_cache(os.path.join(dir, "other"))
+            assert False
+        except AssertionError as e:
+            assert "not in" in str(e)
+        AcceleratorBase.eval_cache.close()
+        AcceleratorBase.eval_cache = None
+
+
+def test_prefetch():
+    AcceleratorBase.compute_cache = {}
+    acc = CountingNVDLA("acc", num_pes=512)
+    tasks = []
+    for i in range(6):
+        params = {"H": 16, "W": 16, "P": 16, "Q": 16, "K": 16 * (1 + i % 3), "C": 16,
+                  "R": 3, "S": 3, "stride_h": 1, "stride_w": 1}
+        tasks.append(AccTask(f"T{i}", "Conv2d", params, []))
+    pool = FakePool()
+    assert acc.prefetch(tasks, pool) == 3
+    assert len(pool.jobs) == 3 and pool.jobs[0].num_pes == 512
+    CountingNVDLA.num_runs = 0
+    for task in tasks:
+        runtime, power = acc.evaluate_compute(*task.get_params())
+        assert runtime > 0 and power == 1.5
+    assert CountingNVDLA.num_runs == 0
+    assert acc.prefetch(tasks, pool) == 0
+    AcceleratorBase.compute_cache = {}
+
+
+def test_analytical_cost_model():
+    args = (56, 56, 56, 56, 64, 64, 3, 3, 1, 1)
+    small = NVDLA("small", num_pes=256)
+    large = NVDLA("large", num_pes=1024)
+    small.set_cost_model("analytical")
+    large.set_cost_model("analytical")
+    assert small.evaluate_compute(*args)[0] > large.evaluate_compute(*args)[0] > 0
+    AcceleratorBase.set_default_cost_model("analytical")
+    gemm = GemmTPU("tpu")
+    assert gemm.evaluate_compute(4, 128, 256, 512)[0] == 4 * gemm.evaluate_compute(128, 256, 512)[0]
+    assert DepthwiseShiDianNao("dw").evaluate_compute(*args)[0] > 0
+    AcceleratorBase.set_default_cost_model("maestro")
+
+    # calibrate against MAESTRO records
+    hardware = large.hardware_params()
+    runtime, power = NVDLA.analytical_cost(hardware, *args)
+    records = [{"kind": "conv", "accelerator": "NVDLA", "args": args, "hardware": hardware,
+                "runtime": 2 * runtime, "power": 3 * power}]
+    factors = calibrate([large], records)
+    assert np.allclose(factors[("NVDLA", "conv")], (2, 3))
+    assert np.isclose(large.evaluate_compute(*args)[0], 2 * runtime / large.freq)
+    AcceleratorBase.calibration = {}
+
+
+def test_surrogate():
+    model = SurrogateModel(k=4, threshold=0.5, min_points=4)
+    key = SurrogateModel.make_key("NVDLA", "gemm", {"num_pes": 256})
+    for M in [64, 128, 256, 512, 1024]:
+        model.add(key, (M, 64, 64), M * 100, 2.0)
+    runtime, power, confidence = model.predict(key, (256, 64, 64))
+    assert (runtime, power, confidence) == (25600, 2.0, 1.0)
+    runtime, power, confidence = model.predict(key, (300, 64, 64))
+    assert 12800 < runtime < 51200 and np.isclose(power, 2.0) and 0.5 < confidence < 1
+    assert model.query(key, (300, 64, 64)) is not None
+    assert model.query(key, (8, 4096, 4096)) is None
+    assert model.predict(SurrogateModel.make_key("NVDLA", "conv", {"num_pes": 256}), (1, 1, 1)) is None
+    # a tuned record has more args, it is not compared with the others
+    model.add(key, (300, 64, 64, 128), 100, 2.0)
+    assert model.predict(key, (300, 64, 64))[0] == runtime
+    assert model.predict(key, (300, 64, 64, 64)) is None
+
+    # below the threshold the accelerator runs MAESTRO and learns the point
+    AcceleratorBase.compute_cache = {}
+    AcceleratorBase.surrogate = SurrogateModel(min_points=2)
+    acc = CountingNVDLA("acc", num_pes=512)
+    acc.set_cost_model("surrogate")
+    args = (56, 56, 56, 56, 64, 64, 3, 3, 1, 1)
+    CountingNVDLA.num_runs = 0
+    runtime, _ = acc.evaluate_compute(*args)
+    assert CountingNVDLA.num_runs == 1 and len(AcceleratorBase.surrogate) == 1
+    larger, _ = acc.evaluate_compute(*args[:4], 128, 64, 3, 3, 1, 1)
+    assert CountingNVDLA.num_runs == 2
+    AcceleratorBase.compute_cache = {}
+    assert acc.evaluate_compute(*args)[0] == runtime
+    assert runtime < acc.evaluate_compute(*args[:4], 96, 64, 3, 3, 1, 1)[0] < larger
+    assert CountingNVDLA.num_runs == 2
+    AcceleratorBase.compute_cache = {}
+    AcceleratorBase.surrogate = None
+
+
+def test_pack_network():
+    acc = NVDLA("acc", num_pes=256)
+    first = acc.get_mapping(56, 56, 56, 56, 64, 64, 3, 3, 1, 1)
+    second = acc.get_mapping(28, 28, 28, 28, 128, 64, 1, 1, 1, 1)
+    network = pack_network([first, second])
+    assert network.count("Network") == 1
+    assert "Layer L0 {" in network and "Layer L1 {" in network
+    assert network.index("Layer L0") < network.index("Layer L1")
+
+    results = MaestroResults(*[np.array([i, 10 * i]) for i in range(len(MaestroResults._fields))])
+    first, second = split_results(results, 2)
+    assert first.runtime[0] == 0 and second.runtime[0] == 0
+    assert first.power[0] == 5 and second.power[0] == 50
+    assert len(second.mac) == 1
+
+
+def test_parse_maestro_csv():
+    header = ["Neural Network Name", " Layer Number", " Num MACs", " Runtime (Cycles)", " Activity count-based Energy (nJ)",
+              " Throughput (MACs/Cycle)", " Area", " Power", " L1 SRAM Size Req (Bytes)", "  L2 SRAM Size Req (Bytes)",
+              " input l1 read", " input l1 write", "filter l1 read", " filter l1 write", "output l1 read", " output l1 write",
+              " input l2 read", " input l2 write", " filter l2 read", " filter l2 write", " output l2 read", " output l2 write"]
+    rows = [["sample_net", " L0"] + [str(i) for i in range(2, len(header))],
+            ["sample_net", " L1"] + [str(10 * i) for i in range(2, len(header))]]
+    contents = "\n".join(",".join(row) for row in [header] + rows) + "\n"
+    results = parse_maestro_csv(contents)
+    assert list(results.mac) == [2, 20] and list(results.runtime) == [3, 30]
+    assert list(results.runtime_series) == [3, 30]
+    assert list(results.power) == [7, 70] and list(results.l2_size) == [9, 90]
+    assert list(results.l1_weight_read) == [12, 120] and list(results.l2_output_write) == [21, 210]
+    # the rows of a network are matched by layer name
+    contents = "\n".join(",".join(row) for row in [header] + rows[::-1]) + "\n"
+    results = parse_maestro_csv(contents, ["L0", "L1"])
+    assert list(results.runtime) == [3, 30]
+    try:
+        parse_maestro_csv(contents, ["L0", "L2"])
+        assert False
+    except ValueError:
+        pass
+    try:
+        parse_maestro_csv("a,b\n1,2\n")
+        assert False
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_cache_key()
+    test_cache_store()
+    test_accelerator_cache()
+    test_prefetch()
+    test_analytical_cost_model()
+    test_surrogate()
+    test_pack_network()
+    test_parse_maestro_csv()
@@ -6,6 +6,9 @@ from domino import utils
 from domino.graph_ir import Op, Tensor, Graph
 from domino.graph_pass import set_graph_precision, GraphPrinter, GraphVisitor
 from domino.utils import ONNXConvertor
+from domino.accelerator.dse import compute_area
+from domino.accelerator.dataflow import (Dataflow, channel_parallel_conv_directives, output_parallel_conv_directives,
+                                         output_parallel_depthwise_directives, systolic_gemm_directives)
 
 
 def get_precision_configs(path: str):
@@ -42,54 +45,10 @@ def get_graph(path: str):
 conv2d_mapping_templates = {
     "TPU":
         lambda H, W, P, Q, K, C, R, S, stride_h, stride_w:
-            ("Network sample_net {\n"
-             "Layer Conv2d {\n"
-             "Type: CONV\n"
-             "Stride { "
-             f"X: {stride_h}, Y: {stride_w} "
-             "}\n"
-             "Dimensions { "
-             f"K: {K}, C: {C}, R: {R}, S: {S}, Y: {H}, X: {W} "
-             "}\n"
-             "Dataflow {\n"
-             "        SpatialMap(1,1) K;\n"
-             "        TemporalMap(256,256) C;\n"
-             "        TemporalMap(Sz(R),Sz(R)) R;\n"
-             "        TemporalMap(Sz(S),Sz(S)) S;\n"
-             "        TemporalMap(Sz(R),1) Y;\n"
-             "        TemporalMap(Sz(S),1) X;\n"
-             "        Cluster(256, P);\n"
-             "        SpatialMap(1,1) C;\n"
-             "        TemporalMap(Sz(R),1) Y;\n"
-             "        TemporalMap(Sz(S),1) X;\n"
-             "        TemporalMap(Sz(R),Sz(R)) R;\n"
-             "        TemporalMap(Sz(S),Sz(S)) S;\n"
-             "}\n"
-             "}\n"
-             "}\n"),
+            Dataflow.conv2d(H, W, K, C, R, S, stride_h, stride_w, channel_parallel_conv_directives(256)).canonical().render(),
     "ShiDianNao":
         lambda H, W, P, Q, K, C, R, S, stride_h, stride_w:
-            ("Network sample_net {\n"
-             "Layer Conv2d {\n"
-             "Type: CONV\n"
-             "Stride { "
-             f"X: {stride_h}, Y: {stride_w} "
-             "}\n"
-             "Dimensions { "
-             f"K: {K}, C: {C}, R: {R}, S: {S}, Y: {H}, X: {W} "
-             "}\n"
-             "Dataflow {\n"
-             "        TemporalMap(1,1) K;\n"
-             "        TemporalMap(1,1) C;\n"
-             "        SpatialMap(Sz(R), 1) Y;\n"
-             "        TemporalMap(256,256) X;\n"
-             "        TemporalMap(Sz(R), Sz(R)) R;\n"
-             "        TemporalMap(Sz(S), Sz(S)) S;\n"
-             "        Cluster(256, P);\n"
-             "        SpatialMap(Sz(S), 1) X;\n"
-             "}\n"
-             "}\n"
-             "}\n"),
+            Dataflow.conv2d(H, W, K, C, R, S, stride_h, stride_w, output_parallel_conv_directives(256)).canonical().render(),
     # "Eyeriss":
     #     lambda H, W, P, Q, K, C, R, S, stride_h, stride_w:
     #         ("Network sample_net {\n"
@@ -145,49 +104,14 @@ conv2d_mapping_templates = {
 depthwise_conv2d_mapping_templates = {
     "ShiDianNao":
         lambda H, W, P, Q, K, M, R, S, stride_h, stride_w:
-            ("Network sample_net {\n"
-             "Layer DepthwiseConv2d {\n"
-             "Type: DSCONV\n"
-             "Stride { "
-             f"X: {stride_h}, Y: {stride_w} "
-             "}\n"
-             "Dimensions { "
-             f"K: {M}, C: {K}, R: {R}, S: {S}, Y: {H}, X: {W} "
-             "}\n"
-             "Dataflow {\n"
-             "        TemporalMap(1,1) C;\n"
-             "        SpatialMap(Sz(R), 1) Y;\n"
-             "        TemporalMap(256,256) X;\n"
-             "        TemporalMap(Sz(R), Sz(R)) R;\n"
-             "        TemporalMap(Sz(S), Sz(S)) S;\n"
-             "        Cluster(256, P);\n"
-             "        SpatialMap(Sz(S), 1) X;\n"
-             "}\n"
-             "}\n"
-             "}\n")
+            Dataflow.depthwise_conv2d(H, W, K, M, R, S, stride_h, stride_w, output_parallel_depthwise_directives(256)).canonical().render()
 }
 
 
 gemm_mapping_templates = {
     "TPU":
         lambda M, N, K:
-            ("Network sample_net {\n"
-             "Layer GEMM {\n"
-             "Type: GEMM\n"
-             "Dimensions { "
-             f"K: {K}, M: {M}, N: {N} "
-             "}\n"
-             "Dataflow {\n"
-             "        SpatialMap(1, 1) M;\n"
-             "        TemporalMap(256, 256) N;\n"
-             "        TemporalMap(16, 16) K;\n"
-             "        Cluster(256, P);\n"
-             "        SpatialMap(1, 1) N;\n"
-             "        TemporalMap(1, 1) M;\n"
-             "        TemporalMap(16, 16) K;\n"
-             "}\n"
-             "}\n"
-             "}\n")
+            Dataflow.gemm(M, N, K, systolic_gemm_directives(256)).canonical().render()
 }
 
 
@@ -195,23 +119,8 @@ MAX_BW = 81920000
 
 
 def compute_area_external(num_pe, l1_size, l2_size, precision):
-    """return um^2"""
-    alpha = 2.3141918
-    TABLE = {
-        "444": 282/alpha/alpha/alpha,
-        "448": 282/alpha/alpha,
-        "484": 282/alpha/alpha,
-        "488": 282/alpha,
-        "884": 282/alpha,
-        "888": 282
-    }
-    # MAC_AREA_INT8=282
-    # MAC_AREA_INT32=3495
-    MAC_AREA = TABLE[precision]
-    BUF_AREA_perbit = 0.086
-    buf_size = l1_size * num_pe + l2_size
-    area = num_pe * MAC_AREA + buf_size * BUF_AREA_perbit * 8
-    return area
+    """return um^2, the params can also be arrays of design points"""
+    return compute_area(num_pe, l1_size, l2_size, precision)
 
 
 class LayerwiseDataflowMapping(GraphVisitor):
@@ -0,0 +1,78 @@
+import tempfile
+import numpy as np
+from domino.utils import MaestroResults, ResultsStore
+
+
+def make_results(runtime, energy):
+    values = {field: np.array([1.0]) for field in MaestroResults._fields}
+    values["runtime"] = np.array([runtime])
+    values["energy"] = np.array([energy])
+    return MaestroResults(**values)
+
+
+def fill(store, num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(num_rows):
+        accelerator = ["NVDLA", "GemmTPU"][i % 2]
+        kind = "conv" if accelerator == "NVDLA" else "gemm"
+        args = (56, 56, 56, 56, 64, int(rng.integers(1, 5)) * 16, 3, 3, 1, 1) if kind == "conv" else (64, 64, int(rng.integers(1, 5)) * 16)
+        hardware = {"freq": 2e8, "num_pes": [256, 1024][i % 4 // 2], "noc_bw": 1e3, "off_chip_bw": 1e3, "l1_size": 1e3, "l2_size": 1e6}
+        rows.append((accelerator, kind, args, hardware, make_results(float(rng.integers(1, 1000)), float(rng.integers(1, 1000)))))
+    store.append_many(rows)
+    return rows
+
+
+def test_append_and_reopen():
+    with tempfile.TemporaryDirectory() as dir:
+        store = ResultsStore(dir, initial_capacity=4)
+        rows = fill(store, 37)
+        store.append("NVDLA", "conv", (1, 2, 3), {"num_pes": 16}, make_results(5, 6))
+        assert len(store) == 38 and store.capacity == 64
+        assert list(store.column("runtime")[:37]) == [row[4].runtime[0] for row in rows]
+        assert list(store.column("args")[37][:4]) == [1, 2, 3, -1]
+        assert np.isnan(store.column("freq")[37])
+        store.close()
+
+        store = ResultsStore(dir)
+        assert len(store) == 38
+        assert store.select(["accelerator", "kind"], arg0=1)["accelerator"].tolist() == ["NVDLA"]
+        fill(store, 40, seed=1)
+        assert len(store) == 78 and store.capacity == 128
+        assert store.column("runtime")[37] == 5
+        store.close()
+
+
+def test_queries():
+    with tempfile.TemporaryDirectory() as dir:
+        with ResultsStore(dir) as store:
+            rows = fill(store, 200)
+            runtime = np.array([row[4].runtime[0] for row in rows])
+            energy = np.array([row[4].energy[0] for row in rows])
+            is_tpu = np.array([row[0] == "GemmTPU" for row in rows])
+
+            mask = store.mask(accelerator="GemmTPU", runtime=(100, 500))
+            assert (mask == (is_tpu & (runtime >= 100) & (runtime <= 500))).all()
+            assert store.mask(accelerator="Unknown").sum() == 0
+            assert store.mask(num_pes=[256]).sum() == 100
+
+            keys, reduced = store.group_by("accelerator", "runtime", reduce="min")
+            assert sorted(zip(keys["accelerator"], reduced)) == [("GemmTPU", runtime[is_tpu].min()), ("NVDLA", runtime[~is_tpu].min())]
+            keys, counts = store.group_by(["accelerator", "num_pes"], "runtime", reduce="count")
+            assert len(counts) == 4 and counts.sum() == 200
+            keys, reduced = store.group_by("args", "runtime", reduce="mean", mask=store.mask(kind="gemm"))
+            assert keys["args"].shape == (len(reduced), 12)
+
+            front = store.pareto(["runtime", "energy"])
+            dominated = [i for i in range(200) if ((runtime <= runtime[i]) & (energy <= energy[i]) &
+                                                   ((runtime < runtime[i]) | (energy < energy[i]))).any()]
+            assert sorted(front.tolist()) == sorted(set(range(200)) - set(dominated) - set(
+                i for i in range(200) for j in range(i) if runtime[i] == runtime[j] and energy[i] == energy[j]))
+            points = np.stack([runtime, energy, store.column("num_pes")], axis=1)
+            for i in store.pareto(["runtime", "energy", "num_pes"]):
+                assert not ((points <= points[i]).all(axis=1) & (points < points[i]).any(axis=1)).any()
+
+
+if __name__ == "__main__":
+    test_append_and_reopen()
+    test_queries()